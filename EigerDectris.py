@@ -52,6 +52,7 @@ import sys
 #----- PROTECTED REGION ID(EigerDectris.additionnal_import) ENABLED START -----#
 
 from dectris_eiger.eiger import EigerDetector
+from dectris_eiger.communication import DeadlineExceeded
 import json
 
 try:
@@ -727,9 +728,17 @@ class EigerDectris (PyTango.Device_4Impl):
             try:
                 self.flag_arm = 1
                 self.det.arm(timeout=0.1)
-                self.attr_MustArmFlag_read = 0
-            except:
-                pass
+            except DeadlineExceeded as e:
+                # arming takes longer than the timeout, the command is not
+                # waited for once the DCU accepted it
+                if not e.reached:
+                    self.flag_arm = 0
+                    raise
+            except Exception:
+                # the detector was not armed and still has to be
+                self.flag_arm = 0
+                raise
+            self.attr_MustArmFlag_read = 0
             
         #----- PROTECTED REGION END -----#	//	EigerDectris.Arm
         
@@ -753,8 +762,11 @@ class EigerDectris (PyTango.Device_4Impl):
                 self.det.trigger(timeout=1.5, input_value = self.attr_CountTimeInte_read)
             else:
                 self.det.trigger(timeout=1.5)
-        except:
-            pass
+        except DeadlineExceeded as e:
+            # the trigger returns only at the end of the series, it is not
+            # waited for once the DCU accepted it
+            if not e.reached:
+                raise
 
         #----- PROTECTED REGION END -----#	//	EigerDectris.Trigger
         
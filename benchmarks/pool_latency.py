@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the per-call latency of ``get_value`` with a pooled
+:py:class:`dectris_eiger.communication.EigerClient` against one new
+connection per call, using a local stand-in for the DCU's web server.
+
+Usage::
+
+  python benchmarks/pool_latency.py [ncalls]
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dectris_eiger.communication import EigerClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({"value": 0.1, "value_type": "float"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * len(values))))]
+
+
+def measure(call, ncalls):
+    latencies = []
+    for _ in range(ncalls):
+        t0 = time.time()
+        call()
+        latencies.append(time.time() - t0)
+    return latencies
+
+
+def main(ncalls=2000):
+    server = StandInServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = server.server_address[1]
+
+    client = EigerClient("127.0.0.1", port, warm_up=True)
+    url = client.api_url("1.0.0", "detector", "config", "count_time")
+
+    def unpooled():
+        json.loads(requests.get(url, timeout=2).text)["value"]
+
+    def pooled():
+        client.get_value("1.0.0", "detector", "config", "count_time")
+
+    for name, call in [("new connection per call", unpooled),
+                       ("pooled EigerClient", pooled)]:
+        latencies = measure(call, ncalls)
+        print("{0:<26} mean {1:7.3f} ms  p50 {2:7.3f} ms  "
+              "p99 {3:7.3f} ms".format(
+                  name, 1e3 * sum(latencies) / len(latencies),
+                  1e3 * percentile(latencies, 50),
+                  1e3 * percentile(latencies, 99)))
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,1435 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: aio
+   :synopsis: This module contains asyncio versions of the detector, file
+              writer, monitor and data buffer interfaces. Every getter,
+              setter and command is a coroutine, so many detectors and
+              transfers can be driven from one event loop.
+
+Getters are also available as read-only properties which return awaitables::
+
+  async with AsyncEigerDetector("eiger.local") as det:
+      await det.set_count_time(0.1)
+      state, files = await asyncio.gather(det.state, det.buffer.files)
+
+This module requires Python 3 and the ``aiohttp`` package.
+"""
+import asyncio
+import fnmatch
+import json
+import os
+import time
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .buffer import (DELETE_WORKERS, DOWNLOAD_CHUNK_SIZE, DataBufferError,
+                     DeleteError, DeleteReport, DownloadError,
+                     DownloadReport, UnknownDataFileError)
+from .communication import (DEFAULT_POLICY, DEFAULT_POOL_SIZE,
+                            CircuitBreaker, CommunicationError,
+                            ConnectionFailed, DeadlineExceeded, EigerEndpoint,
+                            ParameterSet, ResponseError, split_key)
+from .eiger import SNAPSHOT_KEYS
+
+
+class AsyncEigerClient(EigerEndpoint):
+    """
+    asyncio counterpart of :py:class:`dectris_eiger.communication.EigerClient`.
+    All requests share one ``aiohttp.ClientSession`` with a pool of at most
+    *pool_size* connections to the DCU.
+
+    Like the synchronous client, calls are timed and repeated according to
+    *policy* (a :py:class:`dectris_eiger.communication.RetryPolicy`), pass a
+    :py:class:`dectris_eiger.communication.CircuitBreaker` (*data_breaker*
+    for requests to the data buffer) and raise a
+    :py:class:`dectris_eiger.communication.CommunicationError` on failure.
+    At most *max_transfers* file transfers (default: all but two of
+    *pool_size*) run at the same time; transfers wait for one of the
+    *transfer_slots*.
+    """
+
+    def __init__(self, host, port=80, pool_size=DEFAULT_POOL_SIZE,
+                 keep_alive=True, policy=DEFAULT_POLICY, breaker=None,
+                 max_transfers=None, data_breaker=None):
+        if aiohttp is None:
+            raise ImportError("The asyncio client requires aiohttp.")
+        super(AsyncEigerClient, self).__init__(host, port)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.policy = policy
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.data_breaker = data_breaker if data_breaker is not None \
+            else CircuitBreaker()
+        if max_transfers is None:
+            max_transfers = max(1, pool_size - 2)
+        self.max_transfers = max_transfers
+        self._session = None
+        self._transfer_slots = None
+        self._data_prefix = self.data_url("")
+
+    @property
+    def session(self):
+        """
+        The ``aiohttp.ClientSession``, created on first use inside the
+        running event loop.
+        """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                             force_close=not self.keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @property
+    def transfer_slots(self):
+        """
+        ``asyncio.Semaphore`` of the *max_transfers* concurrent file
+        transfers, created on first use inside the running event loop.
+        """
+        if self._transfer_slots is None:
+            self._transfer_slots = asyncio.Semaphore(self.max_transfers)
+        return self._transfer_slots
+
+    async def request(self, method, url, timeout=None, idempotent=True,
+                      policy=None, stream=False, **kwargs):
+        """
+        Sends a request to the DCU according to the retry policy. See
+        :py:meth:`dectris_eiger.communication.EigerClient.request`; the
+        response is returned as ``requests.Response`` with its body read.
+
+        With *stream* set, the ``aiohttp.ClientResponse`` is returned as
+        soon as its headers arrived (unless it is a server error) and the
+        caller reads and releases it. *timeout* then limits the whole
+        transfer including the body; each read of the body waits at most
+        the policy's *attempt_timeout*.
+
+        :raises dectris_eiger.communication.CommunicationError: if the call
+                                                                 fails
+        """
+        if policy is None:
+            policy = self.policy
+        limits = [t for t in (timeout, policy.deadline) if t is not None]
+        deadline = time.time() + min(limits) if limits else None
+        # failing transfers must not block commands and vice versa
+        breaker = self.data_breaker if url.startswith(self._data_prefix) \
+            else self.breaker
+        breaker.before()
+        try:
+            response = await self._attempts(method, url, deadline,
+                                            idempotent, policy, stream,
+                                            **kwargs)
+        except CommunicationError:
+            # timeouts included: a DCU which does not answer in time is
+            # down as far as the caller can tell
+            breaker.failure()
+            raise
+        breaker.success()
+        return response
+
+    async def _attempts(self, method, url, deadline, idempotent, policy,
+                        stream=False, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            attempt_timeout = policy.attempt_timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise DeadlineExceeded("{0} {1}: deadline exceeded".format(
+                        method, url))
+                if attempt_timeout is None or attempt_timeout > remaining:
+                    attempt_timeout = remaining
+            if stream:
+                timeout = aiohttp.ClientTimeout(
+                    total=None if deadline is None else remaining,
+                    sock_connect=policy.attempt_timeout,
+                    sock_read=policy.attempt_timeout)
+            else:
+                timeout = aiohttp.ClientTimeout(total=attempt_timeout)
+            try:
+                response = await self.session.request(method, url,
+                                                      timeout=timeout,
+                                                      **kwargs)
+                if stream and response.status < 500:
+                    return response
+                try:
+                    body = await response.read()
+                finally:
+                    response.release()
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                error = _typed_error(e, method, url)
+                # a connection which could not be opened sent nothing
+                retry = idempotent or \
+                    isinstance(e, aiohttp.ClientConnectorError)
+            else:
+                result = _response(response, body)
+                if result.status_code < 500:
+                    return result
+                error = ResponseError(result)
+                retry = idempotent
+
+            if not retry or attempt > policy.retries:
+                raise error
+            delay = policy.delay(attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                raise error
+            await asyncio.sleep(delay)
+
+    async def get_value(self, api_version, subsystem, section, key, timeout=2,
+                        return_full=False, policy=None):
+        """
+        Get a value from the detector. If return_full is True, the complete
+        return value (a dict) is returned.
+        """
+        url = self.api_url(api_version, subsystem, section, key)
+        response = await self.request("GET", url, timeout=timeout,
+                                      policy=policy)
+        if response.status_code >= 400:
+            raise ResponseError(response)
+        data = json.loads(response.text)
+        if return_full:
+            return data
+        else:
+            return data["value"]
+
+    async def set_value(self, api_version, subsystem, section, key, value,
+                        timeout=2.0, no_data=False, policy=None):
+        """
+        Set a value.
+        """
+        url = self.api_url(api_version, subsystem, section, key)
+        payload = self.encode_value(subsystem, section, key, value)
+        headers = {"Content-type": "application/json"}
+        response = await self.request("PUT", url, timeout=timeout,
+                                      idempotent=section != "command",
+                                      policy=policy, data=payload,
+                                      headers=headers)
+        if response.status_code >= 400:
+            raise ResponseError(response)
+        if no_data:
+            return None
+        return json.loads(response.text)
+
+    async def get_many(self, api_version, keys, timeout=2.0, return_full=False,
+                       subsystem="detector"):
+        """
+        Reads several keys concurrently. See
+        :py:meth:`dectris_eiger.communication.EigerClient.get_many`.
+        """
+        t0 = time.time()
+        coros = []
+        for key in keys:
+            sys_name, section, name = split_key(key, subsystem)
+            coros.append(self.get_value(api_version, sys_name, section, name,
+                                        timeout=timeout,
+                                        return_full=return_full))
+        results = await asyncio.gather(*coros, return_exceptions=True)
+
+        values = {}
+        errors = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                errors[key] = result
+            else:
+                values[key] = result
+        return ParameterSet(values, errors, time.time() - t0)
+
+    async def close(self):
+        """
+        Closes all pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _typed_error(e, method, url):
+    # the CommunicationError corresponding to an aiohttp exception
+    if isinstance(e, asyncio.TimeoutError):
+        error = DeadlineExceeded("{0} {1}: timed out".format(method, url))
+        error.reached = True
+        return error
+    elif isinstance(e, aiohttp.ClientConnectionError):
+        return ConnectionFailed(str(e))
+    return CommunicationError(str(e))
+
+
+def _response(response, body):
+    # the aiohttp response as requests.Response, for ResponseError
+    result = requests.Response()
+    result.status_code = response.status
+    result.reason = response.reason
+    result.url = str(response.url)
+    result.headers.update(response.headers)
+    result.encoding = response.charset or "utf-8"
+    result._content = body
+    return result
+
+
+class _AsyncInterface(object):
+    """
+    Common base of the asyncio subsystem interfaces.
+    """
+
+    _subsystem = None
+
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
+        super(_AsyncInterface, self).__init__()
+        self._host = host
+        self._port = port
+        self._api_v = api_version
+        if client is None:
+            client = AsyncEigerClient(host, port)
+        self._client = client
+
+    async def _get(self, section, key, timeout=2.0, return_full=False):
+        return await self._client.get_value(self._api_v, self._subsystem,
+                                            section, key, timeout=timeout,
+                                            return_full=return_full)
+
+    async def _set(self, section, key, value, timeout=2.0, no_data=False):
+        return await self._client.set_value(self._api_v, self._subsystem,
+                                            section, key, value,
+                                            timeout=timeout, no_data=no_data)
+
+    async def close(self):
+        """
+        Closes the connections of the underlying client.
+        """
+        await self._client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncEigerDataBuffer(_AsyncInterface):
+    """
+    asyncio version of :py:class:`dectris_eiger.buffer.EigerDataBuffer`.
+    Files matched by :py:meth:`download` and :py:meth:`delete_all` are
+    processed concurrently.
+    """
+
+    async def list_files(self):
+        """
+        Returns a list of all files in the data buffer.
+
+        :returns: list of files in the buffer
+        :rtype: list of string
+        :raises ResponseError: if the DCU refuses to list the files
+        """
+        url = self._client.files_url(self._api_v)
+        response = await self._client.request("GET", url)
+        if response.status_code >= 400:
+            raise ResponseError(response)
+        return json.loads(response.text)
+
+    files = property(list_files)
+
+    async def get_file(self, filename):
+        """
+        Downloads a file's content and returns it.
+
+        :param str filename: Data file name
+        :returns: The file's content
+        :rtype: bytes
+        :raises UnknownDataFileError: if the data file can not be found
+        """
+        url = self._client.data_url(filename)
+        async with self._client.transfer_slots:
+            response = await self._client.request("GET", url)
+        if response.status_code == 200:
+            return response.content
+        else:
+            raise UnknownDataFileError(filename)
+
+    async def download_file(self, filename, target_dir, timeout=None):
+        """
+        Downloads a file's content into a file with the same name in the
+        given target directory. The transfer waits for one of the client's
+        *transfer_slots*.
+
+        :param str filename: Data file name
+        :param str target_dir: Local directory to save the file in
+        :param float timeout: maximum time of the transfer in seconds
+                              (default: no limit)
+        :returns: number of bytes read
+        :rtype: int
+        :raises UnknownDataFileError: if the data file can not be found
+        :raises dectris_eiger.communication.CommunicationError: if the
+                                                                 transfer
+                                                                 fails
+        """
+        url = self._client.data_url(filename)
+        bytes_read = 0
+        async with self._client.transfer_slots:
+            response = await self._client.request("GET", url,
+                                                  timeout=timeout,
+                                                  stream=True)
+            try:
+                if response.status != 200:
+                    raise UnknownDataFileError(filename)
+                expected = response.content_length
+                target_fn = os.sep.join([target_dir, filename])
+                with open(target_fn, "wb") as f:
+                    async for chunk in response.content.iter_chunked(
+                            DOWNLOAD_CHUNK_SIZE):
+                        bytes_read += len(chunk)
+                        f.write(chunk)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                raise _typed_error(e, "GET", url)
+            finally:
+                response.release()
+        if expected is not None and expected != bytes_read:
+            raise DataBufferError("{0}: received {1} of {2} bytes".format(
+                filename, bytes_read, expected))
+        return bytes_read
+
+    async def download(self, filename_pattern, target_dir, workers=None,
+                       timeout=None):
+        """
+        Downloads all files matching the glob pattern, up to *workers* (by
+        default the client's *max_transfers*) at a time. See
+        :py:meth:`dectris_eiger.buffer.EigerDataBuffer.download`. A failed
+        file does not stop the others, all failures are raised together at
+        the end.
+
+        :param str filename_pattern: Filename or glob pattern
+        :param str target_dir: Local directory to save the file(s) in
+        :param int workers: number of files downloaded concurrently
+        :param float timeout: maximum time of each transfer in seconds
+        :returns: report with the files downloaded and the throughput
+        :rtype: dectris_eiger.buffer.DownloadReport
+        :raises dectris_eiger.buffer.DownloadError: if any file could not be
+                                                    downloaded
+        """
+        t0 = time.time()
+        filenames = sorted(fnmatch.filter(await self.files, filename_pattern))
+        report = DownloadReport()
+
+        async def fetch(filename):
+            try:
+                size = await self.download_file(filename, target_dir,
+                                                timeout=timeout)
+            except Exception as e:
+                report.errors[filename] = e
+            else:
+                report.files.append((filename, size))
+
+        await _bounded(fetch, filenames,
+                       workers or self._client.max_transfers)
+        report.elapsed = time.time() - t0
+        if report.errors:
+            raise DownloadError(report)
+        return report
+
+    async def delete_file(self, filename):
+        """
+        Deletes the file given by the filename from the buffer. Returns
+        False if the file did not exist.
+
+        :param str filename: Data file to delete
+        :rtype: bool
+        :raises ResponseError: if the DCU refuses to delete the file
+        """
+        url = self._client.data_url(filename)
+        response = await self._client.request("DELETE", url)
+        if response.status_code == 404:
+            return False
+        elif response.status_code >= 400:
+            raise ResponseError(response)
+        return True
+
+    async def delete_all(self, workers=DELETE_WORKERS):
+        """
+        Deletes all files from the buffer, up to *workers* at a time. A
+        failed file does not stop the others, all failures are raised
+        together at the end.
+
+        :param int workers: number of files deleted concurrently
+        :rtype: dectris_eiger.buffer.DeleteReport
+        :raises dectris_eiger.buffer.DeleteError: if any file could not be
+                                                  deleted
+        """
+        t0 = time.time()
+        report = DeleteReport()
+
+        async def delete(filename):
+            try:
+                existed = await self.delete_file(filename)
+            except Exception as e:
+                report.errors[filename] = e
+            else:
+                (report.deleted if existed else report.missing).append(
+                    filename)
+
+        await _bounded(delete, await self.files, workers)
+        report.elapsed = time.time() - t0
+        if report.errors:
+            raise DeleteError(report)
+        return report
+
+    async def clear_buffer(self):
+        """
+        Alias for :py:meth:`delete_all`.
+        """
+        return await self.delete_all()
+
+
+async def _bounded(func, items, workers):
+    # awaits func for all items in *workers* coroutines taking turns
+    items = iter(items)
+
+    async def worker():
+        for item in items:
+            await func(item)
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+
+
+class AsyncEigerFileWriter(_AsyncInterface):
+    """
+    asyncio version of :py:class:`dectris_eiger.filewriter.EigerFileWriter`.
+    """
+
+    _subsystem = "filewriter"
+
+    # initialize
+    async def initialize(self, timeout=100.0):
+        """
+        Resets the filewriter to its original state.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "initialize", "initialize", timeout=timeout,
+                        no_data=True)
+
+    # clear
+    async def clear(self, timeout=100.0):
+        """
+        Drops all data (image data and directories) on the DCU.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "clear", "clear", timeout=timeout,
+                        no_data=True)
+
+    # status
+    async def get_status(self, timeout=2.0, return_full=False):
+        """
+        Returns the filewriter's status. The status can be one of "disabled",
+        "ready", "acquire", and "error".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: subsystem status
+        :rytpe: str
+        """
+        return await self._get("status", "state", timeout=timeout,
+                               return_full=return_full)
+    status = property(get_status)
+
+    # error
+    async def get_error(self, timeout=2.0, return_full=False):
+        """
+        Returns list of status parameters causing error state.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: subsystem status
+        :rytpe: str
+        """
+        return await self._get("status", "error", timeout=timeout,
+                               return_full=return_full)
+    error = property(get_error)
+
+    # available buffer space
+    async def get_available_space(self, timeout=2.0, return_full=False):
+        """
+        Return the available buffer space in KB.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: free buffer space in KB
+        :rytpe: int
+        """
+        return int(await self._get("status", "state", timeout=timeout,
+                                   return_full=return_full))
+    available_space = property(get_available_space)
+
+    # time
+    async def get_time(self, timeout=2.0, return_full=False):
+        """
+        Returns the filewriter's current system time.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: time string
+        :rytpe: str
+        """
+        return await self._get("status", "time", timeout=timeout,
+                               return_full=return_full)
+    time = property(get_time)
+
+    #  mode
+    async def get_mode(self, timeout=2.0, return_full=False):
+        """
+        Returns the operation mode, which can be "enabled" or "disabled".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the  mode
+        :rytpe: str
+        """
+        return await self._get("config", "mode", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_mode(self, mode, timeout=2.0):
+        """
+        Set the filewriter's operation mode, which can be "enabled" or "disabled".
+
+        :param str mode: mode
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "mode", mode, timeout=timeout, no_data=True)
+    mode = property(get_mode)
+
+    # transfer mode
+    async def get_transfer_mode(self, timeout=2.0, return_full=False):
+        """
+        Returns the transfer mode. Currently only "http" is supported.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the transfer mode
+        :rytpe: str
+        """
+        return await self._get("config", "transfer_mode", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_transfer_mode(self, mode, timeout=2.0):
+        """
+        Set the filewriter's transfer mode. Currently only "http" is
+        supported.
+
+        :param str mode: transfer mode
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "transfer_mode", mode, timeout=timeout,
+                        no_data=True)
+    transfer_mode = property(get_transfer_mode)
+
+    # number of images per file
+    async def get_images_per_file(self, timeout=2.0, return_full=False):
+        """
+        Returns the number of images stored in a single data file.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of images per file
+        :rytpe: int
+        """
+        return int(await self._get("config", "nimages_per_file",
+                                   timeout=timeout, return_full=return_full))
+
+    async def set_images_per_file(self, n, timeout=2.0):
+        """
+        Set the number of images stored in a single data file.
+
+        :param int n: number of images per file
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "nimages_per_file", n, timeout=timeout,
+                        no_data=True)
+    images_per_file = property(get_images_per_file)
+
+    # image_nr_low metadata parameter in the first HDF5 data file
+    async def get_image_nr_start(self, timeout=2.0, return_full=False):
+        """
+        Returns the image_nr_low metadata parameter in the first HDF5 data file.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of images per file
+        :rytpe: int
+        """
+        return int(await self._get("config", "image_nr_start", timeout=timeout,
+                                   return_full=return_full))
+
+    async def set_image_nr_start(self, n, timeout=2.0):
+        """
+        Set the image_nr_low metadata parameter in the first HDF5 data file.
+
+        :param int n: image_nr_low
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "image_nr_start", n, timeout=timeout,
+                        no_data=True)
+    image_nr_start = property(get_image_nr_start)
+
+    # filename pattern
+    async def get_filename_pattern(self, timeout=2.0, return_full=False):
+        """
+        Returns the file naming pattern. The string ``$id`` is replaced by
+        the series id.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the file naming pattern
+        :rytpe: string
+        """
+        return await self._get("config", "name_pattern", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_filename_pattern(self, pattern, timeout=2.0):
+        """
+        Set the file naming pattern. The string ``$id`` is replaced by the
+        series id.
+
+        :param str pattern: the file naming pattern
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "name_pattern", pattern, timeout=timeout,
+                        no_data=True)
+    filename_pattern = property(get_filename_pattern)
+
+    # compression
+    async def get_compression_enabled(self, timeout=2.0, return_full=False):
+        """
+        Returns True if the LZ4 data compression is enabled, False otherwise.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: True if compression is enable, False otherwise
+        :rytpe: boolean
+        """
+        return await self._get("config", "compression_enabled",
+                               timeout=timeout, return_full=return_full)
+
+    async def set_compression_enabled(self, enabled, timeout=2.0):
+        """
+        Enable or disable LZ4 data compression.
+
+        :param boolean enabled: set the data compression status
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "compression_enabled", enabled,
+                        timeout=timeout, no_data=True)
+    compression_enabled = property(get_compression_enabled)
+
+    # buffer free
+    async def get_buffer_free(self, timeout=2.0, return_full=False):
+        """
+        Returns the remaining buffer space in kB. 
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: error
+        :rytpe: str or dict
+        """
+        return await self._get("status", "buffer_free", timeout=timeout,
+                               return_full=return_full)
+    buffer_free = property(get_buffer_free)
+
+
+class AsyncEigerMonitorCtrl(_AsyncInterface):
+    """
+    asyncio version of :py:class:`dectris_eiger.monitor.EigerMonitorCtrl`.
+    """
+
+    _subsystem = "monitor"
+
+    # initialize
+    async def initialize(self, timeout=100.0):
+        """
+        Resets the monitor o its original state.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "initialize", "initialize", timeout=timeout,
+                        no_data=True)
+
+    # clear
+    async def clear(self, timeout=100.0):
+        """
+        Drops all buffered images and resets status/dropped to zero.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "clear", "clear", timeout=timeout,
+                        no_data=True)
+
+    # status
+    async def get_status(self, timeout=2.0, return_full=False):
+        """
+        Returns the monitor's status. The status can be one "normal" or
+        "overflow".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: subsystem status
+        :rytpe: str
+        """
+        return await self._get("status", "state", timeout=timeout,
+                               return_full=return_full)
+    status = property(get_status)
+
+    # error
+    async def get_error(self, timeout=2.0, return_full=False):
+        """
+        Returns list of status parameters causing error condition.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: subsystem status
+        :rytpe: str
+        """
+        return await self._get("status", "error", timeout=timeout,
+                               return_full=return_full)
+    error = property(get_error)
+
+    # mode
+    async def get_mode(self, timeout=2.0, return_full=False):
+        """
+        Returns the operation mode.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the operation mode
+        :rytpe: str
+        """
+        return await self._get("config", "mode", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_mode(self, mode, timeout=2.0):
+        """
+        Set the monitor's operation mode.
+
+        :param str mode: operation mode
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "mode", mode, timeout=timeout, no_data=True)
+    mode = property(get_mode)
+
+    # number of images that can be buffered by the monitor interface
+    async def get_buffer_size(self, timeout=2.0, return_full=False):
+        """
+        Returns the number of images that can be buffered.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of images that can be buffered
+        :rytpe: int
+        """
+        return int(await self._get("config", "buffer_size", timeout=timeout,
+                                   return_full=return_full))
+
+    async def set_buffer_size(self, n, timeout=2.0):
+        """
+        Set the number of images that can be buffered.
+
+        :param int n: number of images that can be buffered
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "buffer_size", n, timeout=timeout,
+                        no_data=True)
+    buffer_size = property(get_buffer_size)
+
+
+class AsyncEigerDetector(_AsyncInterface):
+    """
+    asyncio version of :py:class:`dectris_eiger.eiger.EigerDetector`. The
+    *filewriter* and *buffer* attributes are the asyncio interfaces of the
+    respective subsystems and share the detector's client.
+    """
+
+    _subsystem = "detector"
+
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
+        super(AsyncEigerDetector, self).__init__(host, port, api_version,
+                                                 client=client)
+        self.filewriter = AsyncEigerFileWriter(host, port, api_version,
+                                               client=self._client)
+        self.buffer = AsyncEigerDataBuffer(host, port, api_version,
+                                           client=self._client)
+
+    # detector state
+    async def get_state(self, timeout=2.0, return_full=False):
+        """
+        Returns the detector state. This can be one of "na", "initialize",
+        "configure", "acquire", "test", "ready", and "idle".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: The detector state.
+        :rytpe: str or dict
+        """
+        return await self._get("status", "state", timeout=timeout,
+                               return_full=return_full)
+    state = property(get_state)
+
+    # board temperature
+    async def get_temperature(self, timeout=2.0, return_full=False,
+                              board="board_000"):
+        """
+        Returns the temperature reading (in Celsius) for a specific detector
+        board.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :param str board: board name (default board_000 - first board)
+        :returns: board temperature
+        :rtype: float
+        """
+        return await self._get("status", "{0}/th0_temp".format(board),
+                               timeout=timeout, return_full=return_full)
+    temperature = property(get_temperature)
+
+    # board humidity
+    async def get_humidity(self, timeout=2.0, return_full=False,
+                           board="board_000"):
+        """
+        Returns the relative humidity reading (in percent) for a specific
+        detector board.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :param str board: board name (default board_000 - first board)
+        :returns: board humidity
+        :rtype: float
+        """
+        return await self._get("status", "{0}/th0_humidity".format(board),
+                               timeout=timeout, return_full=return_full)
+    humidity = property(get_humidity)
+
+    # detector error
+    async def get_error(self, timeout=2.0, return_full=False):
+        """
+        Returns the list of staus parameters causing an error condition. 
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: error
+        :rytpe: str or dict
+        """
+        return await self._get("status", "error", timeout=timeout,
+                               return_full=return_full)
+    error = property(get_error)
+
+    # detector time
+    async def get_detector_time(self, timeout=2.0, return_full=False):
+        """
+        Returns the actual system time. 
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: error
+        :rytpe: str or dict
+        """
+        return await self._get("status", "time", timeout=timeout,
+                               return_full=return_full)
+    detector_time = property(get_detector_time)
+
+    # count time
+    async def get_count_time(self, timeout=2.0, return_full=False):
+        """
+        Returns the currently set count time per image in seconds.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: count time in seconds
+        :rtype: float
+        """
+        return await self._get("config", "count_time", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_count_time(self, t, timeout=2.0):
+        """
+        Set the count time per image in seconds.
+
+        :param float t: count time in seconds
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "count_time", t, timeout=timeout)
+    count_time = property(get_count_time)
+
+    # frame time
+    async def get_frame_time(self, timeout=2.0, return_full=False):
+        """
+        Returns the currently set frame time (count time plus read out time)
+        per image in seconds.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: frame time in seconds
+        :rtype: float
+        """
+        return await self._get("config", "frame_time", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_frame_time(self, t, timeout=2.0):
+        """
+        Set the frame time per image in seconds.
+
+        :param float t: frame time in seconds
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "frame_time", t, timeout=timeout)
+    frame_time = property(get_frame_time)
+
+    # number of images
+    async def get_nimages(self, timeout=2.0, return_full=False):
+        """
+        Returns the number of images per series.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of images
+        :rtype: int
+        """
+        return int(await self._get("config", "nimages", timeout=timeout,
+                                   return_full=return_full))
+
+    async def set_nimages(self, n, timeout=2.0):
+        """
+        Set the number of images per series.
+
+        :param int n: number of images
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "nimages", n, timeout=timeout)
+    nimages = property(get_nimages)
+
+    # number of triggers
+    async def get_ntrigger(self, timeout=2.0, return_full=False):
+        """
+        Returns the allowed number of trigger per arm/disarm sequence.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of images
+        :rtype: int
+        """
+        return int(await self._get("config", "ntrigger", timeout=timeout,
+                                   return_full=return_full))
+
+    async def set_ntrigger(self, n, timeout=2.0):
+        """
+        Set the allowed number of triggers per arm/disarm sequence.
+
+        :param int n: number of triggers
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "ntrigger", n, timeout=timeout)
+    ntrigger = property(get_ntrigger)
+
+    # photon energy
+    async def get_energy(self, timeout=2.0, return_full=False):
+        """
+        Returns the currently set photon energy in electron volts.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: photon energy in electron volts
+        :rtype: float
+        """
+        return await self._get("config", "photon_energy", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_energy(self, energy, timeout=2.0):
+        """
+        Set the photon energy in electron volts. This will also affect the
+        wavelength property and the threshold.
+
+        :param float timeout: communication timeout in seconds
+        :param float energy: the new photon energy in electron volts
+        """
+        await self._set("config", "photon_energy", energy, timeout=timeout)
+    energy = property(get_energy)
+
+    # photon wavelength
+    async def get_wavelength(self, timeout=2.0, return_full=False):
+        """
+        Returns the currently set photon wavelength in Angstrom.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: photon wavelength in Angstrom
+        :rtype: float
+        """
+        return await self._get("config", "wavelength", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_wavelength(self, wavelength, timeout=2.0):
+        """
+        Set the photon energy in Angstrom. This will also affect the energy
+        and threshold properties.
+
+        :param float timeout: communication timeout in seconds
+        :param float wavelength: photon wavelength in Angstrom
+        """
+        await self._set("config", "wavelength", wavelength, timeout=timeout)
+    wavelength = property(get_wavelength)
+
+    # energy threshold
+    async def get_threshold(self, timeout=2.0, return_full=False):
+        """
+        Returns the currently set energy threshold in electron volts.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: energy threshold in electron volts
+        :rtype: float
+        """
+        return await self._get("config", "threshold_energy", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_threshold(self, energy, timeout=2.0):
+        """
+        Set the energy threshold in electron volts.
+
+        :param float timeout: communication timeout in seconds
+        :param float energy: threshold energy
+        """
+        await self._set("config", "threshold_energy", energy, timeout=timeout)
+    threshold = property(get_threshold)
+
+    # flatfield
+    async def get_flatfield_enabled(self, timeout=2.0, return_full=False):
+        """
+        Returns True if the flatfield correction is enabled.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: True if the flatfield correction is enabled, False otherwise
+        :rtype: boolean
+        """
+        return await self._get("config", "flatfield_correction_applied",
+                               timeout=timeout, return_full=return_full)
+
+    async def set_flatfield_enabled(self, enabled, timeout=2.0):
+        """
+        Enable or disable the flatfield correction.
+
+        :param boolean enabled: set the flatfield correction status
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "flatfield_correction_applied", enabled,
+                        timeout=timeout)
+    flatfield_enabled = property(get_flatfield_enabled)
+
+    # auto summation
+    async def get_auto_summation_enabled(self, timeout=2.0, return_full=False):
+        """
+        Returns True if the auto summation feature (to increase the dynamic
+        range) is enabled.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: True if auto summation is enabled, False otherwise
+        :rtype: boolean
+        """
+        return await self._get("config", "auto_summation", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_auto_summation_enabled(self, enabled, timeout=2.0):
+        """
+        Enable or disable the auto summation feature.
+
+        :param boolean enabled: set the auto summation status
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "auto_summation", enabled, timeout=timeout)
+    auto_summation_enabled = property(get_auto_summation_enabled)
+
+    # trigger mode
+    async def get_trigger_mode(self, timeout=2.0, return_full=False):
+        """
+        Returns the current trigger mode. Following trigger modes are
+        supported:
+
+         * expo
+         * extt
+         * extm
+         * exte
+         * exts
+         * ints
+         * inte
+
+        This is likely to change with future API versions.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the current trigger mode
+        :rtype: string
+        """
+        return await self._get("config", "trigger_mode", timeout=timeout,
+                               return_full=return_full)
+
+    async def set_trigger_mode(self, mode, timeout=2.0):
+        """
+        Set the trigger mode. Raises ``ValueError`` if *mode* is an invalid
+        mode string. See :py:meth:`get_trigger_mode` for supported modes.
+
+        :param string mode: trigger mode
+        :param float timeout: communication timeout in seconds
+        """
+        if mode not in ["expo", "extt", "extm", "exte", "exts", "ints", "inte"]:
+            raise ValueError("Invalid trigger mode.")
+        await self._set("config", "trigger_mode", mode, timeout=timeout)
+    trigger_mode = property(get_trigger_mode)
+
+    # rate correction
+    async def get_rate_correction_enabled(self, timeout=2.0,
+                                          return_full=False):
+        """
+        Returns True if the rate correction is enabled, False otherwise.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: True if rate correction is enabled, False otherwise
+        :rtype: boolean
+        """
+        return await self._get("config", "countrate_correction_applied",
+                               timeout=timeout, return_full=return_full)
+
+    async def set_rate_correction_enabled(self, enabled, timeout=2.0):
+        """
+        Enable or disable the rate correction.
+
+        :param boolean enabled: set the rate correction status
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("config", "countrate_correction_applied", enabled,
+                        timeout=timeout)
+    rate_correction_enabled = property(get_rate_correction_enabled)
+
+    # bit depth
+    async def get_bit_depth(self, timeout=2.0, return_full=False):
+        """
+        Returns the detector's bit depth, i.e. the dynamic range.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: bit depth
+        :rtype: int
+        """
+        return await self._get("config", "bit_depth_readout", timeout=timeout,
+                               return_full=return_full)
+    bit_depth = property(get_bit_depth)
+
+    # readout time
+    async def get_readout_time(self, timeout=2.0, return_full=False):
+        """
+        Return the detector's readout time per image.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: readout time in seconds
+        :rtype: float
+        """
+        return await self._get("config", "detector_readout_time",
+                               timeout=timeout, return_full=return_full)
+    readout_time = property(get_readout_time)
+
+    # description
+    async def get_description(self, timeout=2.0, return_full=False):
+        """
+        Returns the detector description, i.e. the model.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: detector description
+        :rtype: string
+        """
+        return await self._get("config", "description", timeout=timeout,
+                               return_full=return_full)
+    description = property(get_description)
+
+    # serial number
+    async def get_serial_number(self, timeout=2.0, return_full=False):
+        """
+        Returns the detector's serial number.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: detector serial number
+        :rtype: string
+        """
+        return await self._get("config", "detector_number", timeout=timeout,
+                               return_full=return_full)
+    serial_number = property(get_serial_number)
+
+    # firmware version
+    async def get_firmware_version(self, timeout=2.0, return_full=False):
+        """
+        Returns the detector's firmware version.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: detector firmware version
+        :rtype: string
+        """
+        return await self._get("config", "software_version", timeout=timeout,
+                               return_full=return_full)
+    firmware_version = property(get_firmware_version)
+
+    # sensor material
+    async def get_sensor_material(self, timeout=2.0, return_full=False):
+        """
+        Returns the detector sensor's material.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: material
+        :rtype: string
+        """
+        return await self._get("config", "sensor_material", timeout=timeout,
+                               return_full=return_full)
+    sensor_material = property(get_sensor_material)
+
+    # sensor thickness
+    async def get_sensor_thickness(self, timeout=2.0, return_full=False):
+        """
+        Returns the thickness of the sensor material in meters.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: sensor thickness in meters
+        :rtype: float
+        """
+        return await self._get("config", "sensor_thickness", timeout=timeout,
+                               return_full=return_full)
+    sensor_thickness = property(get_sensor_thickness)
+
+    # initialize
+    async def initialize(self, timeout=100.0):
+        """
+        Initialize the detector.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "initialize", "initialize", timeout=timeout,
+                        no_data=True)
+
+    # arm
+    async def arm(self, timeout=100.0, return_full=False):
+        """
+        Arm the detector.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: next series id
+        :rtype: int
+        """
+        data = await self._set("command", "arm", "arm", timeout=timeout)
+        if return_full:
+            return data
+        else:
+            return data["sequence id"]
+
+    # disarm
+    async def disarm(self, timeout=100.0):
+        """
+        Disarm the detector.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "disarm", "disarm", timeout=timeout,
+                        no_data=True)
+
+    # trigger
+    async def trigger(self, timeout=100.0, input_value=-1):
+        """
+        Trigger the detector.
+
+        :param float timeout: communication timeout in seconds
+        """
+        await self._set("command", "trigger", input_value, timeout=timeout,
+                        no_data=True)
+
+    # cancel
+    async def cancel(self, timeout=2.0, return_full=False):
+        """
+        Stop data acquisition after the current image.
+
+        .. note::
+
+           The cancel() command is not available in firmware version 0.9 and
+           below.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: current series id
+        :rtype: int
+        """
+        data = await self._set("command", "cancel", "cancel", timeout=timeout)
+        if return_full:
+            return data
+        else:
+            return data["sequence id"]
+
+    # abort
+    async def abort(self, timeout=2.0, return_full=False):
+        """
+        Abort all operations and reset the detector system.
+
+        .. note::
+
+           The abort() command is not available in firmware version 0.9 and
+           below.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: current series id
+        :rtype: int
+        """
+        data = await self._set("command", "abort", "abort", timeout=timeout)
+        if return_full:
+            return data
+        else:
+            return data["sequence id"]
+
+    async def get_param_lim(self, parameter, limit, timeout=2.0,
+                            return_full=True):
+        """
+        Returns the limit max or min of the given parameter
+
+        :param string parameter: parameter name
+        :param string limit: max or min
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: max count time in seconds
+        :rtype: float
+        """
+        response = await self._get("config", parameter, timeout=timeout,
+                                   return_full=return_full)
+
+        return response[limit]
+
+    async def get_many(self, keys, timeout=2.0, return_full=False):
+        """
+        Reads several keys concurrently. See
+        :py:meth:`dectris_eiger.eiger.EigerDetector.get_many`.
+        """
+        return await self._client.get_many(self._api_v, keys, timeout=timeout,
+                                           return_full=return_full)
+
+    async def snapshot(self, keys=SNAPSHOT_KEYS, timeout=2.0):
+        """
+        Reads the complete configuration and status in one batch. See
+        :py:meth:`dectris_eiger.eiger.EigerDetector.snapshot`.
+        """
+        return await self.get_many(keys, timeout=timeout)
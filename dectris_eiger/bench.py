@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: bench
+   :synopsis: This module contains benchmarks of the control path (reading
+              and writing values, arming, triggering) and the data path
+              (listing and downloading buffered files), run against the local
+              simulator of :py:mod:`dectris_eiger.sim`.
+
+Results are written as JSON, so that they can be compared between
+releases::
+
+  python -m dectris_eiger.bench -o results-0.3.1.json
+  python -m dectris_eiger.bench --quick --latency 0.0005 --bandwidth 100
+
+Times are given in seconds, throughputs in bytes per second.
+"""
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from . import __version__
+from .eiger import SNAPSHOT_KEYS, EigerDetector
+from .sim import Simulator
+
+#: buffer sizes (number of files) for the file listing benchmark; the
+#: device's FilesInBuffer attribute holds up to 100000 names
+LIST_SIZES = (10, 100, 1000, 10000, 100000)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * len(values))))]
+
+
+def summarize(samples):
+    """
+    Returns count, mean, percentiles and maximum of a list of durations.
+    """
+    return {"n": len(samples),
+            "mean": sum(samples) / len(samples),
+            "p50": percentile(samples, 50),
+            "p90": percentile(samples, 90),
+            "p99": percentile(samples, 99),
+            "max": max(samples)}
+
+
+def measure(call, repeat):
+    """
+    Calls *call* *repeat* times and returns the durations of the calls.
+    """
+    samples = []
+    for _ in range(repeat):
+        t0 = time.time()
+        call()
+        samples.append(time.time() - t0)
+    return samples
+
+
+def bench_get_value(sim, detector, repeat):
+    """
+    Round trip of reading a value, bypassing the client's cache.
+    """
+    client = detector._client
+
+    def call():
+        client.get_value(detector._api_v, "detector", "config",
+                         "count_time", fresh=True)
+    return summarize(measure(call, repeat))
+
+
+def bench_set_value(sim, detector, repeat):
+    """
+    Round trip of writing a value.
+    """
+    values = [0.1, 0.2]
+
+    def call():
+        values.reverse()
+        detector.count_time = values[0]
+    return summarize(measure(call, repeat))
+
+
+def bench_full_config(sim, detector, repeat):
+    """
+    Time to read all :py:data:`dectris_eiger.eiger.SNAPSHOT_KEYS`, batched
+    with :py:meth:`dectris_eiger.eiger.EigerDetector.snapshot` and one by
+    one.
+    """
+    client = detector._client
+
+    def batched():
+        detector.cache.clear()
+        detector.snapshot()
+
+    def sequential():
+        for key in SNAPSHOT_KEYS:
+            subsystem, section, key = key.split("/", 2)
+            client.get_value(detector._api_v, subsystem, section, key,
+                             fresh=True)
+    return {"keys": len(SNAPSHOT_KEYS),
+            "snapshot": summarize(measure(batched, repeat)),
+            "sequential": summarize(measure(sequential, repeat))}
+
+
+def bench_arm(sim, detector, repeat):
+    """
+    Latency from sending arm until the detector reports "ready", minus the
+    simulated arming time.
+    """
+    samples = []
+    for _ in range(repeat):
+        t0 = time.time()
+        detector.arm()
+        detector.wait_for_state("ready", timeout=10.0)
+        samples.append(time.time() - t0 - sim.dcu.arm_time)
+        detector.disarm()
+    return summarize(samples)
+
+
+def bench_trigger(sim, detector, repeat, frame_time=0.01):
+    """
+    Overhead of the trigger command: its duration minus the acquisition
+    time of a single image.
+    """
+    detector.set_many({"nimages": 1, "ntrigger": repeat,
+                       "frame_time": frame_time, "count_time": frame_time / 2,
+                       "filewriter/mode": "disabled"})
+    detector.arm()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.time()
+        detector.trigger()
+        samples.append(time.time() - t0 - frame_time)
+    detector.disarm()
+    detector.set_many({"ntrigger": 1, "filewriter/mode": "enabled"})
+    return summarize(samples)
+
+
+def bench_list_files(sim, detector, repeat, sizes=LIST_SIZES):
+    """
+    Time of :py:attr:`dectris_eiger.buffer.EigerDataBuffer.files` against
+    the number of files in the buffer.
+    """
+    result = {}
+    for size in sizes:
+        sim.dcu.clear_files()
+        for i in range(size):
+            sim.dcu.add_file("series_{0}_data_{1:06d}.h5".format(
+                i // 1000 + 1, i % 1000 + 1), 1024)
+        samples = measure(lambda: detector.buffer.files, repeat)
+        result[str(size)] = summarize(samples)
+    sim.dcu.clear_files()
+    return result
+
+
+def bench_download(sim, detector, repeat, nfiles=8, file_size=8 * 1024 ** 2,
+                   workers=(1, 4), segments=4):
+    """
+    Throughput of :py:meth:`dectris_eiger.buffer.EigerDataBuffer.download_file`
+    for a single file (as a whole and in *segments* ranges) and of
+    :py:meth:`~dectris_eiger.buffer.EigerDataBuffer.download` for a series
+    of *nfiles* files with each number of *workers*.
+    """
+    sim.dcu.clear_files()
+    names = ["series_1_data_{0:06d}.h5".format(i + 1) for i in range(nfiles)]
+    for name in names:
+        sim.dcu.add_file(name, file_size)
+    target = tempfile.mkdtemp(prefix="eiger-bench-")
+    try:
+        single = measure(
+            lambda: detector.buffer.download_file(names[0], target), repeat)
+        segmented = measure(lambda: detector.buffer.download_file(
+            names[0], target, segments=segments), repeat)
+        result = {"file_size": file_size, "nfiles": nfiles,
+                  "download_file": dict(summarize(single),
+                                        throughput=file_size / min(single)),
+                  "download_file_segmented": dict(
+                      summarize(segmented), segments=segments,
+                      throughput=file_size / min(segmented))}
+        for n in workers:
+            series = measure(lambda: detector.buffer.download(
+                "series_1_*", target, workers=n), repeat)
+            result["download_{0}".format(n)] = dict(
+                summarize(series),
+                throughput=nfiles * file_size / min(series))
+    finally:
+        shutil.rmtree(target)
+        sim.dcu.clear_files()
+    return result
+
+
+#: benchmarks run by :py:func:`run` as (name, function, repetitions,
+#: repetitions with quick=True)
+BENCHMARKS = (
+    ("get_value", bench_get_value, 1000, 100),
+    ("set_value", bench_set_value, 1000, 100),
+    ("full_config", bench_full_config, 50, 5),
+    ("arm", bench_arm, 20, 3),
+    ("trigger", bench_trigger, 50, 5),
+    ("list_files", bench_list_files, 5, 1),
+    ("download", bench_download, 5, 1),
+)
+
+
+def run(names=None, quick=False, latency=0.0, jitter=0.0, bandwidth=None,
+        stream_bandwidth=None, api_version="1.6.0"):
+    """
+    Runs the benchmarks against a fresh simulator and returns the results as
+    a dict.
+
+    :param names: names of the benchmarks to run (default: all)
+    :param bool quick: whether to run fewer repetitions
+    :param float latency: simulated latency per request in seconds
+    :param float jitter: simulated random additional latency in seconds
+    :param float bandwidth: simulated bandwidth in bytes/s
+    :param float stream_bandwidth: simulated bandwidth per response in
+                                   bytes/s
+    :param str api_version: API version to use
+    """
+    results = {}
+    with Simulator(api_version=api_version, latency=latency, jitter=jitter,
+                   bandwidth=bandwidth,
+                   stream_bandwidth=stream_bandwidth) as sim:
+        detector = EigerDetector("127.0.0.1", sim.port, api_version)
+        for name, function, repeat, quick_repeat in BENCHMARKS:
+            if names and name not in names:
+                continue
+            results[name] = function(sim, detector,
+                                     quick_repeat if quick else repeat)
+        detector._client.close()
+    return {"version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "link": {"latency": latency, "jitter": jitter,
+                     "bandwidth": bandwidth,
+                     "stream_bandwidth": stream_bandwidth},
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m dectris_eiger.bench",
+        description="Benchmarks of dectris_eiger against a simulated DCU.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="benchmarks to run (default: all of {0})".format(
+                            ", ".join(b[0] for b in BENCHMARKS)))
+    parser.add_argument("-o", "--output",
+                        help="JSON file to write (default: stdout)")
+    parser.add_argument("--quick", action="store_true",
+                        help="run fewer repetitions")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="simulated additional latency in seconds")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="simulated bandwidth in MB/s")
+    parser.add_argument("--stream-bandwidth", type=float, default=None,
+                        help="simulated bandwidth per response in MB/s")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(b[0] for b in BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark(s): {0}".format(", ".join(unknown)))
+    bandwidth = args.bandwidth * 1e6 if args.bandwidth else None
+    stream_bandwidth = args.stream_bandwidth * 1e6 \
+        if args.stream_bandwidth else None
+    results = run(args.benchmarks, args.quick, args.latency, args.jitter,
+                  bandwidth, stream_bandwidth)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,22 +7,97 @@
 
 .. moduleauthor:: Sven Festersen <festersen@physik.uni-kiel.de>
 """
+import bisect
+import collections
 import fnmatch
+import hashlib
+import io
 import json
 import os
+import re
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+try:
+    import http.client as http_client
+except ImportError:
+    import httplib as http_client
+
 import requests
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from .communication import ResponseError, get_client
 
 
 DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
+#: smallest amount of data :py:func:`download_into` reads at once
+MIN_CHUNK_SIZE = 64 * 1024
+
+#: largest amount of data :py:func:`download_into` reads at once
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+
+#: time in seconds one read of :py:func:`download_into` should take, the
+#: chunk size follows the throughput to match it
+CHUNK_TIME = 0.05
+
+#: size of the blocks cached by :py:class:`RemoteFile` in bytes
+BLOCK_SIZE = 256 * 1024
+
+#: number of blocks cached by :py:class:`RemoteFile`
+CACHE_BLOCKS = 32
+
+#: amount of data written between two releases of the page cache if
+#: :py:func:`download_into` is to bypass it
+DROP_CACHE_INTERVAL = 64 * 1024 * 1024
+
+#: number of attempts to download a master file
+MASTER_ATTEMPTS = 3
+
+#: smallest segment of a segmented download in bytes
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+
+#: number of attempts to download a segment
+SEGMENT_ATTEMPTS = 3
 
-def download_chunks(response, f):
+#: number of files deleted concurrently by default
+DELETE_WORKERS = 8
+
+#: suffix of a file being downloaded in segments
+PART_SUFFIX = ".part"
+
+#: suffix of the journal of a segmented download
+JOURNAL_SUFFIX = ".part.json"
+
+#: suffix of the manifest of a series' files, see :py:class:`Manifest`
+MANIFEST_SUFFIX = "_manifest.json"
+
+#: minimum time between two updates of a journal in seconds
+JOURNAL_INTERVAL = 1.0
+
+_replace = getattr(os, "replace", os.rename)
+
+_fadvise = getattr(os, "posix_fadvise", None)
+
+_local = threading.local()
+
+
+def download_chunks(response, f, digest=None):
     """
     Download a file opened as ``requests.Response`` into a file object.
 
     :param requests.Response response: the response object
     :param f: the file-like object to write to
     :type f: file-like
+    :param digest: hashlib object updated with the data
     :returns: number of bytes read
     :rtype: int
     """
@@ -30,9 +105,242 @@ def download_chunks(response, f):
     for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
         bytes_read += len(chunk)
         f.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+    return bytes_read
+
+
+def _read_buffer():
+    # a reusable buffer of MAX_CHUNK_SIZE bytes for the current thread
+    buf = getattr(_local, "buffer", None)
+    if buf is None:
+        buf = _local.buffer = memoryview(bytearray(MAX_CHUNK_SIZE))
+    return buf
+
+
+def _body_reader(response):
+    # returns a function reading the undecoded HTTP body into a buffer, or
+    # None if the body has to be decoded or the installed urllib3 has no
+    # readinto (before 1.26). urllib3's errors are converted like requests'
+    # iter_content does, so that they are retried like any failed request
+    encoding = response.headers.get("Content-Encoding", "identity")
+    if encoding.lower() != "identity":
+        return None
+    readinto = getattr(response.raw, "readinto", None)
+    if readinto is None:
+        return None
+
+    def read(b):
+        try:
+            return readinto(b)
+        except ReadTimeoutError as e:
+            raise requests.ConnectionError(e, response=response)
+        except (ProtocolError, http_client.HTTPException, socket.error) as e:
+            raise requests.exceptions.ChunkedEncodingError(
+                e, response=response)
+    return read
+
+
+def _drop_cache(fd, end):
+    # releases cached pages of the file up to *end*
+    try:
+        _fadvise(fd, 0, end, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+def download_into(response, f, size=None, digest=None, drop_cache=False,
+                  abort=None, progress=None, limiter=None):
+    """
+    Downloads a file opened as ``requests.Response`` with ``stream=True``
+    into a file object without creating an object per chunk: the body is
+    read into a reusable buffer with ``readinto`` and written from there.
+    The amount read at once follows the throughput so that a read takes
+    about :py:data:`CHUNK_TIME` seconds, between :py:data:`MIN_CHUNK_SIZE`
+    and :py:data:`MAX_CHUNK_SIZE`. If the body is content-encoded, it is
+    read like in :py:func:`download_chunks`.
+
+    If *size* is given, at most *size* bytes are read. With *drop_cache*,
+    written data is released from the page cache every
+    :py:data:`DROP_CACHE_INTERVAL` bytes, so that downloading
+    huge files does not displace the cache of other processes. With a
+    *limiter*, every chunk is accounted for and chunks are kept small enough
+    for a smooth rate.
+
+    :param requests.Response response: the response object
+    :param f: the file object to write to, at its current position
+    :param int size: number of bytes expected
+    :param digest: hashlib object updated with the data
+    :param bool drop_cache: whether to bypass the page cache
+    :param threading.Event abort: stops the download when set
+    :param callable progress: called with the number of bytes of each
+                              chunk written
+    :param limiter: :py:class:`dectris_eiger.communication.BandwidthLimiter`
+                    of the transfer
+    :returns: number of bytes read
+    :rtype: int
+    """
+    readinto = _body_reader(response)
+    if readinto is None:
+        bytes_read = 0
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            if abort is not None and abort.is_set():
+                break
+            if size is not None:
+                chunk = chunk[:size - bytes_read]
+            f.write(chunk)
+            bytes_read += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            if progress is not None:
+                progress(len(chunk))
+            if limiter is not None:
+                limiter.consume(len(chunk))
+        return bytes_read
+    start = f.tell()
+    drop_cache = drop_cache and _fadvise is not None
+    buf = _read_buffer()
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+    bytes_read = dropped = 0
+    while size is None or bytes_read < size:
+        if abort is not None and abort.is_set():
+            break
+        if limiter is not None:
+            chunk_size = int(min(chunk_size, max(MIN_CHUNK_SIZE,
+                                                 limiter.rate * CHUNK_TIME)))
+        n = chunk_size if size is None else min(chunk_size, size - bytes_read)
+        t0 = time.time()
+        n = readinto(buf[:n])
+        if not n:
+            break
+        elapsed = time.time() - t0
+        chunk = buf[:n]
+        written = 0
+        while written < n:
+            written += f.write(chunk[written:]) or 0
+        bytes_read += n
+        if digest is not None:
+            digest.update(chunk)
+        if progress is not None:
+            progress(n)
+        if limiter is not None:
+            limiter.consume(n)
+        if elapsed > 0:
+            chunk_size = int(min(MAX_CHUNK_SIZE, max(
+                MIN_CHUNK_SIZE, (chunk_size + n / elapsed * CHUNK_TIME) / 2)))
+        if drop_cache and bytes_read - dropped >= 2 * DROP_CACHE_INTERVAL:
+            # the older half has most likely been written back by now
+            dropped = bytes_read - DROP_CACHE_INTERVAL
+            _drop_cache(f.fileno(), start + dropped)
+    if drop_cache:
+        f.flush()
+        os.fdatasync(f.fileno())
+        _drop_cache(f.fileno(), start + bytes_read)
+    _release_body(response)
     return bytes_read
 
 
+def _release_body(response):
+    # returns the connection of a response read with _body_reader to the
+    # pool if its body was read completely
+    if response.raw.closed:
+        response.raw.release_conn()
+
+
+def split_ranges(size, segments):
+    """
+    Splits *size* bytes into at most *segments* ranges of at least
+    :py:data:`MIN_SEGMENT_SIZE` bytes and returns them as ``[start, end,
+    done]`` lists, *done* being the number of bytes already downloaded.
+    """
+    segments = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    bounds = [i * size // segments for i in range(segments + 1)]
+    return [[bounds[i], bounds[i + 1], 0] for i in range(segments)]
+
+
+def preallocate(f, size):
+    """
+    Allocates *size* bytes for the file object *f*, so that segments can be
+    written at their offsets.
+    """
+    f.truncate(size)
+    fallocate = getattr(os, "posix_fallocate", None)
+    if fallocate is not None and size:
+        try:
+            fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass
+
+
+class _CRC32(object):
+    # hashlib-like interface to zlib.crc32
+
+    name = "crc32"
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        return "{0:08x}".format(self._value & 0xffffffff)
+
+
+def new_checksum(algorithm):
+    """
+    Returns a hash object with ``update`` and ``hexdigest`` methods for
+    *algorithm*, which is "crc32", "xxhash" (xxh64) or the name of an
+    algorithm of the ``xxhash`` package or of ``hashlib`` (like "sha256").
+    The xxhash algorithms require the ``xxhash`` package.
+
+    :raises ValueError: if the algorithm is unknown or not available
+    """
+    if algorithm == "crc32":
+        return _CRC32()
+    if algorithm.startswith("xxh"):
+        if xxhash is None:
+            raise ValueError("{0} requires the xxhash package".format(
+                algorithm))
+        constructor = getattr(xxhash, "xxh64" if algorithm == "xxhash"
+                              else algorithm, None)
+        if constructor is None:
+            raise ValueError("unknown algorithm {0}".format(algorithm))
+        return constructor()
+    return hashlib.new(algorithm)
+
+
+def file_digest(path, algorithm="md5"):
+    """
+    Returns the hex digest of a local file, see :py:func:`new_checksum` for
+    the algorithms.
+    """
+    digest = new_checksum(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fsync_file(path, drop_cache=False):
+    """
+    Flushes a local file to disk. With *drop_cache*, the file is also
+    released from the page cache, so that it is read back from the disk
+    afterwards.
+    """
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+        if drop_cache and _fadvise is not None:
+            _drop_cache(f.fileno(), os.fstat(f.fileno()).st_size)
+
+
+def is_master(filename):
+    """
+    Returns True if the file is the master file of a series.
+    """
+    return filename.endswith("_master.h5")
+
+
 class DataBufferError(Exception):
     pass
 
@@ -41,51 +349,948 @@ class UnknownDataFileError(DataBufferError):
     pass
 
 
+class IncompleteSeriesError(DataBufferError):
+    # a master file skipped because data files of its series failed
+    pass
+
+
+class _RangeIgnored(DataBufferError):
+    # the server answered a Range request with the whole file
+    pass
+
+
+class DownloadJournal(object):
+    """
+    Sidecar file recording the progress of a segmented download, so that an
+    interrupted download can be resumed. It stores the size and ETag of the
+    file (a changed file is downloaded anew) and the segments.
+    """
+
+    def __init__(self, path):
+        super(DownloadJournal, self).__init__()
+        self.path = path
+        self._saved = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, size, etag):
+        """
+        Returns the segments of an earlier download of the same file, or
+        None.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get("size") != size or data.get("etag") != etag:
+            return None
+        return data["segments"]
+
+    def save(self, size, etag, segments, force=True):
+        """
+        Writes the journal, unless *force* is False and it was written less
+        than :py:data:`JOURNAL_INTERVAL` seconds ago.
+        """
+        with self._lock:
+            if not force and time.time() - self._saved < JOURNAL_INTERVAL:
+                return
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"size": size, "etag": etag,
+                           "segments": segments}, f)
+            _replace(tmp, self.path)
+            self._saved = time.time()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Manifest(object):
+    """
+    Sizes and checksums of files downloaded into *target_dir*. They are
+    kept in one JSON file per series (e.g. ``series_1_manifest.json``, see
+    :py:func:`series_prefix`; files of no series go to
+    ``files_manifest.json``)::
+
+      {"algorithm": "sha256",
+       "files": {"series_1_data_000001.h5": {"size": 3291362,
+                                             "checksum": "9f86d0..."}}}
+
+    The checksums are computed while the files are received, so they cost
+    no extra reading; :py:meth:`verify` reads the files back to check them
+    later. Entries are added with :py:meth:`add` and written with
+    :py:meth:`save`, merged into an existing manifest of the same algorithm
+    (a manifest of another algorithm is replaced).
+
+    :param str target_dir: the directory of the downloaded files
+    :param str algorithm: the checksum algorithm
+    """
+
+    def __init__(self, target_dir, algorithm):
+        super(Manifest, self).__init__()
+        new_checksum(algorithm)  # raises ValueError for unknown algorithms
+        self.target_dir = target_dir
+        self.algorithm = algorithm
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def path(self, filename):
+        """
+        Returns the path of the manifest which lists a file.
+        """
+        return os.sep.join([self.target_dir, (series_prefix(filename) or
+                                              "files") + MANIFEST_SUFFIX])
+
+    def add(self, filename, size, checksum):
+        """
+        Records a file's size and checksum.
+        """
+        with self._lock:
+            self._changed.setdefault(self.path(filename), {})[filename] = {
+                "size": size, "checksum": checksum}
+
+    def save(self):
+        """
+        Writes the entries added since the last call into the manifests.
+        """
+        with self._lock:
+            changed, self._changed = self._changed, {}
+            for path, files in changed.items():
+                content = self.load(path)
+                if content.get("algorithm") != self.algorithm:
+                    content = {"algorithm": self.algorithm, "files": {}}
+                content["files"].update(files)
+                tmp_fn = path + ".tmp"
+                with open(tmp_fn, "w") as f:
+                    json.dump(content, f, indent=1, sort_keys=True)
+                _replace(tmp_fn, path)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns the content of a manifest file, or an empty dict if it does
+        not exist.
+        """
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return {}
+
+    @staticmethod
+    def verify(path):
+        """
+        Reads back the files listed in a manifest and returns a dict of the
+        ones which are missing or whose size or checksum differ, with the
+        reason.
+
+        :param str path: the manifest file
+        :rtype: dict
+        """
+        content = Manifest.load(path)
+        directory = os.path.dirname(path)
+        problems = {}
+        for filename, entry in content.get("files", {}).items():
+            fn = os.path.join(directory, filename)
+            if not os.path.exists(fn):
+                problems[filename] = "missing"
+            elif os.path.getsize(fn) != entry["size"]:
+                problems[filename] = "size mismatch"
+            elif file_digest(fn, content["algorithm"]) != entry["checksum"]:
+                problems[filename] = "checksum mismatch"
+        return problems
+
+
+class DownloadError(DataBufferError):
+    """
+    Raised by :py:meth:`EigerDataBuffer.download` if files could not be
+    downloaded. *report* is the :py:class:`DownloadReport` of the files that
+    were.
+    """
+
+    def __init__(self, report):
+        super(DownloadError, self).__init__(
+            "failed to download {0}".format(", ".join(sorted(report.errors))))
+        self.report = report
+
+
+class DeleteError(DataBufferError):
+    """
+    Raised by :py:meth:`EigerDataBuffer.delete` and related methods if files
+    could not be deleted. *report* is the :py:class:`DeleteReport`.
+    """
+
+    def __init__(self, report):
+        super(DeleteError, self).__init__(
+            "failed to delete {0}".format(", ".join(sorted(report.errors))))
+        self.report = report
+
+
+class DeleteReport(object):
+    """
+    Result of :py:meth:`EigerDataBuffer.delete`: *deleted* lists the files
+    deleted, *missing* the files which were already gone, *errors* maps the
+    files which could not be deleted to the exception raised, *elapsed* is
+    the wall time in seconds.
+    """
+
+    def __init__(self):
+        super(DeleteReport, self).__init__()
+        self.deleted = []
+        self.missing = []
+        self.errors = {}
+        self.elapsed = 0.0
+
+
+class DownloadReport(object):
+    """
+    Result of :py:meth:`EigerDataBuffer.download`: *files* lists the
+    ``(filename, size)`` of the downloaded files in download order, *errors*
+    maps the files which could not be downloaded to the exception raised,
+    *elapsed* is the wall time of the download in seconds. *deleted* lists
+    the files :py:meth:`EigerDataBuffer.drain` removed from the buffer.
+    """
+
+    def __init__(self):
+        super(DownloadReport, self).__init__()
+        self.files = []
+        self.errors = {}
+        self.deleted = []
+        self.elapsed = 0.0
+
+    @property
+    def nbytes(self):
+        """
+        Total number of bytes downloaded.
+        """
+        return sum(size for _, size in self.files)
+
+    @property
+    def throughput(self):
+        """
+        Aggregate throughput in bytes per second.
+        """
+        return self.nbytes / self.elapsed if self.elapsed else 0.0
+
+
+def _common_prefix(a, b, block=64 * 1024):
+    # length of the common prefix of two byte strings
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i + block] == b[i:i + block]:
+        i += block
+    if i >= n:
+        return n
+    lo, hi = i, min(i + block, n)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[lo:mid + 1] == b[lo:mid + 1]:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _common_suffix(a, b, limit, block=64 * 1024):
+    # length of the common suffix of two byte strings, at most limit
+    la, lb = len(a), len(b)
+    i = 0
+    while i < limit:
+        step = min(block, limit - i)
+        if a[la - i - step:la - i] != b[lb - i - step:lb - i]:
+            break
+        i += step
+    else:
+        return limit
+    lo, hi = i, i + step - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def glob_prefix(pattern):
+    """
+    Returns the literal part of a glob pattern before its first wildcard.
+    """
+    match = re.match(r"[^*?\[]*", pattern)
+    return match.group(0)
+
+
+class FileIndex(object):
+    """
+    Cached listing of the data buffer which is refreshed incrementally.
+
+    :py:meth:`refresh` sends a conditional request if the server gave an
+    ETag, and skips parsing if the list did not change. Otherwise the new
+    list is compared with the previous one byte-wise and only the part
+    between their common beginning and end is parsed, so appending or
+    deleting a few files among many is cheap. Each change increases
+    *version* and is recorded as a delta of added and removed names, see
+    :py:meth:`changes`. Glob queries (:py:meth:`match`) use compiled
+    patterns, look up the names sharing the pattern's literal prefix in a
+    sorted copy of the list and are cached until the list changes.
+
+    :param EigerClient client: the client of the DCU
+    :param str api_version: API version
+    :param float max_age: time in seconds for which a listing is used
+                          without asking the DCU (default: always ask)
+    :param int history: number of deltas kept for :py:meth:`changes`
+    """
+
+    def __init__(self, client, api_version="1.0.0", max_age=0.0,
+                 history=100):
+        super(FileIndex, self).__init__()
+        self._client = client
+        self._api_v = api_version
+        self.max_age = max_age
+        self.version = 0
+        self.names = ()
+        self._set = frozenset()
+        self._sorted = None
+        self._raw = None
+        self._plain = False
+        self._etag = None
+        self._fetched = None
+        self._deltas = collections.deque(maxlen=history)
+        self._patterns = {}
+        self._matches = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, filename):
+        return filename in self._set
+
+    def refresh(self, max_age=None, timeout=2.0):
+        """
+        Updates the listing unless it is younger than *max_age* seconds
+        (default: the index's *max_age*). Returns the names added and
+        removed.
+
+        :returns: added and removed names
+        :rtype: tuple
+        """
+        if max_age is None:
+            max_age = self.max_age
+        with self._lock:
+            if self._fetched is not None and \
+                    time.time() - self._fetched < max_age:
+                return (), ()
+            headers = {}
+            if self._etag is not None:
+                headers["If-None-Match"] = self._etag
+            response = self._client.request(
+                "GET", self._client.files_url(self._api_v), timeout=timeout,
+                headers=headers)
+            if response.status_code == 304:
+                self._fetched = time.time()
+                return (), ()
+            if response.status_code >= 400:
+                raise ResponseError(response)
+            self._fetched = time.time()
+            self._etag = response.headers.get("ETag")
+            raw = response.content
+            if raw == self._raw:
+                return (), ()
+            diff = self._diff(raw)
+            if diff is not None:
+                names, added, removed = diff
+                name_set = self._set.difference(removed).union(added)
+            else:
+                names = tuple(json.loads(raw.decode("utf-8")))
+                name_set = frozenset(names)
+                added = tuple(sorted(name_set.difference(self._set)))
+                removed = tuple(sorted(self._set.difference(name_set)))
+            self._raw = raw
+            # the byte-wise diff relies on commas separating names only
+            self._plain = b"\\" not in raw and \
+                raw.count(b",") == max(0, len(names) - 1)
+            if added or removed:
+                self._update(names, name_set, added, removed)
+            return added, removed
+
+    def _diff(self, raw):
+        # returns the new names and the names added and removed by parsing
+        # only the part of *raw* which differs from the previous listing, or
+        # None if that is not possible
+        old = self._raw
+        if not self._plain or not self.names or b"\\" in raw or \
+                raw[:1] != b"[" or raw[-1:] != b"]":
+            return None
+        prefix = _common_prefix(old, raw)
+        suffix = _common_suffix(old, raw, min(len(old), len(raw)) - prefix)
+        # names before the last comma of the common prefix and after the
+        # first comma of the common suffix are unchanged
+        head = old.count(b",", 0, prefix)
+        tail = old.count(b",", len(old) - suffix)
+        start = old.rfind(b",", 0, prefix) + 1 if head else old.find(b"[") + 1
+        old_end = old.find(b",", len(old) - suffix) if tail else len(old)
+        new_end = raw.find(b",", len(raw) - suffix) if tail else len(raw)
+        if not tail:
+            old_end = old.rfind(b"]")
+            new_end = raw.rfind(b"]")
+        try:
+            removed = json.loads("[{0}]".format(
+                old[start:old_end].decode("utf-8")))
+            added = json.loads("[{0}]".format(
+                raw[start:new_end].decode("utf-8")))
+        except ValueError:
+            return None
+        names = self.names[:head] + tuple(added) + \
+            self.names[len(self.names) - tail:len(self.names)]
+        if len(names) != raw.count(b",") + 1:
+            return None
+        changed = set(added).symmetric_difference(removed)
+        return (names, tuple(sorted(changed.intersection(added))),
+                tuple(sorted(changed.intersection(removed))))
+
+    def _update(self, names, name_set, added, removed):
+        # publishes a new listing, readers see either the old or the new
+        self.names = names
+        self._set = name_set
+        self._sorted = None
+        self._matches = {}
+        self.version += 1
+        self._deltas.append((self.version, added, removed))
+
+    def changes(self, since):
+        """
+        Returns the names added and removed since the given *version*, or
+        None if that version is too old to be covered by the deltas kept.
+
+        :param int since: a previous value of *version*
+        :returns: added and removed names
+        :rtype: tuple
+        """
+        deltas = [d for d in list(self._deltas) if d[0] > since]
+        if since < self.version and (not deltas or deltas[0][0] != since + 1):
+            return None
+        added, removed = set(), set()
+        for _, delta_added, delta_removed in deltas:
+            added.difference_update(delta_removed)
+            removed.difference_update(delta_added)
+            added.update(delta_added)
+            removed.update(delta_removed)
+        return sorted(added), sorted(removed)
+
+    def match(self, pattern):
+        """
+        Returns the names matching a glob pattern in sorted order.
+        """
+        cached = self._matches.get(pattern)
+        if cached is not None and cached[0] == self.version:
+            return list(cached[1])
+        version, names = self.version, self._sorted_names()
+        regex = self._patterns.get(pattern)
+        if regex is None:
+            regex = re.compile(fnmatch.translate(pattern))
+            self._patterns[pattern] = regex
+        prefix = glob_prefix(pattern)
+        if prefix:
+            start = bisect.bisect_left(names, prefix)
+            end = bisect.bisect_left(names, prefix + u"\U0010ffff")
+            names = names[start:end]
+        result = tuple(n for n in names if regex.match(n))
+        self._matches[pattern] = (version, result)
+        return list(result)
+
+    def _sorted_names(self):
+        names = self._sorted
+        if names is None or names[0] != self.version:
+            names = (self.version, sorted(self.names))
+            self._sorted = names
+        return names[1]
+
+
+def name_regex(name_pattern):
+    """
+    Returns a compiled regular expression matching the master and data
+    files written with the file writer's *name_pattern*. It has the groups
+    "id" (the series id, if the pattern contains ``$id``), "master" and
+    "chunk" (the number of a data file).
+    """
+    parts = [re.escape(part) for part in name_pattern.split("$id")]
+    regex = parts[0]
+    if len(parts) > 1:
+        regex += r"(?P<id>\d+)" + r"(?P=id)".join(parts[1:])
+    return re.compile(regex + r"_(?:(?P<master>master)|data_(?P<chunk>\d+))"
+                      r"\.h5$")
+
+
+class _Series(object):
+    # files of one series: the master file's name and the data files' names
+    # by chunk number
+
+    __slots__ = ("master", "chunks", "last")
+
+    def __init__(self):
+        self.master = None
+        self.chunks = {}
+        self.last = 0
+
+
+class SeriesIndex(object):
+    """
+    Files of the data buffer grouped by series. Names are parsed with the
+    file writer's *name_pattern*, in which ``$id`` is replaced by the series
+    id, into series id, role and chunk number::
+
+      series_12_master.h5        ->  (12, "master", None)
+      series_12_data_000003.h5   ->  (12, "data", 3)
+
+    Files not following the pattern are ignored. Looking up a series is a
+    dictionary access and :py:meth:`sync` applies the changes of a
+    :py:class:`FileIndex` since the last sync, so queries stay cheap for
+    large buffers::
+
+      series = detector.buffer.series
+      if series.is_complete(12):
+          detector.buffer.download_series(12, "/data/beamtime")
+
+    :param str name_pattern: the file writer's name pattern
+    :param int images_per_file: the file writer's nimages_per_file (0 for
+                                all images in one file)
+    :param int image_nr_start: number of the first image of a series
+    """
+
+    def __init__(self, name_pattern="series_$id", images_per_file=1000,
+                 image_nr_start=1):
+        super(SeriesIndex, self).__init__()
+        self.name_pattern = name_pattern
+        self.images_per_file = images_per_file
+        self.image_nr_start = image_nr_start
+        self.version = None
+        self._regex = name_regex(name_pattern)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._series)
+
+    def __iter__(self):
+        return iter(self.series_ids())
+
+    def __contains__(self, series_id):
+        return series_id in self._series
+
+    def parse(self, filename):
+        """
+        Parses a file name into series id, role ("master" or "data") and
+        chunk number (None for master files). Returns None for files not
+        following the name pattern.
+
+        :rtype: tuple
+        """
+        match = self._regex.match(filename)
+        if match is None:
+            return None
+        series_id = match.group("id") if "id" in self._regex.groupindex \
+            else None
+        if series_id is not None:
+            series_id = int(series_id)
+        if match.group("master"):
+            return series_id, "master", None
+        return series_id, "data", int(match.group("chunk"))
+
+    def add(self, filenames):
+        """
+        Adds files to the index.
+        """
+        with self._lock:
+            for filename in filenames:
+                parsed = self.parse(filename)
+                if parsed is None:
+                    continue
+                series_id, role, chunk = parsed
+                series = self._series.get(series_id)
+                if series is None:
+                    series = self._series[series_id] = _Series()
+                if role == "master":
+                    series.master = filename
+                else:
+                    series.chunks[chunk] = filename
+                    series.last = max(series.last, chunk)
+
+    def remove(self, filenames):
+        """
+        Removes files from the index.
+        """
+        with self._lock:
+            for filename in filenames:
+                parsed = self.parse(filename)
+                if parsed is None or parsed[0] not in self._series:
+                    continue
+                series_id, role, chunk = parsed
+                series = self._series[series_id]
+                if role == "master":
+                    if series.master == filename:
+                        series.master = None
+                elif series.chunks.get(chunk) == filename:
+                    del series.chunks[chunk]
+                    if chunk == series.last:
+                        series.last = max(series.chunks) \
+                            if series.chunks else 0
+                if series.master is None and not series.chunks:
+                    del self._series[series_id]
+
+    def sync(self, index):
+        """
+        Brings the index up to date with a :py:class:`FileIndex`, applying
+        only the names added and removed since the last sync where
+        possible.
+
+        :param FileIndex index: the listing of the buffer
+        """
+        with index._lock:
+            version, names = index.version, index.names
+            delta = None if self.version is None \
+                else index.changes(self.version)
+        if version == self.version:
+            return
+        if delta is None:
+            with self._lock:
+                self._series = {}
+            self.add(names)
+        else:
+            self.remove(delta[1])
+            self.add(delta[0])
+        self.version = version
+
+    def series_ids(self):
+        """
+        Returns the ids of the series in the buffer in ascending order.
+        """
+        return sorted(self._series, key=lambda i: (i is None, i))
+
+    def master(self, series_id):
+        """
+        Returns the name of a series' master file, or None if it is not in
+        the buffer.
+        """
+        series = self._series.get(series_id)
+        return series.master if series is not None else None
+
+    def data_files(self, series_id):
+        """
+        Returns the names of a series' data files in chunk order.
+        """
+        series = self._series.get(series_id)
+        if series is None:
+            return []
+        return [series.chunks[c] for c in sorted(series.chunks)]
+
+    def files(self, series_id):
+        """
+        Returns the names of all files of a series, data files in chunk order
+        followed by the master file.
+        """
+        files = self.data_files(series_id)
+        master = self.master(series_id)
+        if master is not None:
+            files.append(master)
+        return files
+
+    def is_complete(self, series_id, nimages=None):
+        """
+        Whether all files of a series are in the buffer: its master file
+        and the data files numbered 1 to the highest number present, or,
+        if *nimages* is given, as many data files as needed for *nimages*
+        images.
+
+        :param int series_id: the series id
+        :param int nimages: number of images of the series
+        :rtype: bool
+        """
+        series = self._series.get(series_id)
+        if series is None or series.master is None:
+            return False
+        expected = series.last
+        if nimages is not None:
+            expected = self._chunk(nimages - 1 + self.image_nr_start) \
+                if nimages else 0
+        return len(series.chunks) == series.last == expected
+
+    def image_file(self, series_id, image_nr):
+        """
+        Returns the name of the data file holding an image, or None if it
+        is not in the buffer. Images are numbered from *image_nr_start*.
+
+        :param int series_id: the series id
+        :param int image_nr: the image number
+        :rtype: str
+        """
+        if image_nr < self.image_nr_start:
+            raise ValueError("image numbers start at {0}".format(
+                self.image_nr_start))
+        series = self._series.get(series_id)
+        if series is None:
+            return None
+        return series.chunks.get(self._chunk(image_nr))
+
+    def _chunk(self, image_nr):
+        # number of the data file holding an image
+        if not self.images_per_file:
+            return 1
+        return (image_nr - self.image_nr_start) // self.images_per_file + 1
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only, seekable file object for a file in the data buffer, which
+    reads the requested parts with HTTP range requests instead of
+    downloading the whole file. It can be passed to libraries reading file
+    objects, e.g. to read single frames of a data file with h5py::
+
+      with detector.buffer.open_file("series_1_data_000001.h5") as f:
+          with h5py.File(f, "r") as h5:
+              frame = h5["entry/data/data"][42]
+
+    Small reads are served from a cache of *cache_blocks* blocks of
+    *block_size* bytes (least recently used blocks are evicted), missing
+    blocks of a read are fetched with one request. Reads larger than the
+    cache go directly into the caller's buffer. If the file changes on the
+    DCU while it is open, reads raise :py:class:`DataBufferError`.
+
+    :param EigerClient client: the client of the DCU
+    :param str filename: Data file name
+    :param int block_size: size of a cached block in bytes
+    :param int cache_blocks: number of cached blocks
+    :raises UnknownDataFileError: if the data file can not be found
+    """
+
+    def __init__(self, client, filename, block_size=BLOCK_SIZE,
+                 cache_blocks=CACHE_BLOCKS):
+        super(RemoteFile, self).__init__()
+        self.name = filename
+        self.mode = "rb"
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self._client = client
+        self._url = client.data_url(filename)
+        head = client.request("HEAD", self._url)
+        if head.status_code != 200:
+            raise UnknownDataFileError(filename)
+        self.size = int(head.headers.get("Content-Length", 0))
+        self._etag = head.headers.get("ETag")
+        self._pos = 0
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("invalid whence {0}".format(whence))
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self._pos = offset
+        return offset
+
+    def read(self, size=-1):
+        self._checkClosed()
+        if size is None or size < 0:
+            size = max(0, self.size - self._pos)
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        del buf[n:]
+        return bytes(buf)
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        self._checkClosed()
+        view = memoryview(b)
+        if view.format != "B" or view.ndim != 1:
+            view = view.cast("B")
+        with self._lock:
+            pos = self._pos
+            n = max(0, min(len(view), self.size - pos))
+            if n >= self.block_size * self.cache_blocks:
+                self._fetch(pos, view[:n])
+            else:
+                done = 0
+                last = (pos + n - 1) // self.block_size
+                while done < n:
+                    index, offset = divmod(pos + done, self.block_size)
+                    block = self._block(index, last)
+                    k = min(n - done, len(block) - offset)
+                    view[done:done + k] = block[offset:offset + k]
+                    done += k
+            self._pos = pos + n
+        return n
+
+    def close(self):
+        self._blocks.clear()
+        super(RemoteFile, self).close()
+
+    def _block(self, index, last):
+        # returns a block, fetching it with the missing blocks following it
+        # up to *last*
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.pop(index)
+            self._blocks[index] = block
+            return block
+        end = index + 1
+        while end <= last and end - index < self.cache_blocks and \
+                end not in self._blocks:
+            end += 1
+        start = index * self.block_size
+        data = memoryview(bytearray(min(end * self.block_size, self.size) -
+                                    start))
+        self._fetch(start, data)
+        for i in range(index, end):
+            offset = (i - index) * self.block_size
+            self._blocks[i] = data[offset:offset + self.block_size]
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return self._blocks[index]
+
+    def _fetch(self, start, view):
+        # reads len(view) bytes from *start* into view
+        headers = {"Range": "bytes={0}-{1}".format(start,
+                                                   start + len(view) - 1)}
+        if self._etag:
+            headers["If-Range"] = self._etag
+        response = self._client.request("GET", self._url, stream=True,
+                                        headers=headers)
+        try:
+            if response.status_code == 200:
+                raise DataBufferError(
+                    "{0}: file changed or ranges not supported".format(
+                        self.name))
+            elif response.status_code != 206:
+                raise UnknownDataFileError(self.name)
+            readinto = _body_reader(response)
+            done = 0
+            if readinto is not None:
+                while done < len(view):
+                    n = readinto(view[done:done + DOWNLOAD_CHUNK_SIZE])
+                    if not n:
+                        break
+                    done += n
+                    if self._client.limiter is not None:
+                        self._client.limiter.consume(n)
+                _release_body(response)
+            else:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    chunk = chunk[:len(view) - done]
+                    view[done:done + len(chunk)] = chunk
+                    done += len(chunk)
+                    if self._client.limiter is not None:
+                        self._client.limiter.consume(len(chunk))
+        finally:
+            response.close()
+        if done < len(view):
+            raise DataBufferError("{0}: received {1} of {2} bytes".format(
+                self.name, done, len(view)))
+
+
 class EigerDataBuffer(object):
     """
     Interface to the detector's data buffer which is accessible via WebDAV.
+
+    Downloaded files of at least *drop_cache_size* bytes (default: None,
+    i.e. no limit) are written without keeping them in the page cache, see
+    :py:func:`download_into`.
     """
 
     _base_dir = "/data"
 
-    def __init__(self, host, port=80, api_version="1.0.0"):
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
         super(EigerDataBuffer, self).__init__()
         self._host = host
         self._port = port
         self._api_v = api_version
+        if client is None:
+            client = get_client(host, port)
+        self._client = client
+        self.index = FileIndex(client, api_version)
+        self.drop_cache_size = None
+        self._series = None
 
     def list_files(self):
         """
-        Returns a list of all files in the data buffer.
+        Returns a list of all files in the data buffer. The listing is kept
+        in :py:attr:`index` and only re-read as far as it changed.
 
         :returns: list of files in the buffer
         :rtype: list of string
         """
+        self.index.refresh()
+        return list(self.index.names)
 
-        if self._port == -1:
-            fmt_data = {"host": self._host,
-                        "api_version": self._api_v
-                        }
-            url = ("http://{host}/filewriter/api/"
-                   "{api_version}/files").format(**fmt_data)
-        else:
-            fmt_data = {"host": self._host,
-                        "port": self._port,
-                        "api_version": self._api_v
-                        }
-        
-            url = ("http://{host}:{port}/filewriter/api/"
-                   "{api_version}/files").format(**fmt_data)
-        
-        response = requests.get(url)
-        filenames = json.loads(response.text)
-        return filenames
+    def match(self, filename_pattern):
+        """
+        Returns the files in the data buffer matching a glob pattern, in
+        sorted order.
+
+        :param str filename_pattern: Filename or glob pattern
+        :rtype: list of string
+        """
+        self.index.refresh()
+        return self.index.match(filename_pattern)
 
     files = property(list_files)
 
+    def _drop_cache(self, size):
+        # whether a download of *size* bytes is to bypass the page cache
+        return self.drop_cache_size is not None and size is not None and \
+            int(size) >= self.drop_cache_size
+
+    def get_series_index(self, timeout=2.0):
+        """
+        Returns the buffer's files grouped by series as a
+        :py:class:`SeriesIndex`, using the file writer's current name
+        pattern, images per file and first image number.
+
+        :param float timeout: communication timeout in seconds
+        :rtype: SeriesIndex
+        """
+        config = [self._client.get_value(self._api_v, "filewriter", "config",
+                                         key, timeout=timeout)
+                  for key in ("name_pattern", "nimages_per_file",
+                              "image_nr_start")]
+        series = self._series
+        if series is None or [series.name_pattern, series.images_per_file,
+                              series.image_nr_start] != config:
+            series = SeriesIndex(*config)
+            self._series = series
+        self.index.refresh()
+        series.sync(self.index)
+        return series
+    series = property(get_series_index)
+
     def get_file(self, filename):
         """
-        Downloads a file's content and returns it.
+        Downloads a file's content and returns it. This keeps the whole file
+        in memory, use :py:meth:`open_file` or :py:meth:`iter_file` for
+        large files.
 
         :param str filename: Data file name
         :returns: The file's content
@@ -93,98 +1298,870 @@ class EigerDataBuffer(object):
         :raises UnknownDataFileError: if the data file can not be found
         """
 
-        if self._port == -1:
-            fmt_data = {"host": self._host,
-                        "filename": filename
-                        }
-            url = "http://{host}/data/{filename}".format(**fmt_data)
-        else:
-            fmt_data = {"host": self._host,
-                        "port": self._port,
-                        "filename": filename
-                        }
-            url = "http://{host}:{port}/data/{filename}".format(**fmt_data)
+        url = self._client.data_url(filename)
 
-        response = requests.get(url)
+        response = self._client.request("GET", url)
         if response.status_code == 200:
             return response.content
         else:
             raise UnknownDataFileError(filename)
 
-    def download_file(self, filename, target_dir):
+    def open_file(self, filename, block_size=BLOCK_SIZE,
+                  cache_blocks=CACHE_BLOCKS):
+        """
+        Opens a file in the buffer for reading without downloading it, see
+        :py:class:`RemoteFile`.
+
+        :param str filename: Data file name
+        :param int block_size: size of a cached block in bytes
+        :param int cache_blocks: number of cached blocks
+        :returns: read-only, seekable file object
+        :rtype: RemoteFile
+        :raises UnknownDataFileError: if the data file can not be found
+        """
+        return RemoteFile(self._client, filename, block_size, cache_blocks)
+
+    def iter_file(self, filename, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Yields a file's content in chunks of up to *chunk_size* bytes while
+        it is downloaded::
+
+          for chunk in buffer.iter_file("series_1_master.h5"):
+              archive.write(chunk)
+
+        :param str filename: Data file name
+        :param int chunk_size: maximum size of a chunk in bytes
+        :raises UnknownDataFileError: if the data file can not be found
+        """
+        url = self._client.data_url(filename)
+
+        response = self._client.request("GET", url, stream=True)
+        try:
+            if response.status_code != 200:
+                raise UnknownDataFileError(filename)
+            for chunk in response.iter_content(chunk_size):
+                if self._client.limiter is not None:
+                    self._client.limiter.consume(len(chunk))
+                yield chunk
+        finally:
+            response.close()
+
+    def download_file(self, filename, target_dir, segments=1, resume=False,
+                      checksum=None):
         """
         Downloads a file's content into a file with the same name in the
         given target directory.
 
+        With *segments* > 1 or *resume* set, the file is downloaded with
+        byte range requests: up to *segments* ranges of at least
+        :py:data:`MIN_SEGMENT_SIZE` bytes are fetched in parallel into a
+        preallocated ``.part`` file, which is renamed when complete. The
+        progress is recorded in a ``.part.json`` journal, so that calling
+        the method again after an interruption only downloads the missing
+        bytes. If the server does not support ranges, the file is downloaded
+        as a whole.
+
+        With *checksum* set to an algorithm (see :py:func:`new_checksum`),
+        the file's checksum is recorded with its size in the series'
+        :py:class:`Manifest` in *target_dir*. It is computed while the data
+        is received, except for ranged downloads, whose file is hashed once
+        complete.
+
         :param str filename: Data file name
         :param str target_dir: Local directory to save the file in
+        :param int segments: number of ranges downloaded in parallel
+        :param bool resume: whether to download resumably with one segment
+        :param str checksum: checksum algorithm
+        :returns: number of bytes downloaded
+        :rtype: int
         :raises UnknownDataFileError: if the data file can not be found
         """
-        if self._port == -1:
-            fmt_data = {"host": self._host,
-                        "filename": filename
-                        }
-            url = "http://{host}/data/{filename}".format(**fmt_data)
-        else:
-            fmt_data = {"host": self._host,
-                        "port": self._port,
-                        "filename": filename
-                        }
-            url = "http://{host}:{port}/data/{filename}".format(**fmt_data)
+        if checksum is None:
+            return self._fetch_file(filename, target_dir, segments,
+                                    resume)[0]
+        manifest = Manifest(target_dir, checksum)
+        size, digest = self._fetch_file(filename, target_dir, segments,
+                                        resume, checksum)
+        manifest.add(filename, size, digest)
+        manifest.save()
+        return size
 
-        response = requests.get(url)
-        if response.status_code == 200:
-            target_fn = os.sep.join([target_dir, filename])
-            with open(target_fn, "wb") as f:
-                download_chunks(response, f)
-        else:
+    def _fetch_file(self, filename, target_dir, segments=1, resume=False,
+                    checksum=None, announced=False):
+        # downloads a file and returns its size and, if an algorithm is
+        # given, its checksum; with *announced*, files whose size the DCU
+        # does not announce fail
+        target_fn = os.sep.join([target_dir, filename])
+        if segments > 1 or resume:
+            size = self._download_ranged(filename, target_fn, segments,
+                                         announced)
+            return size, \
+                file_digest(target_fn, checksum) if checksum else None
+        digest = new_checksum(checksum) if checksum else None
+        size = self._download_whole(filename, target_fn, digest, announced)
+        return size, digest.hexdigest() if digest is not None else None
+
+    def _download_whole(self, filename, target_fn, digest=None,
+                        announced=False):
+        url = self._client.data_url(filename)
+
+        with self._client.transfer_slots:
+            response = self._client.request("GET", url, stream=True)
+            try:
+                if response.status_code != 200:
+                    raise UnknownDataFileError(filename)
+                expected = response.headers.get("Content-Length")
+                if expected is not None:
+                    expected = int(expected)
+                elif announced:
+                    raise DataBufferError(
+                        "{0}: size not announced".format(filename))
+                with open(target_fn, "wb", 0) as f:
+                    if expected:
+                        preallocate(f, expected)
+                    size = download_into(response, f, expected, digest,
+                                         self._drop_cache(expected),
+                                         limiter=self._client.limiter)
+                    if expected is not None and size < expected:
+                        f.truncate(size)
+            finally:
+                response.close()
+        if expected is not None and expected != size:
+            raise DataBufferError("{0}: received {1} of {2} bytes".format(
+                filename, size, expected))
+        return size
+
+    def _download_ranged(self, filename, target_fn, segments,
+                         announced=False):
+        url = self._client.data_url(filename)
+        part_fn = target_fn + PART_SUFFIX
+        journal = DownloadJournal(target_fn + JOURNAL_SUFFIX)
+
+        head = self._client.request("HEAD", url)
+        if head.status_code != 200:
             raise UnknownDataFileError(filename)
+        size = int(head.headers.get("Content-Length", 0))
+        etag = head.headers.get("ETag")
+        if "bytes" not in head.headers.get("Accept-Ranges", "") or not size:
+            return self._download_whole(filename, target_fn,
+                                        announced=announced)
+
+        parts = None
+        if os.path.exists(part_fn) and os.path.getsize(part_fn) == size:
+            parts = journal.load(size, etag)
+        if parts is None:
+            parts = split_ranges(size, segments)
+            with open(part_fn, "wb") as f:
+                preallocate(f, size)
+            journal.save(size, etag, parts)
+
+        abort = threading.Event()
+
+        drop_cache = self._drop_cache(size)
+
+        def fetch(part):
+            self._fetch_segment(url, part_fn, part, etag, abort,
+                                lambda: journal.save(size, etag, parts,
+                                                     force=False),
+                                drop_cache)
+
+        pending = [part for part in parts if part[0] + part[2] < part[1]]
+        errors = []
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                futures = [pool.submit(fetch, part) for part in pending]
+                wait(futures, return_when=FIRST_EXCEPTION)
+                if any(f.done() and f.exception() for f in futures):
+                    abort.set()
+                errors = [f.exception() for f in futures if f.exception()]
+        else:
+            for part in pending:
+                try:
+                    fetch(part)
+                except Exception as e:
+                    errors.append(e)
+        if any(isinstance(e, _RangeIgnored) for e in errors):
+            journal.remove()
+            os.remove(part_fn)
+            return self._download_whole(filename, target_fn,
+                                        announced=announced)
+        journal.save(size, etag, parts)
+        if errors:
+            raise errors[0]
+        _replace(part_fn, target_fn)
+        journal.remove()
+        return size
+
+    def _fetch_segment(self, url, part_fn, part, etag, abort, progress,
+                       drop_cache=False):
+        # downloads the missing bytes of a [start, end, done] segment into
+        # the part file, updating done as the data is written
+        start, end = part[0], part[1]
+
+        def advance(n):
+            part[2] += n
+            progress()
 
-    def download(self, filename_pattern, target_dir):
+        for attempt in range(1, SEGMENT_ATTEMPTS + 1):
+            offset = start + part[2]
+            if offset >= end or abort.is_set():
+                return
+            headers = {"Range": "bytes={0}-{1}".format(offset, end - 1)}
+            if etag:
+                headers["If-Range"] = etag
+            try:
+                with self._client.transfer_slots:
+                    response = self._client.request("GET", url, stream=True,
+                                                    headers=headers)
+                    try:
+                        if response.status_code == 200:
+                            raise _RangeIgnored(url)
+                        elif response.status_code != 206:
+                            raise UnknownDataFileError(url)
+                        with open(part_fn, "r+b", 0) as f:
+                            f.seek(offset)
+                            download_into(response, f, end - offset,
+                                          drop_cache=drop_cache, abort=abort,
+                                          progress=advance,
+                                          limiter=self._client.limiter)
+                        if abort.is_set():
+                            return
+                    finally:
+                        response.close()
+            except requests.RequestException:
+                if attempt == SEGMENT_ATTEMPTS:
+                    raise
+        if start + part[2] < end:
+            raise DataBufferError("{0}: incomplete range {1}-{2}".format(
+                url, start + part[2], end - 1))
+
+    def download(self, filename_pattern, target_dir, workers=1,
+                 callback=None, segments=1, resume=False, checksum=None):
         """
         Similar to :py:meth:`.download_file`, but performs glob (*) expansion
         on the filename. All files matching the filename pattern are downloaded
         into the given directory.
         This can be used to download all files of a series::
 
-          buffer.download("series_1*", "/tmp")
+          buffer.download("series_1*", "/tmp", workers=4)
+
+        Data files are downloaded in name order by up to *workers* threads
+        (at most the client's ``max_transfers`` at a time). Master files are
+        downloaded after all data files, so that a series' master file on
+        disk means its data files are complete, and are retried up to
+        :py:data:`MASTER_ATTEMPTS` times. The master file of a series with a
+        failed data file is not downloaded (and reported as
+        :py:class:`IncompleteSeriesError`). A failed file does not stop the
+        others, all failures are raised together at the end.
 
         :param str filename_pattern: Filename or glob pattern
         :param str target_dir: Local directory to save the file(s) in
+        :param int workers: number of files downloaded concurrently
+        :param callable callback: called with the name and size of each
+                                  downloaded file, in download order
+        :param int segments: number of ranges of a file downloaded in
+                             parallel, see :py:meth:`download_file`
+        :param bool resume: whether to download files resumably
+        :param str checksum: checksum algorithm, see :py:meth:`download_file`
+        :returns: report with the files downloaded and the throughput
+        :rtype: DownloadReport
+        :raises DownloadError: if any file could not be downloaded
+        """
+        return self._download(self.match(filename_pattern), target_dir,
+                              workers, callback, segments, resume, checksum)
+
+    def download_series(self, series_id, target_dir, **kwargs):
+        """
+        Downloads all files of a series (see :py:class:`SeriesIndex`) like
+        :py:meth:`download`, which takes the same keyword arguments.
+
+        :param int series_id: the series id
+        :param str target_dir: Local directory to save the files in
+        :rtype: DownloadReport
+        """
+        return self._download(self.series.files(series_id), target_dir,
+                              **kwargs)
+
+    def _download(self, filenames, target_dir, workers=1, callback=None,
+                  segments=1, resume=False, checksum=None):
+        manifest = Manifest(target_dir, checksum) if checksum else None
+
+        def fetch(filename):
+            size, digest = self._fetch_file(filename, target_dir, segments,
+                                            resume, checksum)
+            if manifest is not None:
+                manifest.add(filename, size, digest)
+            return size
+
+        try:
+            return self._transfer(filenames, fetch, workers, callback)
+        finally:
+            if manifest is not None:
+                manifest.save()
+
+    def drain(self, filename_pattern, target_dir, workers=4, callback=None,
+              segments=1, verify="size"):
         """
-        filenames = fnmatch.filter(self.files, filename_pattern)
-        for filename in filenames:
-            self.download_file(filename, target_dir)
+        Moves the files matching the pattern from the buffer into the given
+        directory: each file is downloaded, flushed to disk, verified and
+        deleted from the buffer as soon as its copy is safe, so that buffer
+        space is freed continuously. Files which fail to download or verify
+        stay in the buffer. Files are processed like in :py:meth:`download`
+        (master files last)::
+
+          buffer.drain("series_1_*", "/data/beamtime", workers=4)
+
+        The number of bytes received is compared with the size announced by
+        the DCU (the Content-Length, files without one are not deleted) and
+        with the size of the copy on disk. With *verify* set to a checksum
+        algorithm (like "crc32" or "sha256", see :py:func:`new_checksum`)
+        the files' checksums are additionally computed while receiving them
+        (for segmented downloads from the complete file) and recorded in the
+        series' :py:class:`Manifest`; before a file is deleted, its copy is
+        released from the page cache, read back from the disk and compared
+        with the recorded checksum.
+
+        :param str filename_pattern: Filename or glob pattern
+        :param str target_dir: Local directory to save the file(s) in
+        :param int workers: number of files processed concurrently
+        :param callable callback: called with the name and size of each
+                                  drained file, in download order
+        :param int segments: number of ranges of a file downloaded in
+                             parallel, see :py:meth:`download_file`
+        :param str verify: "size" or a checksum algorithm
+        :returns: report with the files drained and the throughput
+        :rtype: DownloadReport
+        :raises DownloadError: if any file could not be drained
+        """
+        return self._drain(self.match(filename_pattern), target_dir, workers,
+                           callback, segments, verify)
+
+    def drain_series(self, series_id, target_dir, **kwargs):
+        """
+        Moves all files of a series (see :py:class:`SeriesIndex`) from the
+        buffer like :py:meth:`drain`, which takes the same keyword arguments.
+
+        :param int series_id: the series id
+        :param str target_dir: Local directory to save the files in
+        :rtype: DownloadReport
+        """
+        return self._drain(self.series.files(series_id), target_dir,
+                           **kwargs)
+
+    def _drain(self, filenames, target_dir, workers=4, callback=None,
+               segments=1, verify="size"):
+        manifest = Manifest(target_dir, verify) if verify != "size" \
+            else None
+        deleted = []
+
+        def fetch(filename):
+            size = self._move_file(filename, target_dir, segments, manifest)
+            deleted.append(filename)
+            return size
+
+        try:
+            return self._transfer(filenames, fetch, workers, callback,
+                                  deleted)
+        finally:
+            if manifest is not None:
+                manifest.save()
+
+    def _move_file(self, filename, target_dir, segments=1, manifest=None):
+        # downloads, flushes and verifies a file, records it in the manifest
+        # and deletes it from the buffer; the size received was checked
+        # against the Content-Length, the copy is read back from the disk
+        target_fn = os.sep.join([target_dir, filename])
+        size, digest = self._fetch_file(
+            filename, target_dir, segments,
+            checksum=manifest.algorithm if manifest is not None else None,
+            announced=True)
+        fsync_file(target_fn, drop_cache=manifest is not None)
+        if os.path.getsize(target_fn) != size:
+            raise DataBufferError("{0}: size mismatch".format(filename))
+        if manifest is not None and \
+                file_digest(target_fn, manifest.algorithm) != digest:
+            raise DataBufferError("{0}: checksum mismatch".format(filename))
+        if manifest is not None:
+            manifest.add(filename, size, digest)
+        self.delete_file(filename)
+        return size
+
+    def _transfer(self, filenames, fetch, workers, callback, deleted=None):
+        # runs fetch for the given files: data files in name order by up to
+        # *workers* threads, then master files with retries, except those of
+        # series with a failed data file
+        data_files = [f for f in filenames if not is_master(f)]
+        master_files = [f for f in filenames if is_master(f)]
+        report = DownloadReport()
+        if deleted is not None:
+            report.deleted = deleted
+        t0 = time.time()
+
+        def record(filename, result):
+            try:
+                size = result()
+            except Exception as e:
+                report.errors[filename] = e
+                return
+            report.files.append((filename, size))
+            if callback is not None:
+                callback(filename, size)
+
+        workers = min(workers, len(data_files))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [(filename, pool.submit(fetch, filename))
+                           for filename in data_files]
+                for filename, future in futures:
+                    record(filename, future.result)
+        else:
+            for filename in data_files:
+                record(filename, lambda: fetch(filename))
+        failed = set(series_prefix(f) for f in report.errors)
+        for filename in master_files:
+            if series_prefix(filename) in failed:
+                report.errors[filename] = IncompleteSeriesError(
+                    "{0} not transferred, data files of its series failed: "
+                    "{1}".format(filename, ", ".join(sorted(
+                        f for f in report.errors
+                        if series_prefix(f) == series_prefix(filename)))))
+                continue
+            record(filename, lambda: self._fetch_master(fetch, filename))
+        report.elapsed = time.time() - t0
+        if report.errors:
+            raise DownloadError(report)
+        return report
+
+    def _fetch_master(self, fetch, filename):
+        for attempt in range(1, MASTER_ATTEMPTS + 1):
+            try:
+                return fetch(filename)
+            except (requests.RequestException, DataBufferError) as e:
+                if attempt == MASTER_ATTEMPTS or \
+                        isinstance(e, UnknownDataFileError):
+                    raise
 
     def delete_file(self, filename):
         """
-        Deletes the file given by the filename from the buffer.
+        Deletes the file given by the filename from the buffer. Returns
+        False if the file did not exist.
 
         :param str filename: Data file to delete
+        :rtype: bool
+        :raises ResponseError: if the DCU refuses to delete the file
         """
-        if self._port == -1:
-            fmt_data = {"host": self._host,
-                        "filename": filename
-                        }
-            url = "http://{host}/data/{filename}".format(**fmt_data)
-        else:
-            fmt_data = {"host": self._host,
-                        "port": self._port,
-                        "filename": filename
-                        }
-            url = "http://{host}:{port}/data/{filename}".format(**fmt_data)
+        url = self._client.data_url(filename)
+
+        response = self._client.request("DELETE", url)
+        if response.status_code == 404:
+            return False
+        elif response.status_code >= 400:
+            raise ResponseError(response)
+        return True
+
+    def delete(self, filename_pattern, workers=DELETE_WORKERS, callback=None):
+        """
+        Deletes the files matching a glob pattern from the buffer, up to
+        *workers* at a time. Master files are deleted after the data files.
+        A failed file does not stop the others, all failures are raised
+        together at the end::
+
+          report = buffer.delete("series_1_*")
+
+        :param str filename_pattern: Filename or glob pattern
+        :param int workers: number of files deleted concurrently
+        :param callable callback: called with the name of each file and
+                                  whether it existed
+        :returns: report with the files deleted
+        :rtype: DeleteReport
+        :raises DeleteError: if any file could not be deleted
+        """
+        return self._delete(self.match(filename_pattern), workers, callback)
 
-        response = requests.delete(url)
+    def delete_series(self, series_id, workers=DELETE_WORKERS,
+                      callback=None):
+        """
+        Deletes all files of a series (see :py:class:`SeriesIndex`) from the
+        buffer like :py:meth:`delete`.
+
+        :param int series_id: the series id
+        :param int workers: number of files deleted concurrently
+        :param callable callback: called with the name of each file and
+                                  whether it existed
+        :rtype: DeleteReport
+        :raises DeleteError: if any file could not be deleted
+        """
+        return self._delete(self.series.files(series_id), workers, callback)
 
-    def delete_all(self):
+    def delete_all(self, workers=DELETE_WORKERS, clear=False):
         """
-        Deletes all files from the buffer.
+        Deletes all files from the buffer like :py:meth:`delete`. With
+        *clear* set, the file writer's clear command is sent instead, which
+        drops all files on the DCU at once; the report then lists the files
+        which were in the buffer before and are gone afterwards.
+
+        :param int workers: number of files deleted concurrently
+        :param bool clear: whether to use the file writer's clear command
+        :rtype: DeleteReport
+        :raises DeleteError: if any file could not be deleted
         """
-        for filename in self.files:
-            self.delete_file(filename)
+        if not clear:
+            return self._delete(self.list_files(), workers)
+        t0 = time.time()
+        before = self.list_files()
+        self._client.set_value(self._api_v, "filewriter", "command", "clear",
+                               "clear", timeout=100.0, no_data=True)
+        self.index.refresh()
+        report = DeleteReport()
+        report.deleted = [f for f in before if f not in self.index]
+        report.elapsed = time.time() - t0
+        return report
 
     def clear_buffer(self):
         """
-        Alias for :py:meth:`delete_all`.
+        Deletes all files from the buffer with the file writer's clear
+        command, see :py:meth:`delete_all`.
         """
-        return self.delete_all()
+        return self.delete_all(clear=True)
+
+    def _delete(self, filenames, workers=DELETE_WORKERS, callback=None):
+        # deletes the given files with up to *workers* threads, data files
+        # before master files
+        report = DeleteReport()
+        t0 = time.time()
+
+        def record(filename, result):
+            try:
+                found = result()
+            except Exception as e:
+                report.errors[filename] = e
+                return
+            if found:
+                report.deleted.append(filename)
+            else:
+                report.missing.append(filename)
+            if callback is not None:
+                callback(filename, found)
+
+        data_files = [f for f in filenames if not is_master(f)]
+        master_files = [f for f in filenames if is_master(f)]
+        for batch in (data_files, master_files):
+            if min(workers, len(batch)) > 1:
+                with ThreadPoolExecutor(
+                        max_workers=min(workers, len(batch))) as pool:
+                    futures = [(filename, pool.submit(self.delete_file,
+                                                      filename))
+                               for filename in batch]
+                    for filename, future in futures:
+                        record(filename, future.result)
+            else:
+                for filename in batch:
+                    record(filename, lambda: self.delete_file(filename))
+        report.elapsed = time.time() - t0
+        if report.errors:
+            raise DeleteError(report)
+        return report
+
+
+def disk_free(path):
+    """
+    Returns the free space of the file system containing *path* in bytes.
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def series_prefix(filename):
+    """
+    Returns the series part of a data or master file name (e.g.
+    "series_1" for "series_1_data_000001.h5"), or None for other files.
+    """
+    match = re.match(r"(.+)_(?:master|data_\d+)\.h5$", filename)
+    return match.group(1) if match else None
+
+
+#: file writer states in which :py:class:`BufferMirror` treats all files as
+#: closed
+IDLE_WRITER_STATES = ("ready", "disabled")
+
+
+class BufferMirror(object):
+    """
+    Copies files from the data buffer in a background thread while the
+    detector is acquiring, so that the buffer does not overflow during long
+    series and little is left to download when a series ends::
+
+      mirror = BufferMirror(detector.buffer, "/data/beamtime")
+      mirror.start()
+      detector.arm()
+      detector.trigger()
+      mirror.wait_idle()
+      mirror.stop()
+
+    Every *interval* seconds the mirror lists the buffer and reads the file
+    writer's state and free space. A data file is fetched as soon as it is
+    closed, i.e. once a later file of its series exists or the file writer
+    is known to be idle (see :py:data:`IDLE_WRITER_STATES`; a state which
+    cannot be read counts as acquiring), a master file once all data files
+    of its series are done (it stays in the buffer if one of them failed).
+    At most *workers* files are transferred at a time; the others wait in
+    name order. Transfers pause while the target file system has less than
+    *min_disk_free* bytes free.
+
+    With *delete* set (the default), each file is verified (see
+    :py:meth:`EigerDataBuffer.drain`) and deleted from the buffer as soon as
+    its copy is safe. Failed files are retried up to *attempts* times. With
+    *verify* set to a checksum algorithm, checksums are recorded in the
+    series' :py:class:`Manifest`, which is written after every scan.
+
+    :param EigerDataBuffer buffer: the data buffer
+    :param str target_dir: Local directory to save the files in
+    :param str pattern: glob pattern of the files to mirror
+    :param int workers: number of files transferred concurrently
+    :param float interval: time between two scans of the buffer in seconds
+    :param bool delete: whether to delete files once copied
+    :param str verify: "size" or a checksum algorithm
+    :param int segments: number of ranges of a file downloaded in parallel
+    :param int min_disk_free: free space to keep on the target file system
+    :param int attempts: number of attempts per file
+    :param callable callback: called with the name and size of each file
+                              copied
+    """
+
+    def __init__(self, buffer, target_dir, pattern="*", workers=2,
+                 interval=0.5, delete=True, verify="size", segments=1,
+                 min_disk_free=0, attempts=3, callback=None):
+        super(BufferMirror, self).__init__()
+        self.buffer = buffer
+        self.target_dir = target_dir
+        self.pattern = pattern
+        self.workers = workers
+        self.interval = interval
+        self.delete = delete
+        self.verify = verify
+        self.manifest = Manifest(target_dir, verify) if verify != "size" \
+            else None
+        self.segments = segments
+        self.min_disk_free = min_disk_free
+        self.attempts = attempts
+        self.callback = callback
+        self.errors = {}
+        self._state = {}
+        self._tries = {}
+        self._seen = set()
+        self._writer_state = None
+        self._nbytes = 0
+        self._transfers = collections.deque(maxlen=1000)
+        self._free = collections.deque(maxlen=20)
+        self._latest = {}
+        self._started = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._scans = 0
+        self._idle_scan = 0
+        self._scanned = threading.Condition()
+        self._thread = None
+        self._pool = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts mirroring.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self._started = time.time()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._thread = threading.Thread(target=self._run,
+                                        name="EigerBufferMirror")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops mirroring after the transfers in flight.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def wait_idle(self, timeout=None):
+        """
+        Waits until a scan started after the call finds that the file writer
+        no longer acquires and all files have been mirrored (or failed).
+        Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._scanned:
+            first = self._scans + 1
+            self._wake.set()
+            while self._idle_scan < first:
+                remaining = None if deadline is None \
+                    else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._scanned.wait(remaining)
+        return True
+
+    def status(self):
+        """
+        Returns a dict with the number of files *pending*, *in_flight*,
+        *done* and *failed*, the bytes copied (*nbytes*), the throughput
+        over the last (up to) ten seconds (*rate*, bytes/s), the buffer's
+        free space (*buffer_free*) and its trend (*buffer_free_trend*,
+        bytes/s, negative while the buffer fills) and the file writer's
+        state.
+        """
+        now = time.time()
+        with self._lock:
+            counts = collections.Counter(self._state.values())
+            recent = sum(n for t, n in self._transfers if now - t <= 10.0)
+            window = min(10.0, now - (self._started or now)) or 1.0
+            free = list(self._free)
+            nbytes = self._nbytes
+        trend = 0.0
+        if len(free) > 1 and free[-1][0] > free[0][0]:
+            trend = (free[-1][1] - free[0][1]) / (free[-1][0] - free[0][0])
+        return {"pending": counts["pending"],
+                "in_flight": counts["in_flight"],
+                "done": counts["done"],
+                "failed": counts["failed"],
+                "nbytes": nbytes,
+                "rate": recent / window,
+                "buffer_free": free[-1][1] if free else None,
+                "buffer_free_trend": trend,
+                "filewriter_state": self._writer_state}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._scan()
+            except Exception:
+                pass
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _scan(self):
+        with self._scanned:
+            self._scans += 1
+            scan = self._scans
+        client = self.buffer._client
+        status = client.get_many(self.buffer._api_v,
+                                 ["filewriter/status/state",
+                                  "filewriter/status/buffer_free"])
+        self._writer_state = status.get("filewriter/status/state")
+        # an unknown state (e.g. a failed read) may mean the file writer
+        # still writes, so no file counts as closed by the state alone
+        acquiring = self._writer_state not in IDLE_WRITER_STATES
+        names = self.buffer.match(self.pattern)
+        with self._lock:
+            if "filewriter/status/buffer_free" in status:
+                self._free.append((time.time(),
+                                   status["filewriter/status/buffer_free"]))
+            for name in names:
+                if name not in self._seen:
+                    self._seen.add(name)
+                    prefix = series_prefix(name)
+                    if prefix is not None and not is_master(name):
+                        self._latest[prefix] = max(
+                            name, self._latest.get(prefix, name))
+            for name in names:
+                if name not in self._state and \
+                        self._closed(name, acquiring):
+                    self._state[name] = "pending"
+            self._dispatch()
+            busy = any(state in ("pending", "in_flight")
+                       for state in self._state.values())
+        if self.manifest is not None:
+            self.manifest.save()
+        with self._scanned:
+            if not (busy or acquiring):
+                self._idle_scan = scan
+            self._scanned.notify_all()
+
+    def _closed(self, name, acquiring):
+        # whether the file writer has finished writing a file: a data file
+        # is closed once a later one of its series or the master exists
+        prefix = series_prefix(name)
+        if prefix is None or not acquiring or is_master(name):
+            return True
+        return name < self._latest[prefix] or \
+            prefix + "_master.h5" in self._seen
+
+    def _dispatch(self):
+        # starts pending files in name order, masters after their series
+        in_flight = sum(1 for state in self._state.values()
+                        if state == "in_flight")
+        if self.min_disk_free and \
+                disk_free(self.target_dir) < self.min_disk_free:
+            return
+        for name in sorted(self._state):
+            if in_flight >= self.workers:
+                return
+            if self._state[name] != "pending":
+                continue
+            if is_master(name) and self._series_busy(name):
+                continue
+            if is_master(name) and self._series_failed(name):
+                # kept in the buffer with its incomplete series
+                self._state[name] = "failed"
+                self.errors[name] = IncompleteSeriesError(
+                    "{0} not transferred, data files of its series "
+                    "failed".format(name))
+                continue
+            self._state[name] = "in_flight"
+            in_flight += 1
+            self._pool.submit(self._transfer, name)
+
+    def _series_busy(self, master):
+        prefix = series_prefix(master) + "_data_"
+        return any(state in ("pending", "in_flight")
+                   for name, state in self._state.items()
+                   if name.startswith(prefix))
+
+    def _series_failed(self, master):
+        prefix = series_prefix(master) + "_data_"
+        return any(state == "failed" for name, state in self._state.items()
+                   if name.startswith(prefix))
+
+    def _transfer(self, name):
+        try:
+            if self.delete:
+                size = self.buffer._move_file(name, self.target_dir,
+                                              self.segments, self.manifest)
+            elif self.manifest is not None:
+                size, digest = self.buffer._fetch_file(
+                    name, self.target_dir, self.segments,
+                    checksum=self.manifest.algorithm)
+                self.manifest.add(name, size, digest)
+            else:
+                size = self.buffer.download_file(name, self.target_dir,
+                                                 self.segments)
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = e
+                self._tries[name] = self._tries.get(name, 0) + 1
+                retry = self._tries[name] < self.attempts and \
+                    not isinstance(e, UnknownDataFileError)
+                self._state[name] = "pending" if retry else "failed"
+        else:
+            with self._lock:
+                self._state[name] = "done"
+                self.errors.pop(name, None)
+                self._nbytes += size
+                self._transfers.append((time.time(), size))
+            if self.callback is not None:
+                self.callback(name, size)
+        self._wake.set()
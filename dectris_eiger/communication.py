@@ -1,63 +1,1029 @@
 # -*- coding: utf-8 -*-
+"""
+.. module:: communication
+   :synopsis: This module contains the HTTP communication layer used by all
+              subsystem interfaces. Requests to one DCU are sent through a
+              shared :py:class:`EigerClient`, which keeps a pool of
+              persistent connections to the host.
+"""
 import json
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 
 
-def get_value(host, port, api_version, subsystem, section, key, timeout=2,
-              return_full=False):
+DEFAULT_POOL_SIZE = 10
+
+SUBSYSTEMS = ("detector", "filewriter", "monitor", "stream", "system")
+SECTIONS = ("config", "status", "command")
+
+#: configuration keys which only change with the hardware or firmware
+STATIC_KEYS = frozenset([
+    "description", "detector_number", "software_version", "sensor_material",
+    "sensor_thickness", "bit_depth_readout", "detector_readout_time",
+    "x_pixel_size", "y_pixel_size", "x_pixels_in_detector",
+    "y_pixels_in_detector",
+])
+
+#: default time to live (in seconds) of cached values per key class, a TTL
+#: of 0 disables caching for the class; configuration values may be changed
+#: by other clients, so caching them is opt-in (e.g. ``cache_ttl={"config":
+#: 1.0}``)
+DEFAULT_TTL = {"static": 3600.0, "config": 0.0, "status": 0.0}
+
+#: keys whose value the DCU may change when other keys are written, by key:
+#: setting the photon energy (or wavelength) resets the threshold, setting
+#: the frame time may shorten the count time
+WRITE_DEPENDENCIES = {
+    "threshold_energy": ("photon_energy", "wavelength"),
+    "count_time": ("frame_time",),
+}
+
+#: IP type of service of control connections (IPTOS_LOWDELAY)
+CONTROL_TOS = 0x10
+
+#: IP type of service of data buffer connections (IPTOS_THROUGHPUT)
+DATA_TOS = 0x08
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class CommunicationError(requests.RequestException):
     """
-    Get a value from the detector. If return_full is True, the complete return
-    value (a dict) is returned.
+    Base class of all errors raised when talking to the DCU.
     """
-    conf = dict(host=host, port=port, sys=subsystem, version=api_version,
-                section=section, key=key)
+    pass
 
-    if port == -1:
-        url_fmt = "http://{host}/{sys}/api/{version}/{section}/{key}"
-    else:
-        url_fmt = "http://{host}:{port}/{sys}/api/{version}/{section}/{key}"
 
-    url = url_fmt.format(**conf)
+class DeadlineExceeded(CommunicationError, requests.Timeout):
+    """
+    Raised when a call did not complete within its deadline. *reached* is
+    True if the DCU accepted the request but did not answer in time.
+    """
+    reached = False
 
-    response = requests.get(url, timeout=timeout)
-    data = json.loads(response.text)
-    if return_full:
-        return data
-    else:
-        return data["value"]
 
+class ConnectionFailed(CommunicationError, requests.ConnectionError):
+    """
+    Raised when the DCU can not be reached.
+    """
+    pass
 
-def set_value(host, port, api_version, subsystem, section, key, value,
-              timeout=2.0, no_data=False):
+
+class CircuitOpenError(CommunicationError):
     """
-    Set a value.
+    Raised without contacting the DCU while the circuit breaker is open
+    after repeated failures.
     """
-    conf = dict(host=host, port=port, sys=subsystem, version=api_version,
-                section=section, key=key)
+    pass
 
-    if port == -1:
-        url_fmt = "http://{host}/{sys}/api/{version}/{section}/{key}"
+
+class ResponseError(CommunicationError):
+    """
+    Raised when the DCU answers with an HTTP error status.
+    """
+
+    def __init__(self, response):
+        super(ResponseError, self).__init__(
+            "{0} {1}: {2}".format(response.status_code, response.reason,
+                                  response.url),
+            response=response)
+        self.status_code = response.status_code
+
+
+def _typed_error(error):
+    """
+    Returns the :py:class:`CommunicationError` corresponding to an error
+    raised by requests.
+    """
+    if isinstance(error, CommunicationError):
+        return error
+    elif isinstance(error, requests.Timeout):
+        typed = DeadlineExceeded(str(error))
+        typed.reached = not isinstance(error, requests.ConnectTimeout)
+        return typed
+    elif isinstance(error, requests.ConnectionError):
+        return ConnectionFailed(str(error))
     else:
-        url_fmt = "http://{host}:{port}/{sys}/api/{version}/{section}/{key}"
+        return CommunicationError(str(error))
+
+
+def _not_sent(error):
+    """
+    Returns True if a request certainly did not reach the DCU, so that even
+    a non-idempotent request can be repeated.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return type(reason).__name__ == "NewConnectionError"
+
+
+class RetryPolicy(object):
+    """
+    Describes how calls to the DCU are timed and repeated.
+
+    The *timeout* passed to a call is its total deadline, including all
+    retries and back-off delays; *deadline* caps it for every call. Each
+    attempt may additionally be limited to *attempt_timeout*. Failed
+    attempts (connection errors, timeouts and HTTP 5xx) are repeated up to
+    *retries* times after an exponential back-off starting at *backoff*
+    seconds and growing up to *max_backoff*, randomly shortened by up to the
+    fraction *jitter*. Non-idempotent calls (commands such as arm or
+    trigger) are only repeated if they certainly did not reach the DCU.
+
+    :param float deadline: maximum total time of a call in seconds
+    :param float attempt_timeout: maximum time of one attempt in seconds
+    :param int retries: number of retries after the first attempt
+    :param float backoff: first back-off delay in seconds
+    :param float max_backoff: maximum back-off delay in seconds
+    :param float jitter: maximum fraction a delay is randomly shortened by
+    """
+
+    def __init__(self, deadline=None, attempt_timeout=None, retries=2,
+                 backoff=0.05, max_backoff=1.0, jitter=0.5):
+        super(RetryPolicy, self).__init__()
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """
+        Returns the back-off delay after the given (1-based) attempt.
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+
+#: policy used by clients created without one
+DEFAULT_POLICY = RetryPolicy()
 
-    url = url_fmt.format(**conf)
+#: policy which never repeats a call
+NO_RETRY = RetryPolicy(retries=0)
 
-    
-    if port == -1 and subsystem == "detector" and section == "command":
-        if key == "trigger" and value != -1:
-            payload = json.dumps({"value": value})
+
+class CircuitBreaker(object):
+    """
+    Fails calls fast while the DCU is down. After *threshold* consecutive
+    failed calls (each including its retries) the circuit opens and calls
+    raise :py:class:`CircuitOpenError` without contacting the DCU. After
+    *reset_timeout* seconds a single trial call is let through; its success
+    closes the circuit again.
+
+    :param int threshold: consecutive failures opening the circuit
+    :param float reset_timeout: time in seconds until a trial call
+    """
+
+    def __init__(self, threshold=5, reset_timeout=5.0):
+        super(CircuitBreaker, self).__init__()
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        "closed", "open" or "half-open".
+        """
+        if self._opened_at is None:
+            return "closed"
+        elif time.time() - self._opened_at < self.reset_timeout:
+            return "open"
         else:
-            payload = json.dumps({"value": 0})       
+            return "half-open"
+
+    def before(self):
+        """
+        Called before each attempt, raises :py:class:`CircuitOpenError` if
+        the attempt must not be made.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError("DCU unavailable after {0} failures".format(
+            self.failures))
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self._opened_at = time.time()
+            self._trial = False
+
+
+class BandwidthLimiter(object):
+    """
+    Token bucket shared by the file transfers of a client, limiting them to
+    *rate* bytes per second on average with bursts of up to *burst* bytes
+    (default: a tenth of a second's worth). Transfers call
+    :py:meth:`consume` for every chunk received.
+
+    :param float rate: maximum rate in bytes per second
+    :param int burst: bucket size in bytes
+    """
+
+    def __init__(self, rate, burst=None):
+        super(BandwidthLimiter, self).__init__()
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else self.rate / 10.0
+        self._tokens = self.burst
+        self._time = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """
+        Takes *nbytes* from the bucket, waiting until the rate allows it.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= nbytes
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _TOSAdapter(HTTPAdapter):
+    # HTTPAdapter whose connections are marked with an IP type of service
+
+    def __init__(self, tos, **kwargs):
+        self.tos = tos
+        super(_TOSAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        options = list(HTTPConnection.default_socket_options)
+        if hasattr(socket, "IP_TOS"):
+            options.append((socket.IPPROTO_IP, socket.IP_TOS, self.tos))
+        kwargs["socket_options"] = options
+        super(_TOSAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+def split_key(key, subsystem="detector", section="config"):
+    """
+    Splits a key specification of the form ``[subsystem/][section/]key`` into
+    a ``(subsystem, section, key)`` tuple. Missing parts are taken from the
+    defaults, so ``"count_time"``, ``"status/board_000/th0_temp"`` and
+    ``"filewriter/config/mode"`` are all valid.
+
+    :param str key: key specification
+    :param str subsystem: default subsystem
+    :param str section: default section
+    :returns: subsystem, section and key
+    :rtype: tuple
+    """
+    parts = key.split("/")
+    if len(parts) > 1 and parts[0] in SUBSYSTEMS:
+        subsystem = parts.pop(0)
+    if len(parts) > 1 and parts[0] in SECTIONS:
+        section = parts.pop(0)
+    return subsystem, section, "/".join(parts)
+
+
+def join_key(subsystem, section, key, default_subsystem="detector"):
+    """
+    Inverse of :py:func:`split_key`: returns the shortest key specification
+    for the given subsystem, section and key.
+    """
+    parts = [key]
+    if section != "config":
+        parts.insert(0, section)
+    if subsystem != default_subsystem:
+        parts.insert(0, subsystem)
+    return "/".join(parts)
+
+
+class ParameterSet(dict):
+    """
+    Result of a batched read: a dict mapping each successfully read key to
+    its value. Keys that could not be read are listed in *errors* with the
+    exception raised for them, *elapsed* is the wall time of the whole batch
+    in seconds.
+    """
+
+    def __init__(self, values=(), errors=None, elapsed=0.0):
+        super(ParameterSet, self).__init__(values)
+        self.errors = errors if errors is not None else {}
+        self.elapsed = elapsed
+
+
+def key_class(section, key):
+    """
+    Returns the cache class of a key: "status" for status values, "static"
+    for :py:data:`STATIC_KEYS` and "config" for everything else.
+    """
+    if section == "status":
+        return "status"
+    elif key in STATIC_KEYS:
+        return "static"
     else:
-        payload = json.dumps({"value": value})
-
-    headers = {"Content-type": "application/json"}
-    try:
-        response = requests.put(url, timeout=timeout, data=payload,
-                                headers=headers)
-    except: # avoiding timeouts
-        return None
-    if no_data:
-        return None
-    data = json.loads(response.text)
-    return data
+        return "config"
+
+
+class ValueCache(object):
+    """
+    Cache of full response dicts with a time to live per key class (see
+    :py:func:`key_class` and :py:data:`DEFAULT_TTL`). Counts hits and misses
+    of cacheable keys.
+    """
+
+    def __init__(self, ttl=None):
+        super(ValueCache, self).__init__()
+        self.ttl = dict(DEFAULT_TTL)
+        self.ttl.update(ttl or {})
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, subsystem):
+        """
+        Returns a counter which is increased whenever cached values of the
+        subsystem are invalidated. Pass it to :py:meth:`put` to drop values
+        that were read before an invalidation.
+        """
+        return self._generations.get(subsystem, 0)
+
+    def get(self, api_version, subsystem, section, key):
+        """
+        Returns a copy of the cached response dict or None if the key is not
+        cached or has expired.
+        """
+        if not self.ttl.get(key_class(section, key)):
+            return None
+        with self._lock:
+            entry = self._entries.get((api_version, subsystem, section, key))
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return dict(entry[1])
+            self.misses += 1
+            return None
+
+    def put(self, api_version, subsystem, section, key, data,
+            generation=None):
+        """
+        Stores a response dict if its key class is cached and, if given, the
+        subsystem's *generation* has not changed since the value was read.
+        """
+        ttl = self.ttl.get(key_class(section, key))
+        if not ttl or not isinstance(data, dict):
+            return
+        with self._lock:
+            if generation is not None and \
+                    generation != self.generation(subsystem):
+                return
+            self._entries[(api_version, subsystem, section, key)] = \
+                (time.time() + ttl, dict(data))
+
+    def invalidate(self, subsystem=None, keys=None, classes=None):
+        """
+        Drops cached values. Without arguments the whole cache is cleared,
+        otherwise only entries of the given subsystem and matching either
+        one of the key names in *keys* or one of the key *classes*.
+        """
+        with self._lock:
+            for sys_name in set(SUBSYSTEMS) | set(self._generations):
+                if subsystem is None or sys_name == subsystem:
+                    self._generations[sys_name] = \
+                        self.generation(sys_name) + 1
+            for entry in list(self._entries):
+                _, sys_name, section, key = entry
+                if subsystem is not None and sys_name != subsystem:
+                    continue
+                if keys is None and classes is None or \
+                        keys is not None and key in keys or \
+                        classes is not None and \
+                        key_class(section, key) in classes:
+                    del self._entries[entry]
+
+    def clear(self):
+        """
+        Drops all cached values.
+        """
+        self.invalidate()
+
+
+class _Flight(object):
+    """
+    A request in flight, shared by all callers asking for the same key.
+    """
+
+    def __init__(self):
+        super(_Flight, self).__init__()
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class EigerEndpoint(object):
+    """
+    Builds the URLs of a DCU's web server. With port -1 the host is used as
+    given (it may contain a port), otherwise the port is appended.
+    """
+
+    def __init__(self, host, port=80):
+        super(EigerEndpoint, self).__init__()
+        self._host = host
+        self._port = port
+
+    @property
+    def base_url(self):
+        """
+        The URL of the DCU's web server.
+        """
+        if self._port == -1:
+            return "http://{0}".format(self._host)
+        else:
+            return "http://{0}:{1}".format(self._host, self._port)
+
+    def url(self, path):
+        """
+        Returns the URL of the given path on the DCU's web server.
+        """
+        return "{0}/{1}".format(self.base_url, path)
+
+    def api_url(self, api_version, subsystem, section, key):
+        """
+        Returns the URL of a key in the SIMPLON API.
+        """
+        return self.url("{sys}/api/{version}/{section}/{key}".format(
+            sys=subsystem, version=api_version, section=section, key=key))
+
+    def data_url(self, filename):
+        """
+        Returns the URL of a file in the data buffer.
+        """
+        return self.url("data/{0}".format(filename))
+
+    def files_url(self, api_version):
+        """
+        Returns the URL of the filewriter's list of buffered files.
+        """
+        return self.url("filewriter/api/{0}/files".format(api_version))
+
+    def encode_value(self, subsystem, section, key, value):
+        """
+        Returns the JSON payload for setting a value. Newer firmware (used
+        with port -1) expects a dummy value for detector commands.
+        """
+        if self._port == -1 and subsystem == "detector" and \
+                section == "command":
+            if key == "trigger" and value != -1:
+                return json.dumps({"value": value})
+            else:
+                return json.dumps({"value": 0})
+        else:
+            return json.dumps({"value": value})
+
+
+class EigerClient(EigerEndpoint):
+    """
+    Connection pool to a single DCU. All requests are sent through one
+    ``requests.Session`` so that TCP connections are kept alive and reused
+    instead of being opened for every call.
+
+    Values read are kept in a :py:class:`ValueCache` with a time to live per
+    key class, *cache_ttl* overrides entries of :py:data:`DEFAULT_TTL`.
+    Writes invalidate the written key, the keys the DCU reports as changed
+    and the keys depending on it (see :py:data:`WRITE_DEPENDENCIES`), as
+    well as the status of the written subsystem. Commands (like arm or
+    initialize) invalidate everything cached for the subsystem.
+
+    Concurrent reads of the same key are coalesced: while a request for a
+    key is in flight, further callers wait for its result instead of sending
+    their own. *coalesced* counts the requests saved this way.
+
+    Calls are timed and repeated according to *policy* (a
+    :py:class:`RetryPolicy`, which can also be given per call) and pass a
+    :py:class:`CircuitBreaker`. Failures raise a
+    :py:class:`CommunicationError`.
+
+    Requests to the data buffer (``/data``) use a separate session with a
+    pool of *max_transfers* connections, so that bulk transfers never hold
+    connections needed by commands and status reads, which are sent with a
+    low-delay IP type of service. They pass their own circuit breaker
+    (*data_breaker*), so that failing transfers do not reject commands. At
+    most *max_transfers* file transfers run at the same time (default: all
+    but two of *pool_size*); transfers wait for one of the
+    *transfer_slots*. *max_bandwidth* (bytes/s, default: no limit) caps the
+    transfers' total rate, leaving room on the link for control traffic; it
+    can be changed at any time.
+
+    Instances are normally obtained via :py:func:`get_client`, which returns
+    the same client for every interface talking to the same host and port.
+    """
+
+    def __init__(self, host, port=80, pool_size=DEFAULT_POOL_SIZE,
+                 keep_alive=True, warm_up=False, cache_ttl=None,
+                 policy=DEFAULT_POLICY, breaker=None, max_transfers=None,
+                 max_bandwidth=None, data_breaker=None):
+        super(EigerClient, self).__init__(host, port)
+        self.policy = policy
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.data_breaker = data_breaker if data_breaker is not None \
+            else CircuitBreaker()
+        self.cache = ValueCache(cache_ttl)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        if max_transfers is None:
+            max_transfers = max(1, pool_size - 2)
+        self.max_transfers = max_transfers
+        self.transfer_slots = threading.BoundedSemaphore(max_transfers)
+        self.limiter = None
+        self.max_bandwidth = max_bandwidth
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.coalesced = 0
+        self.poller = None
+
+        self.session = requests.Session()
+        self.session.mount("http://", _TOSAdapter(
+            CONTROL_TOS, pool_connections=1, pool_maxsize=pool_size))
+        self.data_session = requests.Session()
+        self.data_session.mount("http://", _TOSAdapter(
+            DATA_TOS, pool_connections=1, pool_maxsize=max_transfers))
+        self._data_prefix = self.data_url("")
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+            self.data_session.headers["Connection"] = "close"
+
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self, connections=None, timeout=2.0):
+        """
+        Opens up to *connections* (default: the pool size) connections in
+        parallel, so that the first calls do not pay for the TCP handshake.
+        Errors are ignored, warming up is best effort only.
+
+        :param int connections: number of connections to open
+        :param float timeout: communication timeout in seconds
+        """
+        if connections is None:
+            connections = self.pool_size
+        url = self.url("detector/api/version/")
+
+        def touch():
+            try:
+                self.session.get(url, timeout=timeout).close()
+            except requests.RequestException:
+                pass
+
+        threads = [threading.Thread(target=touch)
+                   for _ in range(min(connections, self.pool_size))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def get_max_bandwidth(self):
+        """
+        Returns the cap of the data transfers' total rate in bytes/s, or
+        None.
+        """
+        return self.limiter.rate if self.limiter is not None else None
+
+    def set_max_bandwidth(self, rate):
+        """
+        Caps the data transfers' total rate at *rate* bytes/s, None removes
+        the cap.
+        """
+        self.limiter = BandwidthLimiter(rate) if rate else None
+    max_bandwidth = property(get_max_bandwidth, set_max_bandwidth)
+
+    @property
+    def executor(self):
+        """
+        Thread pool with one worker per pooled connection, used to run
+        requests concurrently.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size)
+            return self._executor
+
+    def request(self, method, url, timeout=None, idempotent=True,
+                policy=None, **kwargs):
+        """
+        Sends a request to the DCU according to the retry policy and returns
+        the response. Responses with HTTP status below 500 are returned as
+        they are, server errors are repeated like failed connections.
+
+        :param str method: HTTP method
+        :param str url: URL
+        :param float timeout: deadline of the call in seconds
+        :param bool idempotent: whether the request may be repeated safely
+        :param RetryPolicy policy: policy overriding the client's one
+        :returns: the response
+        :rtype: requests.Response
+        :raises CommunicationError: if the call fails
+        """
+        if policy is None:
+            policy = self.policy
+        limits = [t for t in (timeout, policy.deadline) if t is not None]
+        deadline = time.time() + min(limits) if limits else None
+        # failing transfers must not block commands and vice versa
+        breaker = self.data_breaker if url.startswith(self._data_prefix) \
+            else self.breaker
+        breaker.before()
+        try:
+            response = self._attempts(method, url, deadline, idempotent,
+                                      policy, **kwargs)
+        except CommunicationError:
+            # timeouts included: a DCU which does not answer in time is
+            # down as far as the caller can tell
+            breaker.failure()
+            raise
+        breaker.success()
+        return response
+
+    def _attempts(self, method, url, deadline, idempotent, policy, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            attempt_timeout = policy.attempt_timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise DeadlineExceeded("{0} {1}: deadline exceeded".format(
+                        method, url))
+                if attempt_timeout is None or attempt_timeout > remaining:
+                    attempt_timeout = remaining
+            session = self.data_session if url.startswith(self._data_prefix) \
+                else self.session
+            try:
+                response = session.request(method, url,
+                                           timeout=attempt_timeout, **kwargs)
+            except requests.RequestException as e:
+                error = _typed_error(e)
+                retry = idempotent or _not_sent(e)
+            else:
+                if response.status_code < 500:
+                    return response
+                error = ResponseError(response)
+                retry = idempotent
+
+            if not retry or attempt > policy.retries:
+                raise error
+            delay = policy.delay(attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                raise error
+            time.sleep(delay)
+
+    def get_value(self, api_version, subsystem, section, key, timeout=2,
+                  return_full=False, fresh=False, policy=None):
+        """
+        Get a value from the detector. If return_full is True, the complete
+        return value (a dict) is returned. Status values are answered from
+        the attached :py:class:`dectris_eiger.poller.StatusPoller` and other
+        values from the cache where possible, unless *fresh* is True.
+        """
+        data = None
+        if not fresh:
+            if self.poller is not None and section == "status":
+                data = self.poller.lookup(api_version, subsystem, section, key)
+            if data is None:
+                data = self.cache.get(api_version, subsystem, section, key)
+        if data is None:
+            data = self._fetch(api_version, subsystem, section, key, timeout,
+                               policy)
+        if return_full:
+            return data
+        else:
+            return data["value"]
+
+    def _fetch(self, api_version, subsystem, section, key, timeout,
+               policy=None):
+        """
+        Reads a response dict from the DCU, joining a request for the same
+        key that is already in flight.
+        """
+        full_key = (api_version, subsystem, section, key)
+        with self._flights_lock:
+            flight = self._flights.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[full_key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise DeadlineExceeded("waiting for {0} timed out".format(
+                    "/".join(full_key[1:])))
+            if flight.error is not None:
+                raise flight.error
+            return dict(flight.data)
+
+        generation = self.cache.generation(subsystem)
+        try:
+            url = self.api_url(api_version, subsystem, section, key)
+            response = self.request("GET", url, timeout=timeout,
+                                    policy=policy)
+            if response.status_code >= 400:
+                raise ResponseError(response)
+            flight.data = json.loads(response.text)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                if self._flights.get(full_key) is flight:
+                    del self._flights[full_key]
+            flight.done.set()
+        self.cache.put(api_version, subsystem, section, key, flight.data,
+                       generation=generation)
+        return dict(flight.data)
+
+    def set_value(self, api_version, subsystem, section, key, value,
+                  timeout=2.0, no_data=False, policy=None):
+        """
+        Set a value.
+        """
+        response, data = self._put(api_version, subsystem, section, key,
+                                   value, timeout, policy)
+        if no_data:
+            return None
+        if data is None:
+            data = json.loads(response.text)
+        return data
+
+    def _put(self, api_version, subsystem, section, key, value, timeout,
+             policy=None):
+        """
+        Writes a value and returns the response and its decoded content, or
+        None if the response is not JSON.
+        """
+        url = self.api_url(api_version, subsystem, section, key)
+        payload = self.encode_value(subsystem, section, key, value)
+        headers = {"Content-type": "application/json"}
+        try:
+            response = self.request("PUT", url, timeout=timeout,
+                                    idempotent=section != "command",
+                                    policy=policy, data=payload,
+                                    headers=headers)
+        except CommunicationError:
+            # the DCU may have applied the value anyway
+            self._invalidate(subsystem, section, key, None)
+            raise
+        if response.status_code >= 400:
+            self._invalidate(subsystem, section, key, None)
+            raise ResponseError(response)
+        try:
+            data = json.loads(response.text)
+        except ValueError:
+            data = None
+        self._invalidate(subsystem, section, key, data)
+        return response, data
+
+    def _invalidate(self, subsystem, section, key, data):
+        # reads already in flight may return the old value, later callers
+        # must not join them
+        with self._flights_lock:
+            for full_key in list(self._flights):
+                if full_key[1] == subsystem:
+                    del self._flights[full_key]
+        if section == "command":
+            self.cache.invalidate(subsystem)
+        else:
+            changed = set(data) if isinstance(data, list) else set()
+            changed.add(key)
+            changed.update(name for name, required in
+                           WRITE_DEPENDENCIES.items() if key in required)
+            # any status value may follow a configuration change
+            self.cache.invalidate(subsystem, keys=changed,
+                                  classes=("status",))
+        # after the cache, whose generation tells the poller to discard
+        # values it is reading right now
+        poller = self.poller
+        if poller is not None:
+            poller.invalidate(subsystem)
+
+    def refresh(self, api_version=None, keys=None, timeout=2.0,
+                subsystem="detector"):
+        """
+        Drops cached values. Without *keys* the whole cache is cleared,
+        otherwise the given keys (specified as for :py:meth:`get_many`) are
+        dropped and read again.
+
+        :param list keys: key specifications
+        :param float timeout: communication timeout in seconds
+        :param str subsystem: default subsystem
+        :returns: the values read again, if *keys* is given
+        :rtype: ParameterSet
+        """
+        if keys is None:
+            self.cache.clear()
+            return None
+        for key in keys:
+            sys_name, _, name = split_key(key, subsystem)
+            self.cache.invalidate(sys_name, keys=(name,))
+        return self.get_many(api_version, keys, timeout=timeout,
+                             subsystem=subsystem, fresh=True)
+
+    def get_many(self, api_version, keys, timeout=2.0, return_full=False,
+                 subsystem="detector", fresh=False):
+        """
+        Reads several keys concurrently over the pooled connections. Keys
+        are given as ``[subsystem/][section/]key`` (see :py:func:`split_key`),
+        the subsystem defaults to *subsystem* and the section to "config".
+        Errors do not abort the batch but are collected per key.
+
+        :param list keys: key specifications
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dicts
+        :param str subsystem: default subsystem
+        :param bool fresh: whether to bypass the status poller and the cache
+        :returns: values and errors by key specification
+        :rtype: ParameterSet
+        """
+        t0 = time.time()
+        futures = []
+        for key in keys:
+            sys_name, section, name = split_key(key, subsystem)
+            futures.append((key, self.executor.submit(
+                self.get_value, api_version, sys_name, section, name,
+                timeout=timeout, return_full=return_full, fresh=fresh)))
+
+        values = {}
+        errors = {}
+        for key, future in futures:
+            try:
+                values[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+        return ParameterSet(values, errors, time.time() - t0)
+
+    def set_many(self, api_version, values, dependencies=None, timeout=2.0,
+                 subsystem="detector"):
+        """
+        Writes several keys, sending independent keys concurrently. Keys are
+        given as for :py:meth:`get_many`. *dependencies* maps a key to the
+        keys that have to be written before it; dependent keys are written
+        in later stages once all earlier writes have finished.
+
+        The DCU answers every write with the list of keys it changed. Written
+        keys are reported with the value sent, unless a later write changed
+        them again. Keys only changed as a side effect are read back in one
+        parallel batch, so only their values cost an extra round trip.
+
+        A failed write does not stop the others, including those depending
+        on it: each key that could not be written (or read back) is listed
+        in *errors* with its exception and missing from the values. Every
+        write, successful or not, invalidates the cached values it may have
+        changed.
+
+        :param dict values: values by key specification
+        :param dict dependencies: key specifications by key specification
+        :param float timeout: communication timeout in seconds
+        :param str subsystem: default subsystem
+        :returns: effective values by key, with *errors* and *elapsed*
+        :rtype: ParameterSet
+        """
+        t0 = time.time()
+        specs = {}
+        for key in values:
+            specs[split_key(key, subsystem)] = key
+        depends_on = {}
+        for key, required in (dependencies or {}).items():
+            depends_on[split_key(key, subsystem)] = \
+                [split_key(k, subsystem) for k in required]
+
+        stages = {}
+
+        def stage_of(full_key):
+            if full_key not in stages:
+                stages[full_key] = 0
+                stages[full_key] = max(
+                    [stage_of(k) + 1 for k in depends_on.get(full_key, ())
+                     if k in specs] or [0])
+            return stages[full_key]
+
+        for full_key in specs:
+            stage_of(full_key)
+
+        result = {}
+        errors = {}
+        dirty = set()
+        for stage in sorted(set(stages.values())):
+            batch = [k for k in specs if stages[k] == stage]
+            futures = [(k, self.executor.submit(
+                self._put, api_version, k[0], k[1], k[2], values[specs[k]],
+                timeout)) for k in batch]
+            reported_by = {}
+            for full_key, future in futures:
+                try:
+                    _, data = future.result()
+                except Exception as e:
+                    errors[specs[full_key]] = e
+                    continue
+                result[full_key] = values[specs[full_key]]
+                dirty.discard(full_key)
+                for name in data if isinstance(data, list) else ():
+                    changed = (full_key[0], full_key[1], name)
+                    reported_by.setdefault(changed, []).append(full_key)
+            # a key keeps the value we sent only if no other write of this
+            # stage may have changed it as well
+            for changed, writers in reported_by.items():
+                if writers != [changed]:
+                    dirty.add(changed)
+
+        if dirty:
+            names = dict((join_key(k[0], k[1], k[2], subsystem), k)
+                         for k in dirty)
+            reread = self.get_many(api_version, list(names), timeout=timeout,
+                                   subsystem=subsystem)
+            for name, value in reread.items():
+                result[names[name]] = value
+            errors.update(reread.errors)
+
+        values_out = {}
+        for full_key, value in result.items():
+            key = specs.get(full_key)
+            if key is None:
+                key = join_key(full_key[0], full_key[1], full_key[2],
+                               subsystem)
+            values_out[key] = value
+        return ParameterSet(values_out, errors, time.time() - t0)
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.session.close()
+        self.data_session.close()
+
+
+def get_client(host, port=80, **kwargs):
+    """
+    Returns the shared :py:class:`EigerClient` for the given host and port,
+    creating it on first use. Keyword arguments are passed to the client's
+    constructor and are only used when the client is created.
+    """
+    with _clients_lock:
+        client = _clients.get((host, port))
+        if client is None:
+            client = EigerClient(host, port, **kwargs)
+            _clients[(host, port)] = client
+        return client
+
+
+def get_value(host, port, api_version, subsystem, section, key, timeout=2,
+              return_full=False, client=None, policy=None):
+    """
+    Get a value from the detector. If return_full is True, the complete return
+    value (a dict) is returned.
+
+    :raises CommunicationError: if the value can not be read
+    """
+    if client is None:
+        client = get_client(host, port)
+    return client.get_value(api_version, subsystem, section, key,
+                            timeout=timeout, return_full=return_full,
+                            policy=policy)
+
+
+def set_value(host, port, api_version, subsystem, section, key, value,
+              timeout=2.0, no_data=False, client=None, policy=None):
+    """
+    Set a value.
+
+    :raises CommunicationError: if the value can not be set
+    """
+    if client is None:
+        client = get_client(host, port)
+    return client.set_value(api_version, subsystem, section, key, value,
+                            timeout=timeout, no_data=no_data, policy=policy)
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: decode
+   :synopsis: This module contains a pool of processes which decompress the
+              images received from the stream subsystem into shared memory.
+
+Decompressing LZ4 or bitshuffle-LZ4 images in the receiving process limits
+the frame rate to what one core manages. :py:class:`DecodePool` hands the
+compressed frames to worker processes, which decode them into slots of a
+shared memory block, and returns the decoded frames in the order they were
+submitted::
+
+  with DecodePool((1030, 1065), "uint32") as pool:
+      with StreamReceiver("eiger.local", callback=pool.submit):
+          for result in pool:
+              with result:
+                  process(result.image)
+
+At most *depth* frames are submitted but not yet released; beyond that
+:py:meth:`DecodePool.submit` blocks, so that a slow consumer holds back the
+receiver (and the DCU) instead of filling the memory.
+
+This module requires Python 3.8 (``multiprocessing.shared_memory``) and
+``numpy``, plus ``lz4`` or ``bitshuffle`` for the images' encoding.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .stream import Frame, StreamError, decode_image
+
+
+#: number of frames per worker which are in flight by default
+DEPTH_PER_WORKER = 4
+
+#: time in seconds :py:meth:`DecodePool.get` waits for a result before it
+#: checks that the workers are alive
+CHECK_INTERVAL = 0.5
+
+
+class DecodedFrame(object):
+    """
+    A frame decoded by a :py:class:`DecodePool`. *image* is a view of the
+    pool's shared memory and only valid until :py:meth:`release` is called,
+    which hands the slot back to the pool; copy the image to keep it. Used as
+    a context manager, the frame is released on exit.
+    """
+
+    def __init__(self, frame, image, pool, slot):
+        super(DecodedFrame, self).__init__()
+        self.frame = frame
+        self.image = image
+        self._pool = pool
+        self._slot = slot
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __repr__(self):
+        return "DecodedFrame(series={0}, frame={1})".format(
+            self.frame.series, self.frame.frame)
+
+    def release(self):
+        """
+        Returns the frame's slot to the pool.
+        """
+        if self._slot is not None:
+            self.image = None
+            self._pool._release(self._slot)
+            self._slot = None
+
+
+def _decode_worker(name, slot_size, tasks, results):
+    # runs in the worker processes: decodes frames into the shared slots,
+    # data is either the compressed image or its length in the slot's input
+    # area behind the image
+    memory = shared_memory.SharedMemory(name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            seq, slot, data, shape, dtype, encoding = task
+            try:
+                offset = 2 * slot * slot_size
+                if isinstance(data, int):
+                    data = memory.buf[offset + slot_size:
+                                      offset + slot_size + data]
+                out = numpy.ndarray((shape[1], shape[0]), dtype, memory.buf,
+                                    offset)
+                decode_image(data, shape, dtype, encoding, out=out)
+                del out, data
+                results.put((seq, None))
+            except Exception as e:
+                results.put((seq, "{0}: {1}".format(type(e).__name__, e)))
+    finally:
+        memory.close()
+
+
+class DecodePool(object):
+    """
+    Decodes frames of the stream subsystem in *workers* processes into
+    *depth* slots of shared memory, each large enough for an image of
+    *shape* (x, y) and *dtype*. Each slot also has room for the compressed
+    image, so that it is copied once into shared memory instead of being
+    sent through a pipe to the worker.
+
+    Messages are passed to :py:meth:`submit` (e.g. as the callback of a
+    :py:class:`dectris_eiger.stream.StreamReceiver`) and taken with
+    :py:meth:`get` or by iterating over the pool, in the same order. Frames
+    are returned as :py:class:`DecodedFrame`, series headers and ends as
+    they are. :py:meth:`get` is meant to be called from one thread.
+
+    :param tuple shape: largest image size (x, y)
+    :param str dtype: largest pixel type, like "uint32"
+    :param int workers: number of processes (default: number of cores)
+    :param int depth: number of frames in flight (default: 4 per worker)
+    :param context: multiprocessing context used to start the workers
+    """
+
+    def __init__(self, shape, dtype="uint32", workers=None, depth=None,
+                 context=None):
+        super(DecodePool, self).__init__()
+        if shared_memory is None:
+            raise ImportError("The decode pool requires Python 3.8.")
+        if numpy is None:
+            raise ImportError("The decode pool requires numpy.")
+        self.workers = workers or multiprocessing.cpu_count()
+        self.depth = depth or DEPTH_PER_WORKER * self.workers
+        self.slot_size = shape[0] * shape[1] * numpy.dtype(dtype).itemsize
+        self.frames = 0
+        self.errors = 0
+        self._context = context or multiprocessing.get_context()
+        self._memory = None
+        self._processes = []
+        self._tasks = None
+        self._results = None
+        self._free = queue.Queue()
+        self._pending = {}
+        self._done = {}
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._next = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+    @property
+    def in_flight(self):
+        """
+        Number of frames submitted but not yet released.
+        """
+        return self.depth - self._free.qsize()
+
+    def start(self):
+        """
+        Allocates the shared memory and starts the workers.
+        """
+        if self._processes:
+            return
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=2 * self.depth * self.slot_size)
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        for slot in range(self.depth):
+            self._free.put(slot)
+        for _ in range(self.workers):
+            process = self._context.Process(
+                target=_decode_worker, args=(self._memory.name,
+                                             self.slot_size, self._tasks,
+                                             self._results))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory. Images of frames
+        which were not released must not be used afterwards.
+        """
+        if all(process.is_alive() for process in self._processes):
+            for _ in self._processes:
+                self._tasks.put(None)
+        else:
+            # a dead worker may hold the task queue's lock, which blocks the
+            # others for good
+            for process in self._processes:
+                process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        if self._memory is not None:
+            try:
+                self._memory.close()
+            except BufferError:
+                # images are still referenced, the mapping goes with them
+                pass
+            self._memory.unlink()
+            self._memory = None
+
+    def submit(self, message, timeout=None):
+        """
+        Hands a message to the pool. Frames are decoded by the workers, which
+        waits for a free slot if *depth* frames are in flight; other messages
+        pass through in order.
+
+        :param message: a message of the stream subsystem
+        :param float timeout: maximum time to wait for a slot in seconds
+        :raises queue.Full: if no slot was released within *timeout*
+        """
+        if not isinstance(message, Frame):
+            with self._lock:
+                seq = self._seq
+                self._seq += 1
+                self._pending[seq] = (message, None)
+            self._results.put((seq, None))
+            return
+        size = message.shape[0] * message.shape[1] * \
+            numpy.dtype(message.dtype).itemsize
+        if size > self.slot_size:
+            error = "image of {0} bytes exceeds slot size".format(size)
+            slot = None
+        else:
+            try:
+                slot = self._free.get(timeout=timeout)
+            except queue.Empty:
+                raise queue.Full("no free slot")
+            error = None
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            self._pending[seq] = (message, slot)
+        if error is None:
+            data = message.data
+            if len(data) <= self.slot_size:
+                # copied into the input area, the worker gets the length
+                offset = (2 * slot + 1) * self.slot_size
+                self._memory.buf[offset:offset + len(data)] = data
+                data = len(data)
+            else:
+                data = bytes(data)
+            self._tasks.put((seq, slot, data, message.shape, message.dtype,
+                             message.encoding))
+        else:
+            self._results.put((seq, error))
+
+    def get(self, timeout=None):
+        """
+        Returns the next message in the order of submission, frames as
+        :py:class:`DecodedFrame`.
+
+        :param float timeout: maximum time to wait in seconds
+        :raises queue.Empty: if nothing arrives within *timeout*
+        :raises dectris_eiger.stream.StreamError: if a frame could not be
+                                                  decoded
+        :raises RuntimeError: if a worker process died
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._next not in self._done:
+            wait = CHECK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.time(), 0))
+            try:
+                seq, error = self._results.get(timeout=wait)
+            except queue.Empty:
+                # the frames of a dead worker would never arrive
+                for process in self._processes:
+                    if not process.is_alive():
+                        raise RuntimeError(
+                            "decode worker {0} died with exit code "
+                            "{1}".format(process.pid, process.exitcode))
+                if deadline is not None and time.time() >= deadline:
+                    raise
+                continue
+            self._done[seq] = error
+        error = self._done.pop(self._next)
+        with self._lock:
+            message, slot = self._pending.pop(self._next)
+        self._next += 1
+        if not isinstance(message, Frame):
+            return message
+        if error is not None:
+            self.errors += 1
+            if slot is not None:
+                self._release(slot)
+            raise StreamError("frame {0} of series {1}: {2}".format(
+                message.frame, message.series, error))
+        self.frames += 1
+        shape = (message.shape[1], message.shape[0])
+        image = numpy.ndarray(shape, message.dtype, self._memory.buf,
+                              2 * slot * self.slot_size)
+        return DecodedFrame(message, image, self, slot)
+
+    def _release(self, slot):
+        self._free.put(slot)
@@ -8,10 +8,57 @@
 
 .. moduleauthor:: Sven Festersen <festersen@physik.uni-kiel.de>
 """
+import time
+
 from .buffer import EigerDataBuffer
-from .communication import get_value, set_value
+from .communication import (WRITE_DEPENDENCIES, get_client, get_value,
+                            set_value, split_key)
 from .filewriter import EigerFileWriter
-
+from .poller import (DEFAULT_SCHEDULE, AdaptiveSchedule, StatusPoller,
+                     wait_for, watch)
+from .stream import EigerStream
+
+
+#: keys read by :py:meth:`EigerDetector.snapshot`
+SNAPSHOT_KEYS = (
+    "detector/config/count_time",
+    "detector/config/frame_time",
+    "detector/config/nimages",
+    "detector/config/ntrigger",
+    "detector/config/photon_energy",
+    "detector/config/wavelength",
+    "detector/config/threshold_energy",
+    "detector/config/flatfield_correction_applied",
+    "detector/config/auto_summation",
+    "detector/config/trigger_mode",
+    "detector/config/countrate_correction_applied",
+    "detector/config/bit_depth_readout",
+    "detector/config/detector_readout_time",
+    "detector/config/description",
+    "detector/config/detector_number",
+    "detector/config/software_version",
+    "detector/config/sensor_material",
+    "detector/config/sensor_thickness",
+    "detector/status/state",
+    "detector/status/error",
+    "detector/status/time",
+    "detector/status/board_000/th0_temp",
+    "detector/status/board_000/th0_humidity",
+    "filewriter/config/mode",
+    "filewriter/config/transfer_mode",
+    "filewriter/config/nimages_per_file",
+    "filewriter/config/image_nr_start",
+    "filewriter/config/name_pattern",
+    "filewriter/config/compression_enabled",
+    "filewriter/status/state",
+    "filewriter/status/error",
+    "filewriter/status/time",
+    "filewriter/status/buffer_free",
+    "monitor/config/mode",
+    "monitor/config/buffer_size",
+    "monitor/status/state",
+    "monitor/status/error",
+)
 
 class EigerDetector(object):
     """
@@ -20,16 +67,31 @@ class EigerDetector(object):
 
     ``EigerDectector`` instances have a *filewriter* attribute which points
     to an instance of :py:class:`dectris_eiger.filewrite.EigerFileWriter``.
-    This can be used to configure the temporary data storage.
+    This can be used to configure the temporary data storage. Its *stream*
+    attribute points to an instance of
+    :py:class:`dectris_eiger.stream.EigerStream`, which configures the
+    stream subsystem.
+
+    The detector, its file writer and its buffer share one
+    :py:class:`dectris_eiger.communication.EigerClient` and thus one pool of
+    connections to the DCU. Pass *client* to use a client with non-default
+    pool settings.
     """
 
-    def __init__(self, host, port=80, api_version="1.0.0"):
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
         super(EigerDetector, self).__init__()
-        self.filewriter = EigerFileWriter(host, port, api_version)
-        self.buffer = EigerDataBuffer(host, port, api_version)
+        if client is None:
+            client = get_client(host, port)
+        self.filewriter = EigerFileWriter(host, port, api_version,
+                                          client=client)
+        self.buffer = EigerDataBuffer(host, port, api_version, client=client)
+        self.stream = EigerStream(host, port, api_version, client=client)
         self._host = host
         self._port = port
         self._api_v = api_version
+        self._client = client
+        # time of the first trigger of the armed series
+        self._series_start = None
 
     # detector state
     def get_state(self, timeout=2.0, return_full=False):
@@ -44,7 +106,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "status", "state", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     state = property(get_state)
 
     # board temperature
@@ -62,7 +124,8 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "status", "{0}/th0_temp".format(board),
-                         timeout=timeout, return_full=return_full)
+                         timeout=timeout, return_full=return_full,
+                         client=self._client)
     temperature = property(get_temperature)
 
     # board humidity
@@ -79,7 +142,8 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "status", "{0}/th0_humidity".format(board),
-                         timeout=timeout, return_full=return_full)
+                         timeout=timeout, return_full=return_full,
+                         client=self._client)
     humidity = property(get_humidity)
 
     # detector error
@@ -94,7 +158,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "status", "error", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     error = property(get_error)
 
     # detector time
@@ -109,7 +173,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "status", "time", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     detector_time = property(get_detector_time)
 
     # count time
@@ -124,7 +188,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "count_time", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_count_time(self, t, timeout=2.0):
         """
@@ -134,7 +198,8 @@ class EigerDetector(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "count_time", t, timeout=timeout)
+                  "config", "count_time", t, timeout=timeout,
+                  client=self._client)
     count_time = property(get_count_time, set_count_time)
 
 
@@ -153,7 +218,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "frame_time", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_frame_time(self, t, timeout=2.0):
         """
@@ -163,7 +228,8 @@ class EigerDetector(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "frame_time", t, timeout=timeout)
+                  "config", "frame_time", t, timeout=timeout,
+                  client=self._client)
     frame_time = property(get_frame_time, set_frame_time)
 
     # number of images
@@ -178,7 +244,7 @@ class EigerDetector(object):
         """
         return int(get_value(self._host, self._port, self._api_v, "detector",
                              "config", "nimages", timeout=timeout,
-                             return_full=return_full))
+                             return_full=return_full, client=self._client))
 
     def set_nimages(self, n, timeout=2.0):
         """
@@ -188,7 +254,7 @@ class EigerDetector(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "nimages", n, timeout=timeout)
+                  "config", "nimages", n, timeout=timeout, client=self._client)
     nimages = property(get_nimages, set_nimages)
 
     # number of triggers
@@ -203,7 +269,7 @@ class EigerDetector(object):
         """
         return int(get_value(self._host, self._port, self._api_v, "detector",
                              "config", "ntrigger", timeout=timeout,
-                             return_full=return_full))
+                             return_full=return_full, client=self._client))
 
     def set_ntrigger(self, n, timeout=2.0):
         """
@@ -213,7 +279,8 @@ class EigerDetector(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "ntrigger", n, timeout=timeout)
+                  "config", "ntrigger", n, timeout=timeout,
+                  client=self._client)
     ntrigger = property(get_ntrigger, set_ntrigger)
 
     # photon energy
@@ -228,7 +295,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "photon_energy", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_energy(self, energy, timeout=2.0):
         """
@@ -239,7 +306,8 @@ class EigerDetector(object):
         :param float energy: the new photon energy in electron volts
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "photon_energy", energy, timeout=timeout)
+                  "config", "photon_energy", energy, timeout=timeout,
+                  client=self._client)
     energy = property(get_energy, set_energy)
 
     # photon wavelength
@@ -254,7 +322,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "wavelength", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_wavelength(self, wavelength, timeout=2.0):
         """
@@ -265,7 +333,8 @@ class EigerDetector(object):
         :param float wavelength: photon wavelength in Angstrom
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "wavelength", wavelength, timeout=timeout)
+                  "config", "wavelength", wavelength, timeout=timeout,
+                  client=self._client)
     wavelength = property(get_wavelength, set_wavelength)
 
     # energy threshold
@@ -280,7 +349,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "threshold_energy", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_threshold(self, energy, timeout=2.0):
         """
@@ -290,7 +359,8 @@ class EigerDetector(object):
         :param float energy: threshold energy
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "threshold_energy", energy, timeout=timeout)
+                  "config", "threshold_energy", energy, timeout=timeout,
+                  client=self._client)
     threshold = property(get_threshold, set_threshold)
 
     # flatfield
@@ -305,7 +375,8 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "flatfield_correction_applied",
-                         timeout=timeout, return_full=return_full)
+                         timeout=timeout, return_full=return_full,
+                         client=self._client)
 
     def set_flatfield_enabled(self, enabled, timeout=2.0):
         """
@@ -316,7 +387,7 @@ class EigerDetector(object):
         """
         set_value(self._host, self._port, self._api_v, "detector",
                   "config", "flatfield_correction_applied", enabled,
-                  timeout=timeout)
+                  timeout=timeout, client=self._client)
     flatfield_enabled = property(get_flatfield_enabled, set_flatfield_enabled)
 
     # auto summation
@@ -332,7 +403,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "auto_summation", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_auto_summation_enabled(self, enabled, timeout=2.0):
         """
@@ -342,7 +413,8 @@ class EigerDetector(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "auto_summation", enabled, timeout=timeout)
+                  "config", "auto_summation", enabled, timeout=timeout,
+                  client=self._client)
     auto_summation_enabled = property(get_auto_summation_enabled,
                                       set_auto_summation_enabled)
 
@@ -369,7 +441,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "trigger_mode", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_trigger_mode(self, mode, timeout=2.0):
         """
@@ -382,7 +454,8 @@ class EigerDetector(object):
         if mode not in ["expo", "extt", "extm", "exte", "exts", "ints", "inte"]:
             raise ValueError("Invalid trigger mode.")
         set_value(self._host, self._port, self._api_v, "detector",
-                  "config", "trigger_mode", mode, timeout=timeout)
+                  "config", "trigger_mode", mode, timeout=timeout,
+                  client=self._client)
     trigger_mode = property(get_trigger_mode, set_trigger_mode)
 
     # rate correction
@@ -397,7 +470,8 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "countrate_correction_applied",
-                         timeout=timeout, return_full=return_full)
+                         timeout=timeout, return_full=return_full,
+                         client=self._client)
 
     def set_rate_correction_enabled(self, enabled, timeout=2.0):
         """
@@ -408,7 +482,7 @@ class EigerDetector(object):
         """
         set_value(self._host, self._port, self._api_v, "detector",
                   "config", "countrate_correction_applied", enabled,
-                  timeout=timeout)
+                  timeout=timeout, client=self._client)
     rate_correction_enabled = property(get_rate_correction_enabled,
                                        set_rate_correction_enabled)
 
@@ -424,9 +498,39 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "bit_depth_readout", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     bit_depth = property(get_bit_depth)
 
+    # pixels in x
+    def get_x_pixels(self, timeout=2.0, return_full=False):
+        """
+        Returns the number of pixels in x direction, i.e. the image width.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of pixels
+        :rtype: int
+        """
+        return get_value(self._host, self._port, self._api_v, "detector",
+                         "config", "x_pixels_in_detector", timeout=timeout,
+                         return_full=return_full, client=self._client)
+    x_pixels = property(get_x_pixels)
+
+    # pixels in y
+    def get_y_pixels(self, timeout=2.0, return_full=False):
+        """
+        Returns the number of pixels in y direction, i.e. the image height.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of pixels
+        :rtype: int
+        """
+        return get_value(self._host, self._port, self._api_v, "detector",
+                         "config", "y_pixels_in_detector", timeout=timeout,
+                         return_full=return_full, client=self._client)
+    y_pixels = property(get_y_pixels)
+
     # readout time
     def get_readout_time(self, timeout=2.0, return_full=False):
         """
@@ -439,7 +543,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "detector_readout_time", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     readout_time = property(get_readout_time)
 
     # description
@@ -454,7 +558,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "description", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     description = property(get_description)
 
     # serial number
@@ -469,7 +573,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "detector_number", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     serial_number = property(get_serial_number)
 
     # firmware version
@@ -484,7 +588,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "software_version", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     firmware_version = property(get_firmware_version)
 
     # sensor material
@@ -499,7 +603,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "sensor_material", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     sensor_material = property(get_sensor_material)
 
     # sensor thickness
@@ -514,7 +618,7 @@ class EigerDetector(object):
         """
         return get_value(self._host, self._port, self._api_v, "detector",
                          "config", "sensor_thickness", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     sensor_thickness = property(get_sensor_thickness)
 
     # initialize
@@ -526,7 +630,7 @@ class EigerDetector(object):
         """
         set_value(self._host, self._port, self._api_v, "detector",
                   "command", "initialize", "initialize", timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
 
     # arm
     def arm(self, timeout=100.0, return_full=False):
@@ -538,8 +642,10 @@ class EigerDetector(object):
         :returns: next series id
         :rtype: int
         """
+        self._series_start = None
         data = set_value(self._host, self._port, self._api_v, "detector",
-                         "command", "arm", "arm", timeout=timeout)
+                         "command", "arm", "arm", timeout=timeout,
+                         client=self._client)
         if return_full:
             return data
         else:
@@ -552,9 +658,10 @@ class EigerDetector(object):
 
         :param float timeout: communication timeout in seconds
         """
+        self._series_start = None
         data = set_value(self._host, self._port, self._api_v, "detector",
                          "command", "disarm", "disarm", timeout=timeout,
-                         no_data=True)
+                         no_data=True, client=self._client)
 
     # trigger
     def trigger(self, timeout=100.0, input_value=-1):
@@ -563,9 +670,11 @@ class EigerDetector(object):
 
         :param float timeout: communication timeout in seconds
         """
+        if self._series_start is None:
+            self._series_start = time.time()
         set_value(self._host, self._port, self._api_v, "detector",
                   "command", "trigger", input_value, timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
 
     # cancel
     def cancel(self, timeout=2.0, return_full=False):
@@ -583,7 +692,8 @@ class EigerDetector(object):
         :rtype: int
         """
         data = set_value(self._host, self._port, self._api_v, "detector",
-                         "command", "cancel", "cancel", timeout=timeout)
+                         "command", "cancel", "cancel", timeout=timeout,
+                         client=self._client)
         if return_full:
             return data
         else:
@@ -605,7 +715,8 @@ class EigerDetector(object):
         :rtype: int
         """
         data = set_value(self._host, self._port, self._api_v, "detector",
-                         "command", "abort", "abort", timeout=timeout)
+                         "command", "abort", "abort", timeout=timeout,
+                         client=self._client)
         if return_full:
             return data
         else:
@@ -624,9 +735,173 @@ class EigerDetector(object):
         """
         response = get_value(self._host, self._port, self._api_v, "detector",
                              "config", parameter, timeout=timeout,
-                             return_full=return_full)
+                             return_full=return_full, client=self._client)
 
         return response[limit]
 
+    def get_many(self, keys, timeout=2.0, return_full=False):
+        """
+        Reads several keys in parallel. Keys are given as
+        ``[subsystem/][section/]key``, e.g. ``"count_time"``,
+        ``"status/state"`` or ``"filewriter/config/mode"``; the subsystem
+        defaults to "detector" and the section to "config". Keys that could
+        not be read are reported in the result's *errors* dict instead of
+        raising.
+
+        :param list keys: key specifications
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dicts
+        :returns: values by key, with *errors* and *elapsed* attributes
+        :rtype: dectris_eiger.communication.ParameterSet
+        """
+        return self._client.get_many(self._api_v, keys, timeout=timeout,
+                                     return_full=return_full)
+
+    def snapshot(self, keys=SNAPSHOT_KEYS, timeout=2.0):
+        """
+        Reads the complete configuration and status of the detector, file
+        writer and monitor in parallel. See :py:meth:`get_many`.
+
+        :param list keys: key specifications (default: SNAPSHOT_KEYS)
+        :param float timeout: communication timeout in seconds
+        :returns: values by key, with *errors* and *elapsed* attributes
+        :rtype: dectris_eiger.communication.ParameterSet
+        """
+        return self.get_many(keys, timeout=timeout)
+
+    def set_many(self, values, timeout=2.0):
+        """
+        Writes several keys, given as for :py:meth:`get_many`. Independent
+        keys are written in parallel, keys with side effects on others are
+        ordered according to
+        :py:data:`dectris_eiger.communication.WRITE_DEPENDENCIES`, e.g. the
+        threshold is written after the photon energy::
 
+          detector.set_many({"photon_energy": 12400, "threshold_energy": 6200,
+                             "nimages": 10, "filewriter/nimages_per_file": 5})
+
+        The returned values are the effective ones, including keys changed
+        as a side effect (such as the threshold after an energy change).
+        Photon energy and wavelength describe the same setting and can not
+        be written together. Keys that could not be written are listed in
+        *errors*, the other keys are written anyway.
+
+        :param dict values: values by key specification
+        :param float timeout: communication timeout in seconds
+        :returns: effective values by key, with *errors* and *elapsed*
+        :rtype: dectris_eiger.communication.ParameterSet
+        """
+        keys = [split_key(key) for key in values]
+        if ("detector", "config", "photon_energy") in keys and \
+                ("detector", "config", "wavelength") in keys:
+            raise ValueError("Photon energy and wavelength can not be set "
+                             "together.")
+        return self._client.set_many(self._api_v, values,
+                                     dependencies=WRITE_DEPENDENCIES,
+                                     timeout=timeout)
+
+    def refresh(self, keys=None, timeout=2.0):
+        """
+        Drops cached values so that the next read goes to the DCU. Without
+        *keys* the complete cache of the DCU's client is cleared, otherwise
+        only the given keys (specified as for :py:meth:`get_many`) which are
+        read again right away.
+
+        :param list keys: key specifications
+        :param float timeout: communication timeout in seconds
+        :returns: the values read again, if *keys* is given
+        :rtype: dectris_eiger.communication.ParameterSet
+        """
+        return self._client.refresh(self._api_v, keys, timeout=timeout)
 
+    @property
+    def cache(self):
+        """
+        The :py:class:`dectris_eiger.communication.ValueCache` of the DCU's
+        client, which provides the *hits* and *misses* counters.
+        """
+        return self._client.cache
+
+    def start_status_poller(self, schedule=DEFAULT_SCHEDULE, max_age=None):
+        """
+        Starts a :py:class:`dectris_eiger.poller.StatusPoller` for the DCU.
+        While it runs, status reads of all interfaces sharing this detector's
+        client are answered from its snapshot.
+
+        :param schedule: sequence of (interval, keys) pairs
+        :param float max_age: staleness bound in seconds for answering reads
+        :returns: the running poller
+        :rtype: dectris_eiger.poller.StatusPoller
+        """
+        poller = StatusPoller(self._client, self._api_v, schedule=schedule,
+                              max_age=max_age)
+        poller.start()
+        return poller
+
+    def expected_duration(self, timeout=2.0):
+        """
+        Returns the expected duration of a series in seconds, i.e. frame
+        time times number of images times number of triggers.
+
+        :param float timeout: communication timeout in seconds
+        :returns: expected series duration in seconds
+        :rtype: float
+        """
+        values = self.get_many(["frame_time", "nimages", "ntrigger"],
+                               timeout=timeout)
+        if values.errors:
+            raise list(values.errors.values())[0]
+        return values["frame_time"] * values["nimages"] * values["ntrigger"]
+
+    def wait_for_state(self, targets, timeout=None, expected_duration=None,
+                       min_interval=0.01, max_interval=5.0):
+        """
+        Waits until the detector reaches one of the *targets* states (or
+        "error") and returns the state reached. Polling follows an
+        :py:class:`dectris_eiger.poller.AdaptiveSchedule`: when waiting for
+        the end of a series, the wait sleeps through most of the expected
+        duration and polls quickly around its predicted end::
+
+          detector.arm()
+          detector.trigger(timeout=0.1)
+          detector.wait_for_state("idle")
+
+        :param targets: state or list of states to wait for
+        :param float timeout: maximum time to wait in seconds
+        :param float expected_duration: expected time until a target state is
+                                        reached; by default the rest of the
+                                        series if the detector is acquiring
+                                        a series triggered by this instance,
+                                        pass 0 for no prediction
+        :param float min_interval: shortest polling interval in seconds
+        :param float max_interval: longest polling interval in seconds
+        :returns: the state reached
+        :rtype: str
+        :raises dectris_eiger.poller.WaitTimeout: if no target state is
+                                                  reached within *timeout*
+        """
+        if expected_duration is None:
+            expected_duration = 0
+            start = self._series_start
+            if start is not None and self.get_state() == "acquire":
+                # a late caller only waits for what is left of the series;
+                # without a known start the wait polls without prediction
+                expected_duration = max(
+                    0.0, self.expected_duration() - (time.time() - start))
+        schedule = AdaptiveSchedule(expected_duration, min_interval,
+                                    max_interval)
+        return wait_for(self.get_state, targets, timeout=timeout,
+                        schedule=schedule)
+
+    def watch_state(self, targets, callback=None, **kwargs):
+        """
+        Like :py:meth:`wait_for_state`, but waits in a background thread.
+        Returns a ``concurrent.futures.Future`` resolving to the state
+        reached; *callback* is called with the future when it is done.
+
+        :param targets: state or list of states to wait for
+        :param callable callback: function called with the done future
+        :returns: future for the state reached
+        :rtype: concurrent.futures.Future
+        """
+        return watch(self.wait_for_state, callback, targets, **kwargs)
@@ -6,7 +6,8 @@
 
 .. moduleauthor:: Sven Festersen <festersen@physik.uni-kiel.de>
 """
-from .communication import get_value, set_value
+from .communication import get_client, get_value, set_value
+from .poller import AdaptiveSchedule, wait_for, watch
 
 
 class EigerFileWriter(object):
@@ -15,11 +16,14 @@ class EigerFileWriter(object):
     interface can be used to configure filename patterns and storage details.
     """
 
-    def __init__(self, host, port=80, api_version="1.0.0"):
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
         super(EigerFileWriter, self).__init__()
         self._host = host
         self._port = port
         self._api_v = api_version
+        if client is None:
+            client = get_client(host, port)
+        self._client = client
 
     # initialize
     def initialize(self, timeout=100.0):
@@ -30,7 +34,7 @@ class EigerFileWriter(object):
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
                   "command", "initialize", "initialize", timeout=timeout,
-                  no_data=True) 
+                  no_data=True, client=self._client) 
     # clear
     def clear(self, timeout=100.0):
         """
@@ -40,7 +44,7 @@ class EigerFileWriter(object):
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
                   "command", "clear", "clear", timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
 
 
     # status
@@ -56,7 +60,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "status", "state", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     status = property(get_status)
 
     # error
@@ -71,7 +75,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "status", "error", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     error = property(get_error)
 
     # available buffer space
@@ -86,7 +90,7 @@ class EigerFileWriter(object):
         """
         return int(get_value(self._host, self._port, self._api_v, "filewriter",
                              "status", "state", timeout=timeout,
-                             return_full=return_full))
+                             return_full=return_full, client=self._client))
     available_space = property(get_available_space)
 
     # time
@@ -101,7 +105,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "status", "time", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     time = property(get_time)
 
     #  mode
@@ -116,7 +120,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "config", "mode", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_mode(self, mode, timeout=2.0):
         """
@@ -126,7 +130,8 @@ class EigerFileWriter(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
-                  "config", "mode", mode, timeout=timeout, no_data = True)
+                  "config", "mode", mode, timeout=timeout, no_data = True,
+                  client=self._client)
 
     mode = property(get_mode, set_mode)
 
@@ -142,7 +147,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "config", "transfer_mode", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_transfer_mode(self, mode, timeout=2.0):
         """
@@ -153,7 +158,8 @@ class EigerFileWriter(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
-                  "config", "transfer_mode", mode, timeout=timeout, no_data = True)
+                  "config", "transfer_mode", mode, timeout=timeout, no_data = True,
+                  client=self._client)
     transfer_mode = property(get_transfer_mode, set_transfer_mode)
 
     # number of images per file
@@ -168,7 +174,7 @@ class EigerFileWriter(object):
         """
         return int(get_value(self._host, self._port, self._api_v, "filewriter",
                              "config", "nimages_per_file", timeout=timeout,
-                             return_full=return_full))
+                             return_full=return_full, client=self._client))
 
     def set_images_per_file(self, n, timeout=2.0):
         """
@@ -179,7 +185,7 @@ class EigerFileWriter(object):
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
                   "config", "nimages_per_file", n, timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
     images_per_file = property(get_images_per_file, set_images_per_file)
 
     # image_nr_low metadata parameter in the first HDF5 data file
@@ -194,7 +200,7 @@ class EigerFileWriter(object):
         """
         return int(get_value(self._host, self._port, self._api_v, "filewriter",
                              "config", "image_nr_start", timeout=timeout,
-                             return_full=return_full))
+                             return_full=return_full, client=self._client))
 
     def set_image_nr_start(self, n, timeout=2.0):
         """
@@ -205,7 +211,7 @@ class EigerFileWriter(object):
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
                   "config", "image_nr_start", n, timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
     image_nr_start = property(get_image_nr_start, set_image_nr_start)
 
     # filename pattern
@@ -221,7 +227,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "config", "name_pattern", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_filename_pattern(self, pattern, timeout=2.0):
         """
@@ -233,7 +239,7 @@ class EigerFileWriter(object):
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
                   "config", "name_pattern", pattern, timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
     filename_pattern = property(get_filename_pattern, set_filename_pattern)
 
     # compression
@@ -248,7 +254,7 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "config", "compression_enabled", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_compression_enabled(self, enabled, timeout=2.0):
         """
@@ -259,7 +265,7 @@ class EigerFileWriter(object):
         """
         set_value(self._host, self._port, self._api_v, "filewriter",
                   "config", "compression_enabled", enabled, timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
     compression_enabled = property(get_compression_enabled,
                                    set_compression_enabled)
 
@@ -275,5 +281,40 @@ class EigerFileWriter(object):
         """
         return get_value(self._host, self._port, self._api_v, "filewriter",
                          "status", "buffer_free", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     buffer_free = property(get_buffer_free)
+
+    def wait_until_ready(self, timeout=None, expected_duration=0,
+                         min_interval=0.01, max_interval=5.0):
+        """
+        Waits until the filewriter has written all files, i.e. its status is
+        "ready" (or "disabled" or "error"), and returns the status. See
+        :py:meth:`dectris_eiger.eiger.EigerDetector.wait_for_state` for the
+        polling schedule.
+
+        :param float timeout: maximum time to wait in seconds
+        :param float expected_duration: expected time until the filewriter is
+                                        ready in seconds, 0 for none
+        :param float min_interval: shortest polling interval in seconds
+        :param float max_interval: longest polling interval in seconds
+        :returns: the status reached
+        :rtype: str
+        :raises dectris_eiger.poller.WaitTimeout: if the filewriter is not
+                                                  ready within *timeout*
+        """
+        schedule = AdaptiveSchedule(expected_duration, min_interval,
+                                    max_interval)
+        return wait_for(self.get_status, ("ready", "disabled"),
+                        timeout=timeout, schedule=schedule)
+
+    def watch_ready(self, callback=None, **kwargs):
+        """
+        Like :py:meth:`wait_until_ready`, but waits in a background thread.
+        Returns a ``concurrent.futures.Future`` resolving to the status
+        reached; *callback* is called with the future when it is done.
+
+        :param callable callback: function called with the done future
+        :returns: future for the status reached
+        :rtype: concurrent.futures.Future
+        """
+        return watch(self.wait_until_ready, callback, **kwargs)
@@ -5,7 +5,7 @@
 
 .. moduleauthor:: Teresa Nunez <tnunez@mail.desy.de>
 """
-from .communication import get_value, set_value
+from .communication import get_client, get_value, set_value
 
 
 class EigerMonitorCtrl(object):
@@ -14,11 +14,14 @@ class EigerMonitorCtrl(object):
     interface can be used to configure filename patterns and storage details.
     """
 
-    def __init__(self, host, port=80, api_version="1.0.0"):
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
         super(EigerMonitorCtrl, self).__init__()
         self._host = host
         self._port = port
         self._api_v = api_version
+        if client is None:
+            client = get_client(host, port)
+        self._client = client
 
     # initialize
     def initialize(self, timeout=100.0):
@@ -29,7 +32,7 @@ class EigerMonitorCtrl(object):
         """
         set_value(self._host, self._port, self._api_v, "monitor",
                   "command", "initialize", "initialize", timeout=timeout,
-                  no_data=True) 
+                  no_data=True, client=self._client) 
     # clear
     def clear(self, timeout=100.0):
         """
@@ -39,7 +42,7 @@ class EigerMonitorCtrl(object):
         """
         set_value(self._host, self._port, self._api_v, "monitor",
                   "command", "clear", "clear", timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
 
     # status
     def get_status(self, timeout=2.0, return_full=False):
@@ -54,7 +57,7 @@ class EigerMonitorCtrl(object):
         """
         return get_value(self._host, self._port, self._api_v, "monitor",
                          "status", "state", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     status = property(get_status)
 
     # error
@@ -69,7 +72,7 @@ class EigerMonitorCtrl(object):
         """
         return get_value(self._host, self._port, self._api_v, "monitor",
                          "status", "error", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
     error = property(get_error)
 
     # mode
@@ -84,7 +87,7 @@ class EigerMonitorCtrl(object):
         """
         return get_value(self._host, self._port, self._api_v, "monitor",
                          "config", "mode", timeout=timeout,
-                         return_full=return_full)
+                         return_full=return_full, client=self._client)
 
     def set_mode(self, mode, timeout=2.0):
         """
@@ -94,7 +97,8 @@ class EigerMonitorCtrl(object):
         :param float timeout: communication timeout in seconds
         """
         set_value(self._host, self._port, self._api_v, "monitor",
-                  "config", "mode", mode, timeout=timeout, no_data=True)
+                  "config", "mode", mode, timeout=timeout, no_data=True,
+                  client=self._client)
     mode = property(get_mode, set_mode)
 
     # number of images that can be buffered by the monitor interface
@@ -109,7 +113,7 @@ class EigerMonitorCtrl(object):
         """
         return int(get_value(self._host, self._port, self._api_v, "monitor",
                              "config", "buffer_size", timeout=timeout,
-                             return_full=return_full))
+                             return_full=return_full, client=self._client))
 
     def set_buffer_size(self, n, timeout=2.0):
         """
@@ -120,6 +124,6 @@ class EigerMonitorCtrl(object):
         """
         set_value(self._host, self._port, self._api_v, "monitor",
                   "config", "buffer_size", n, timeout=timeout,
-                  no_data=True)
+                  no_data=True, client=self._client)
     buffer_size = property(get_buffer_size, set_buffer_size)
 
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: poller
+   :synopsis: This module contains a background poller which keeps an
+              in-memory snapshot of the detector, file writer and monitor
+              status, so that any number of readers cost a constant number
+              of requests to the DCU.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+from .communication import split_key
+
+
+#: default polling schedule: interval in seconds and the status keys polled
+#: at that interval
+DEFAULT_SCHEDULE = (
+    (0.2, ("detector/status/state",
+           "filewriter/status/state",
+           "monitor/status/state")),
+    (1.0, ("detector/status/error",
+           "filewriter/status/error",
+           "monitor/status/error",
+           "filewriter/status/buffer_free")),
+    (5.0, ("detector/status/time",
+           "filewriter/status/time",
+           "detector/status/board_000/th0_temp",
+           "detector/status/board_000/th0_humidity")),
+)
+
+
+class WaitTimeout(Exception):
+    """
+    Raised when a state is not reached in time.
+    """
+    pass
+
+
+class AdaptiveSchedule(object):
+    """
+    Polling intervals for waiting on an event that is expected after
+    *expected* seconds, e.g. the end of a series. The wait sleeps through
+    most of the expected time (in steps of at most *max_interval*), polls
+    every *min_interval* from shortly before until shortly after the
+    predicted end, and then backs off geometrically up to *max_interval* in
+    case the prediction was wrong. Without an expectation it only backs off.
+
+    :param float expected: expected time until the event in seconds
+    :param float min_interval: shortest polling interval in seconds
+    :param float max_interval: longest polling interval in seconds
+    """
+
+    def __init__(self, expected=None, min_interval=0.01, max_interval=5.0):
+        super(AdaptiveSchedule, self).__init__()
+        self.expected = expected
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        if expected:
+            self.lead = max(5 * min_interval, 0.02 * expected)
+        else:
+            self.lead = 0.0
+        self._backoff = min_interval
+        self.polls = 0
+
+    def next_delay(self, elapsed):
+        """
+        Returns the time to sleep before the next poll, given the time
+        elapsed since the wait started.
+        """
+        self.polls += 1
+        if self.expected:
+            remaining = self.expected - elapsed
+            if remaining > self.lead:
+                return min(self.max_interval, remaining - self.lead)
+            elif remaining > -self.lead:
+                return self.min_interval
+        delay = self._backoff
+        self._backoff = min(self.max_interval, self._backoff * 1.5)
+        return delay
+
+
+def wait_for(read, targets, timeout=None, schedule=None,
+             stop_states=("error",)):
+    """
+    Calls *read* according to *schedule* until it returns one of *targets*
+    or one of *stop_states*, and returns that value.
+
+    :param callable read: function returning the current state
+    :param targets: state or list of states to wait for
+    :param float timeout: maximum time to wait in seconds (default: forever)
+    :param AdaptiveSchedule schedule: polling schedule
+    :param stop_states: states which end the wait early
+    :returns: the state reached
+    :raises WaitTimeout: if no target state is reached within *timeout*
+    """
+    if isinstance(targets, str):
+        targets = (targets,)
+    if schedule is None:
+        schedule = AdaptiveSchedule()
+    t0 = time.time()
+    while True:
+        state = read()
+        if state in targets or state in stop_states:
+            return state
+        elapsed = time.time() - t0
+        if timeout is not None and elapsed >= timeout:
+            raise WaitTimeout("state {0} not reached within {1} s, "
+                              "last state: {2}".format(
+                                  "/".join(targets), timeout, state))
+        delay = schedule.next_delay(elapsed)
+        if timeout is not None:
+            delay = min(delay, timeout - elapsed)
+        time.sleep(max(0.0, delay))
+
+
+def watch(wait, callback=None, *args, **kwargs):
+    """
+    Runs ``wait(*args, **kwargs)`` in a background thread and returns a
+    ``concurrent.futures.Future`` for its result. If given, *callback* is
+    called with the future once it is done.
+    """
+    future = Future()
+    if callback is not None:
+        future.add_done_callback(callback)
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(wait(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+    thread = threading.Thread(target=run, name="EigerWait")
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+class StatusSnapshot(object):
+    """
+    Immutable set of status values published by a :py:class:`StatusPoller`.
+    Each key maps to the full response dict and the time it was read. The
+    poller never changes a published snapshot but replaces it as a whole,
+    so readers need no locking.
+    """
+
+    def __init__(self, entries=None, errors=None):
+        super(StatusSnapshot, self).__init__()
+        self._entries = entries if entries is not None else {}
+        self.errors = errors if errors is not None else {}
+
+    def get(self, key, default=None, return_full=False):
+        """
+        Returns the value of a key given as ``[subsystem/][section/]key``
+        (the section defaults to "status"), or *default* if the key has not
+        been read yet.
+        """
+        entry = self._entries.get(split_key(key, section="status"))
+        if entry is None:
+            return default
+        if return_full:
+            return dict(entry[0])
+        return entry[0]["value"]
+
+    def age(self, key):
+        """
+        Returns the age of a key's value in seconds, or None if the key has
+        not been read yet.
+        """
+        entry = self._entries.get(split_key(key, section="status"))
+        if entry is None:
+            return None
+        return time.time() - entry[1]
+
+    def keys(self):
+        """
+        Returns the ``(subsystem, section, key)`` tuples in the snapshot.
+        """
+        return list(self._entries)
+
+    def updated(self, entries, errors, dropped=()):
+        """
+        Returns a new snapshot with the given entries replaced and the
+        entries of the subsystems in *dropped* removed.
+        """
+        new_entries = dict((key, entry)
+                           for key, entry in self._entries.items()
+                           if key[0] not in dropped)
+        new_entries.update(entries)
+        new_errors = dict(self.errors)
+        for key in entries:
+            new_errors.pop(key, None)
+        new_errors.update(errors)
+        return StatusSnapshot(new_entries, new_errors)
+
+
+class StatusPoller(object):
+    """
+    Reads status keys in a background thread, each at the interval given by
+    its *schedule* entry, and publishes them as a :py:class:`StatusSnapshot`.
+
+    While running, the poller is attached to the client, which then answers
+    status reads (like :py:attr:`dectris_eiger.eiger.EigerDetector.state`)
+    from the snapshot as long as the value is younger than *max_age*
+    (default: twice the key's polling interval)::
+
+      poller = detector.start_status_poller()
+      detector.state  # answered from the snapshot
+      poller.stop()
+
+    :param EigerClient client: the client of the DCU
+    :param str api_version: API version
+    :param schedule: sequence of (interval, keys) pairs
+    :param float max_age: staleness bound in seconds for answering reads
+    :param float timeout: communication timeout in seconds
+    """
+
+    def __init__(self, client, api_version="1.0.0", schedule=DEFAULT_SCHEDULE,
+                 max_age=None, timeout=2.0):
+        super(StatusPoller, self).__init__()
+        self._client = client
+        self._api_v = api_version
+        self._timeout = timeout
+        self._groups = []
+        self._max_age = {}
+        for interval, keys in schedule:
+            keys = [split_key(key, section="status") for key in keys]
+            self._groups.append((interval, keys))
+            for key in keys:
+                self._max_age[key] = max_age if max_age is not None \
+                    else 2 * interval
+        self.snapshot = StatusSnapshot()
+        self._publish_lock = threading.Lock()
+        self.polls = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts polling and attaches the poller to the client.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="EigerStatusPoller")
+        self._thread.daemon = True
+        self._thread.start()
+        self._client.poller = self
+
+    def stop(self, timeout=None):
+        """
+        Stops polling and detaches the poller from the client.
+        """
+        if self._client.poller is self:
+            self._client.poller = None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def lookup(self, api_version, subsystem, section, key):
+        """
+        Returns the response dict of a key if it is in the snapshot and
+        younger than its staleness bound, None otherwise.
+        """
+        full_key = (subsystem, section, key)
+        if api_version != self._api_v or full_key not in self._max_age:
+            return None
+        entry = self.snapshot._entries.get(full_key)
+        if entry is None or time.time() - entry[1] > self._max_age[full_key]:
+            return None
+        return dict(entry[0])
+
+    def invalidate(self, subsystem):
+        """
+        Drops the values of a subsystem from the snapshot, e.g. after a
+        command changed its state. Reads go to the DCU until the next poll.
+        """
+        with self._publish_lock:
+            self.snapshot = self.snapshot.updated({}, {},
+                                                  dropped=(subsystem,))
+
+    def poll(self, keys):
+        """
+        Reads the given ``(subsystem, section, key)`` tuples in parallel and
+        publishes them. Values are stamped with the time the requests were
+        sent.
+        """
+        cache = self._client.cache
+        generations = dict((key[0], cache.generation(key[0])) for key in keys)
+        specs = ["/".join(key) for key in keys]
+        t0 = time.time()
+        result = self._client.get_many(self._api_v, specs,
+                                       timeout=self._timeout,
+                                       return_full=True, fresh=True)
+        entries = {}
+        errors = {}
+        with self._publish_lock:
+            for spec, key in zip(specs, keys):
+                # skip values read before a write to their subsystem
+                if generations[key[0]] != cache.generation(key[0]):
+                    continue
+                if spec in result:
+                    entries[key] = (result[spec], t0)
+                else:
+                    errors[key] = result.errors.get(spec)
+            self.snapshot = self.snapshot.updated(entries, errors)
+        self.polls += 1
+
+    def _run(self):
+        due = [0.0] * len(self._groups)
+        while not self._stop.is_set():
+            now = time.time()
+            keys = []
+            for i, (interval, group_keys) in enumerate(self._groups):
+                if due[i] <= now:
+                    keys.extend(group_keys)
+                    due[i] = now + interval
+            if keys:
+                try:
+                    self.poll(keys)
+                except Exception:
+                    pass
+            if due:
+                self._stop.wait(max(0.0, min(due) - time.time()))
+            else:
+                self._stop.wait(1.0)
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: ring
+   :synopsis: This module contains a ring buffer of image slots in shared
+              memory, through which the stages of a processing pipeline
+              (receiver, decoder, writer, analysis) hand frames to each other
+              without pickling or copying them.
+
+A :py:class:`FrameRing` holds a fixed number of slots, each the size of one
+image. Frames are numbered with increasing sequence numbers; the frame with
+sequence number *seq* lives in slot ``seq % nslots``. A producer claims the
+next sequence number, writes the image into the slot and publishes it::
+
+  ring = FrameRing.for_detector(detector, 64)
+  seq = ring.claim()
+  decode_image(data, shape, dtype, encoding, out=ring.image(seq))
+  ring.publish(seq)
+
+Consumers, in the same or another process, read the image in place and
+release it by its sequence number::
+
+  for seq, image in ring.frames():
+      process(image)
+      ring.release(seq)
+
+When all slots are in use, the ring's *policy* decides what a producer does:
+
+``"block"``
+  :py:meth:`FrameRing.claim` waits until a consumer releases the slot. No
+  frame is lost, a slow consumer holds back the producer.
+``"overwrite"``
+  :py:meth:`FrameRing.claim` takes the slot of the oldest published frame,
+  which is lost for consumers which have not read it yet. The producer never
+  waits for consumers (only for slots which are still being written). A
+  consumer which reads a frame while it is overwritten gets a torn image;
+  :py:meth:`FrameRing.valid` tells after reading whether the frame was
+  still in the ring.
+
+The ring is shared with other processes by passing it to them when they are
+started (e.g. as argument of ``multiprocessing.Process``), as its lock can
+only be inherited. :py:meth:`FrameRing.stats` returns the occupancy and
+counters of claimed, published, released and overwritten frames.
+
+This module requires Python 3.8 (``multiprocessing.shared_memory``) and
+``numpy``.
+"""
+import multiprocessing
+import os
+import queue
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: policies of :py:class:`FrameRing` when all slots are in use
+BLOCK = "block"
+OVERWRITE = "overwrite"
+
+#: states of a slot
+FREE, CLAIMED, READY = 0, 1, 2
+
+#: counters in the ring's header, followed by (seq, state, references) per
+#: slot
+_COUNTERS = ("head", "used", "high_water", "claimed", "published",
+             "released", "overwritten", "waits")
+
+#: alignment of the image slots in bytes
+ALIGNMENT = 64
+
+
+def image_dtype(bit_depth):
+    """
+    Returns the pixel type of images of a detector with *bit_depth*.
+    """
+    if bit_depth <= 8:
+        return "uint8"
+    elif bit_depth <= 16:
+        return "uint16"
+    return "uint32"
+
+
+class FrameLost(Exception):
+    """
+    Raised when a frame is no longer in the ring, because it was overwritten
+    or released.
+    """
+
+
+class FrameRing(object):
+    """
+    Ring buffer of *nslots* images of *shape* (x, y) and *dtype* in shared
+    memory, see :py:mod:`dectris_eiger.ring`.
+
+    Published frames have to be released *consumers* times (once by each
+    consuming stage) before their slot is reused.
+
+    :param int nslots: number of slots
+    :param tuple shape: image size (x, y)
+    :param str dtype: pixel type
+    :param str policy: :py:data:`BLOCK` or :py:data:`OVERWRITE`
+    :param int consumers: number of releases per frame
+    :param context: multiprocessing context used for the lock
+    """
+
+    def __init__(self, nslots, shape, dtype="uint32", policy=BLOCK,
+                 consumers=1, context=None):
+        super(FrameRing, self).__init__()
+        if shared_memory is None:
+            raise ImportError("The frame ring requires Python 3.8.")
+        if numpy is None:
+            raise ImportError("The frame ring requires numpy.")
+        if policy not in (BLOCK, OVERWRITE):
+            raise ValueError("unknown policy {0}".format(policy))
+        self.nslots = nslots
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.policy = policy
+        self.consumers = consumers
+        self._cond = (context or multiprocessing).Condition()
+        size = self._layout()
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        # the creating process frees the memory (not forked children)
+        self._owner = os.getpid()
+        self._attach()
+        self._slots[:, 0] = -1
+
+    @classmethod
+    def for_detector(cls, detector, nslots, **kwargs):
+        """
+        Returns a ring for the images of *detector* (an
+        :py:class:`dectris_eiger.eiger.EigerDetector`), sized from its pixel
+        numbers and bit depth.
+        """
+        shape = (detector.x_pixels, detector.y_pixels)
+        return cls(nslots, shape, image_dtype(detector.bit_depth), **kwargs)
+
+    def __getstate__(self):
+        return {"nslots": self.nslots, "shape": self.shape,
+                "dtype": self.dtype.str, "policy": self.policy,
+                "consumers": self.consumers, "cond": self._cond,
+                "name": self._memory.name}
+
+    def __setstate__(self, state):
+        self.nslots = state["nslots"]
+        self.shape = state["shape"]
+        self.dtype = numpy.dtype(state["dtype"])
+        self.policy = state["policy"]
+        self.consumers = state["consumers"]
+        self._cond = state["cond"]
+        self._layout()
+        self._memory = shared_memory.SharedMemory(state["name"])
+        self._owner = None
+        self._attach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _layout(self):
+        # sizes of the header and the slots, returns the total size
+        header = 8 * (len(_COUNTERS) + 3 * self.nslots)
+        self._offset = -(-header // ALIGNMENT) * ALIGNMENT
+        size = self.shape[0] * self.shape[1] * self.dtype.itemsize
+        self.slot_size = -(-size // ALIGNMENT) * ALIGNMENT
+        return self._offset + self.nslots * self.slot_size
+
+    def _attach(self):
+        count = len(_COUNTERS)
+        self._counters = numpy.ndarray(count, numpy.int64, self._memory.buf)
+        self._slots = numpy.ndarray((self.nslots, 3), numpy.int64,
+                                    self._memory.buf, 8 * count)
+
+    def close(self):
+        """
+        Detaches from the shared memory, which the creating process also
+        frees. Images must not be used afterwards.
+        """
+        if self._memory is None:
+            return
+        self._counters = self._slots = None
+        try:
+            self._memory.close()
+        except BufferError:
+            # images are still referenced, the mapping goes with them
+            pass
+        if self._owner == os.getpid():
+            self._memory.unlink()
+        self._memory = None
+
+    def _counter(self, name):
+        return int(self._counters[_COUNTERS.index(name)])
+
+    def _add(self, name, value=1):
+        self._counters[_COUNTERS.index(name)] += value
+
+    def image(self, seq):
+        """
+        Returns the image of frame *seq* as numpy array of shape (y, x),
+        a view of its slot.
+        """
+        offset = self._offset + (seq % self.nslots) * self.slot_size
+        return numpy.ndarray((self.shape[1], self.shape[0]), self.dtype,
+                             self._memory.buf, offset)
+
+    def claim(self, timeout=None):
+        """
+        Returns the sequence number of the next frame, whose slot the caller
+        may write to until it calls :py:meth:`publish`. Waits for a free
+        slot according to the policy.
+
+        :param float timeout: maximum time to wait in seconds
+        :raises queue.Full: if no slot becomes free within *timeout*
+        """
+        def available():
+            # the next slot, unless it is in use and the policy is to block
+            slot = self._slots[self._counter("head") % self.nslots]
+            return slot[1] == FREE or \
+                (slot[1] == READY and self.policy == OVERWRITE)
+
+        with self._cond:
+            if not available():
+                self._add("waits")
+                if not self._cond.wait_for(available, timeout):
+                    raise queue.Full("no free slot in the ring")
+            seq = self._counter("head")
+            slot = self._slots[seq % self.nslots]
+            if slot[1] == READY:
+                self._add("overwritten")
+            else:
+                self._add("used")
+                used = self._counter("used")
+                if used > self._counter("high_water"):
+                    self._counters[_COUNTERS.index("high_water")] = used
+            slot[:] = (seq, CLAIMED, 0)
+            self._add("head")
+            self._add("claimed")
+            return seq
+
+    def publish(self, seq):
+        """
+        Makes the claimed frame *seq* available to consumers.
+        """
+        with self._cond:
+            slot = self._slots[seq % self.nslots]
+            if slot[0] != seq or slot[1] != CLAIMED:
+                raise ValueError("frame {0} is not claimed".format(seq))
+            slot[1:] = (READY, self.consumers)
+            self._add("published")
+            self._cond.notify_all()
+
+    def put(self, image, timeout=None):
+        """
+        Copies *image* into the next slot and publishes it.
+
+        :returns: the frame's sequence number
+        """
+        seq = self.claim(timeout)
+        self.image(seq)[...] = image
+        self.publish(seq)
+        return seq
+
+    def get(self, seq, timeout=None):
+        """
+        Waits until frame *seq* is published and returns its image.
+
+        :param int seq: sequence number
+        :param float timeout: maximum time to wait in seconds
+        :raises FrameLost: if the frame is no longer in the ring
+        :raises queue.Empty: if the frame is not published within *timeout*
+        """
+        slot = self._slots[seq % self.nslots]
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: slot[0] > seq or
+                    (slot[0] == seq and slot[1] != CLAIMED), timeout):
+                raise queue.Empty("frame {0} not published".format(seq))
+            if slot[0] != seq or slot[1] != READY:
+                raise FrameLost("frame {0} is no longer in the ring".format(
+                    seq))
+        return self.image(seq)
+
+    def valid(self, seq):
+        """
+        Returns whether frame *seq* is still in the ring. With the
+        :py:data:`OVERWRITE` policy, check this after reading an image.
+        """
+        slot = self._slots[seq % self.nslots]
+        return slot[0] == seq and slot[1] == READY
+
+    def release(self, seq):
+        """
+        Releases frame *seq*. Once it was released by all consumers its slot
+        is free again.
+
+        :returns: False if the frame was no longer in the ring
+        """
+        with self._cond:
+            slot = self._slots[seq % self.nslots]
+            if slot[0] != seq or slot[1] != READY:
+                return False
+            slot[2] -= 1
+            if slot[2] <= 0:
+                slot[1] = FREE
+                self._add("used", -1)
+                self._add("released")
+                self._cond.notify_all()
+            return True
+
+    def oldest(self):
+        """
+        Returns the sequence number of the oldest frame in the ring (or of
+        the next frame, if the ring is empty).
+        """
+        with self._cond:
+            held = self._slots[self._slots[:, 1] != FREE, 0]
+            return int(held.min()) if len(held) else self._counter("head")
+
+    def frames(self, start=None, timeout=None):
+        """
+        Yields ``(seq, image)`` for the frames from *start* (default: the
+        oldest frame) on, skipping frames which are lost. The caller releases
+        the frames.
+
+        :param float timeout: maximum time to wait for each frame
+        :raises queue.Empty: if no frame is published within *timeout*
+        """
+        seq = self.oldest() if start is None else start
+        while True:
+            try:
+                image = self.get(seq, timeout)
+            except FrameLost:
+                seq = max(seq + 1, self.oldest())
+                continue
+            yield seq, image
+            seq += 1
+
+    def stats(self):
+        """
+        Returns the occupancy (number and fraction of slots in use and the
+        maximum number in use so far) and the counters of claimed,
+        published, released and overwritten frames and of claims which had
+        to wait.
+
+        :rtype: dict
+        """
+        with self._cond:
+            stats = dict((name, self._counter(name)) for name in _COUNTERS)
+        stats["slots"] = self.nslots
+        stats["occupancy"] = stats["used"] / float(self.nslots)
+        stats["policy"] = self.policy
+        return stats
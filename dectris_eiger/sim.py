@@ -0,0 +1,1017 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: sim
+   :synopsis: This module contains a local simulator of a DCU: a web server
+              speaking the SIMPLON API and serving the data buffer, with a
+              model of the detector's state machine, synthetic HDF5 files and
+              an injectable network (latency, jitter, bandwidth) and faults.
+              It is meant for offline tests and benchmarks.
+
+The simulator serves the same URLs as a DCU, so it works with both the
+explicit port and the ``port == -1`` form of the interface classes::
+
+  with Simulator() as sim:
+      detector = EigerDetector("127.0.0.1", sim.port)
+      # or: EigerDetector("127.0.0.1:{0}".format(sim.port), -1)
+      detector.arm()
+      detector.trigger()
+      detector.buffer.download("series_1_*", "/tmp")
+
+It can also be run as a stand-alone server::
+
+  python -m dectris_eiger.sim --port 8080 --latency 0.002 --bandwidth 100
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+try:
+    import h5py
+    import numpy
+except ImportError:
+    h5py = None
+
+from .communication import SUBSYSTEMS
+
+
+#: signature at the start of every HDF5 file
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+
+#: size of the header of a synthetic file without h5py, see
+#: :py:class:`SyntheticFile`
+HEADER_SIZE = 512
+
+#: size of the block a synthetic file's payload repeats
+PATTERN_SIZE = 64 * 1024
+
+#: largest payload of a synthetic HDF5 file stored in its metadata, see
+#: :py:class:`SyntheticFile`
+COMPACT_SIZE = 32 * 1024
+
+#: chunk size for sending bodies
+SEND_CHUNK_SIZE = 64 * 1024
+
+#: readout time of the simulated detector in seconds
+READOUT_TIME = 1e-5
+
+#: initial configuration: key -> (value, value type, unit, access mode,
+#: min, max)
+DEFAULT_CONFIG = {
+    "detector": {
+        "count_time": (0.1, "float", "s", "rw", 3e-6, 3600.0),
+        "frame_time": (0.1, "float", "s", "rw", 3e-3, 3600.0),
+        "nimages": (1, "uint", "", "rw", 1, 1000000),
+        "ntrigger": (1, "uint", "", "rw", 1, 1000000),
+        "photon_energy": (8000.0, "float", "eV", "rw", 2000.0, 20000.0),
+        "wavelength": (1.5498, "float", "A", "rw", 0.6199, 6.1992),
+        "threshold_energy": (4000.0, "float", "eV", "rw", 1000.0, 18000.0),
+        "flatfield_correction_applied": (True, "bool", "", "rw", None,
+                                         None),
+        "auto_summation": (True, "bool", "", "rw", None, None),
+        "countrate_correction_applied": (True, "bool", "", "rw", None, None),
+        "trigger_mode": ("ints", "string", "", "rw", None, None),
+        "bit_depth_readout": (32, "uint", "", "r", None, None),
+        "detector_readout_time": (READOUT_TIME, "float", "s", "r", None,
+                                  None),
+        "x_pixels_in_detector": (1030, "uint", "", "r", None, None),
+        "y_pixels_in_detector": (1065, "uint", "", "r", None, None),
+        "x_pixel_size": (7.5e-5, "float", "m", "r", None, None),
+        "y_pixel_size": (7.5e-5, "float", "m", "r", None, None),
+        "description": ("Dectris Eiger 1M (simulated)", "string", "", "r",
+                        None, None),
+        "detector_number": ("E-00-0000", "string", "", "r", None, None),
+        "software_version": ("1.6.0", "string", "", "r", None, None),
+        "sensor_material": ("Si", "string", "", "r", None, None),
+        "sensor_thickness": (4.5e-4, "float", "m", "r", None, None),
+    },
+    "filewriter": {
+        "mode": ("enabled", "string", "", "rw", None, None),
+        "transfer_mode": ("HTTP", "string", "", "rw", None, None),
+        "nimages_per_file": (1000, "uint", "", "rw", 0, 1000000),
+        "image_nr_start": (1, "uint", "", "rw", 0, None),
+        "name_pattern": ("series_$id", "string", "", "rw", None, None),
+        "compression_enabled": (True, "bool", "", "rw", None, None),
+    },
+    "monitor": {
+        "mode": ("disabled", "string", "", "rw", None, None),
+        "buffer_size": (512, "uint", "", "rw", 1, 10000),
+    },
+    "stream": {
+        "mode": ("disabled", "string", "", "rw", None, None),
+        "header_detail": ("basic", "string", "", "rw", None, None),
+        "header_appendix": ("", "string", "", "rw", None, None),
+        "image_appendix": ("", "string", "", "rw", None, None),
+    },
+}
+
+
+class Link(object):
+    """
+    Model of the network between the client and the DCU. Every request is
+    delayed by *latency* plus a random *jitter* (both in seconds), response
+    bodies share a bandwidth of *bandwidth* bytes per second and each of
+    them is sent with at most *stream_bandwidth* bytes per second, like a
+    single TCP stream (default: unlimited).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None,
+                 stream_bandwidth=None):
+        super(Link, self).__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.stream_bandwidth = stream_bandwidth
+        self._free_at = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """
+        Sleeps for the latency of one request.
+        """
+        delay = self.latency + random.uniform(0.0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def transmit(self, write, data):
+        """
+        Writes *data* with *write* once the link has capacity for it.
+        """
+        if self.bandwidth:
+            with self._lock:
+                now = time.time()
+                self._free_at = max(now, self._free_at) + \
+                    len(data) / float(self.bandwidth)
+                wait = self._free_at - now
+            time.sleep(wait)
+        write(data)
+
+    def pace(self, start, sent):
+        """
+        Sleeps until a body of which *sent* bytes were sent since *start*
+        is within the stream bandwidth.
+        """
+        if self.stream_bandwidth:
+            wait = start + sent / float(self.stream_bandwidth) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+
+class Fault(object):
+    """
+    A fault injected into requests whose path matches the regular expression
+    *pattern* and whose method is in *methods* (default: all). Each matching
+    request fails with *probability*, at most *count* times (default:
+    unlimited). *kind* is one of
+
+    * "error": answer with HTTP *status*
+    * "drop": close the connection without answering
+    * "delay": answer normally after *delay* seconds
+    * "truncate": close the connection after half of the response body
+    * "reset": reset the connection (TCP RST) after half of the response
+      body
+
+    :param str kind: kind of fault
+    :param str pattern: regular expression matched against the path
+    :param float probability: probability of a matching request to fail
+    :param int count: maximum number of failures
+    :param int status: HTTP status of "error" faults
+    :param float delay: delay of "delay" faults in seconds
+    :param methods: HTTP methods the fault applies to
+    """
+
+    KINDS = ("error", "drop", "delay", "truncate", "reset")
+
+    def __init__(self, kind="error", pattern="", probability=1.0, count=None,
+                 status=503, delay=1.0, methods=None):
+        super(Fault, self).__init__()
+        if kind not in self.KINDS:
+            raise ValueError("unknown fault kind {0}".format(kind))
+        self.kind = kind
+        self.pattern = re.compile(pattern)
+        self.probability = probability
+        self.count = count
+        self.status = status
+        self.delay = delay
+        self.methods = methods
+        self.injected = 0
+        self._lock = threading.Lock()
+
+    def fires(self, method, path):
+        """
+        Returns True if the fault applies to a request.
+        """
+        if self.methods is not None and method not in self.methods:
+            return False
+        if not self.pattern.search(path):
+            return False
+        with self._lock:
+            if self.count is not None and self.injected >= self.count:
+                return False
+            if random.random() >= self.probability:
+                return False
+            self.injected += 1
+            return True
+
+
+def _hdf5_metadata(length, description, data=None):
+    # returns the bytes before and after the raw data of an HDF5 file with
+    # the uint8 dataset "data" of *length* bytes and the JSON string
+    # *description* in the root group's attribute "description". The
+    # dataset is contiguous and the file is written sparse, so the raw data
+    # is never written. With *data*, the dataset is compact instead, holds
+    # *data* and the whole file is returned before the (empty) raw data
+    fd, path = tempfile.mkstemp(suffix=".h5")
+    os.close(fd)
+    try:
+        with h5py.File(path, "w", libver="latest", meta_block_size=0) as h5:
+            h5.attrs["description"] = numpy.bytes_(description)
+            dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+            dcpl.set_obj_track_times(False)
+            if data is None:
+                dcpl.set_layout(h5py.h5d.CONTIGUOUS)
+                dcpl.set_alloc_time(h5py.h5d.ALLOC_TIME_EARLY)
+                dcpl.set_fill_time(h5py.h5d.FILL_TIME_NEVER)
+            else:
+                dcpl.set_layout(h5py.h5d.COMPACT)
+            space = h5py.h5s.create_simple((length,))
+            dataset = h5py.h5d.create(h5.id, b"data", h5py.h5t.NATIVE_UINT8,
+                                      space, dcpl=dcpl)
+            if data is None:
+                offset = dataset.get_offset()
+            else:
+                dataset.write(h5py.h5s.ALL, h5py.h5s.ALL,
+                              numpy.frombuffer(data, "uint8"))
+        with open(path, "rb") as f:
+            if data is not None:
+                return f.read(), b""
+            header = f.read(offset)
+            f.seek(offset + length)
+            trailer = f.read()
+    finally:
+        os.remove(path)
+    return header, trailer
+
+
+class SyntheticFile(object):
+    """
+    Content of a file in the simulated data buffer. The content is not
+    stored but generated on demand from a pseudo-random block of
+    :py:data:`PATTERN_SIZE` bytes repeated up to *size*.
+
+    With h5py, the file is a real HDF5 file: the block fills the uint8
+    dataset ``/data``, and the root group's attribute ``description`` holds
+    the name and *description* as JSON. Only the HDF5 metadata is created
+    with h5py (for payloads up to :py:data:`COMPACT_SIZE` the whole file),
+    files smaller than the metadata (about 500 bytes) are enlarged.
+
+    Without h5py the format is fake: an HDF5 signature and the JSON
+    description padded to :py:data:`HEADER_SIZE` bytes precede the block,
+    which only looks like HDF5 to tools checking the signature.
+
+    The content only depends on the name, description and size, so it is
+    the same for every read.
+    """
+
+    def __init__(self, name, size, description=None):
+        super(SyntheticFile, self).__init__()
+        self.name = name
+        self.mtime = time.time()
+        self._pattern = None
+        meta = json.dumps(dict(description or {}, name=name)).encode()
+        if h5py is not None:
+            header, trailer = _hdf5_metadata(COMPACT_SIZE, meta)
+            length = size - len(header) - len(trailer)
+            if length > COMPACT_SIZE:
+                header, trailer = _hdf5_metadata(length, meta)
+            else:
+                # HDF5 pads small contiguous datasets, compact ones are not
+                length = max(1, length)
+                header, trailer = _hdf5_metadata(length, meta,
+                                                 self.pattern[:length])
+                length = 0
+        else:
+            header = HDF5_SIGNATURE + struct.pack("<I", len(meta)) + meta
+            header = header[:HEADER_SIZE].ljust(HEADER_SIZE, b"\0")
+            trailer = b""
+            length = max(0, size - HEADER_SIZE)
+        self._header = header
+        self._trailer = trailer
+        self._data_end = len(header) + length
+        self.size = self._data_end + len(trailer)
+
+    @property
+    def etag(self):
+        return '"{0:x}-{1:x}"'.format(self.size, int(self.mtime * 1e6))
+
+    @property
+    def pattern(self):
+        if self._pattern is None:
+            rng = random.Random(hashlib.md5(self.name.encode()).digest())
+            self._pattern = bytes(bytearray(rng.getrandbits(8)
+                                            for _ in range(256))) * \
+                (PATTERN_SIZE // 256)
+        return self._pattern
+
+    def chunks(self, start=0, end=None, chunk_size=SEND_CHUNK_SIZE):
+        """
+        Yields the bytes from *start* up to (excluding) *end* in chunks of
+        at most *chunk_size* bytes.
+        """
+        if end is None or end > self.size:
+            end = self.size
+        data_start, data_end = len(self._header), self._data_end
+        pos = start
+        while pos < end:
+            if pos < data_start:
+                chunk = self._header[pos:min(end, data_start)]
+            elif pos >= data_end:
+                chunk = self._trailer[pos - data_end:end - data_end]
+            else:
+                offset = (pos - data_start) % PATTERN_SIZE
+                length = min(min(end, data_end) - pos, PATTERN_SIZE - offset,
+                             chunk_size)
+                chunk = self.pattern[offset:offset + length]
+            pos += len(chunk)
+            yield chunk
+
+    def read(self, start=0, end=None):
+        """
+        Returns the bytes from *start* up to (excluding) *end*.
+        """
+        return b"".join(self.chunks(start, end))
+
+
+class SimulatedDCU(object):
+    """
+    State of a simulated DCU: the configuration and status of all
+    subsystems, the detector's state machine and the data buffer.
+
+    The detector starts "idle". Arming takes *arm_time* seconds in state
+    "configure" and ends in "ready". Each trigger acquires *nimages* images
+    in state "acquire" and returns when they are taken, after the last of
+    *ntrigger* triggers (or disarm, cancel or abort) the series ends and the
+    detector returns to "idle".
+
+    While the file writer is enabled, it is in state "acquire" during a
+    series, a data file is added to the buffer whenever *nimages_per_file*
+    images are acquired and the master file is added at the end of the
+    series. Data files are sized from the detector
+    geometry and bit depth (scaled by *compression_ratio* with compression
+    enabled).
+
+    :param float arm_time: duration of arming in seconds
+    :param float compression_ratio: size of compressed to raw images
+    :param int buffer_size: capacity of the data buffer in bytes
+    """
+
+    def __init__(self, arm_time=0.05, compression_ratio=0.25,
+                 buffer_size=4 * 1024 ** 3):
+        super(SimulatedDCU, self).__init__()
+        self.arm_time = arm_time
+        self.compression_ratio = compression_ratio
+        self.buffer_size = buffer_size
+        self.config = {}
+        self.meta = {}
+        for subsystem, keys in DEFAULT_CONFIG.items():
+            self.config[subsystem] = {}
+            for key, spec in keys.items():
+                self.config[subsystem][key] = spec[0]
+                self.meta[(subsystem, key)] = spec[1:]
+        self.state = dict((subsystem, "idle") for subsystem in SUBSYSTEMS)
+        self.state["filewriter"] = "ready"
+        self.state["stream"] = "disabled"
+        self.errors = dict((subsystem, []) for subsystem in SUBSYSTEMS)
+        self.files = collections.OrderedDict()
+        self.files_version = 0
+        self._listing = None
+        self._used = 0
+        self.sequence_id = 0
+        self._series = None
+        self._lock = threading.RLock()
+
+    # values
+    def get(self, subsystem, section, key):
+        """
+        Returns the response dict of a key or None if the key does not
+        exist.
+        """
+        with self._lock:
+            if section == "config":
+                if key not in self.config.get(subsystem, {}):
+                    return None
+                value_type, unit, access, vmin, vmax = \
+                    self.meta[(subsystem, key)]
+                data = {"value": self.config[subsystem][key],
+                        "value_type": value_type, "access_mode": access}
+                if unit:
+                    data["unit"] = unit
+                if vmin is not None:
+                    data["min"] = vmin
+                if vmax is not None:
+                    data["max"] = vmax
+                return data
+            elif section == "status":
+                return self._status(subsystem, key)
+            return None
+
+    def _status(self, subsystem, key):
+        if key == "state":
+            return {"value": self.state[subsystem], "value_type": "string"}
+        elif key == "error":
+            return {"value": list(self.errors[subsystem]),
+                    "value_type": "list"}
+        elif key == "time":
+            return {"value": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "value_type": "string"}
+        elif subsystem == "stream" and key == "dropped":
+            return {"value": 0, "value_type": "uint"}
+        elif subsystem == "filewriter" and key == "buffer_free":
+            return {"value": self.buffer_free, "value_type": "uint",
+                    "unit": "B"}
+        elif subsystem == "detector" and key.endswith("/th0_temp"):
+            return {"value": 30.0 + random.gauss(0.0, 0.1),
+                    "value_type": "float", "unit": "degC"}
+        elif subsystem == "detector" and key.endswith("/th0_humidity"):
+            return {"value": 5.0 + random.gauss(0.0, 0.1),
+                    "value_type": "float", "unit": "%"}
+        return None
+
+    def set(self, subsystem, key, value):
+        """
+        Sets a configuration value and returns the list of changed keys.
+
+        :raises KeyError: if the key does not exist
+        :raises ValueError: if the key is read-only or the value invalid
+        """
+        with self._lock:
+            if key not in self.config.get(subsystem, {}):
+                raise KeyError(key)
+            value_type, _, access, vmin, vmax = self.meta[(subsystem, key)]
+            if access != "rw":
+                raise ValueError("{0} is read-only".format(key))
+            if value_type in ("float", "uint"):
+                value = float(value) if value_type == "float" else int(value)
+                if (vmin is not None and value < vmin) or \
+                        (vmax is not None and value > vmax):
+                    raise ValueError("{0} out of range".format(key))
+            config = self.config[subsystem]
+            config[key] = value
+            changed = [key]
+            if subsystem == "stream" and key == "mode":
+                self.state["stream"] = "ready" if value == "enabled" \
+                    else "disabled"
+            if subsystem != "detector":
+                return changed
+            if key in ("photon_energy", "wavelength"):
+                other = "wavelength" if key == "photon_energy" \
+                    else "photon_energy"
+                config[other] = 12398.4 / value
+                config["threshold_energy"] = config["photon_energy"] / 2.0
+                changed += [other, "threshold_energy"]
+            elif key == "frame_time" and \
+                    config["count_time"] > value - READOUT_TIME:
+                config["count_time"] = value - READOUT_TIME
+                changed.append("count_time")
+            elif key == "count_time" and \
+                    config["frame_time"] < value + READOUT_TIME:
+                config["frame_time"] = value + READOUT_TIME
+                changed.append("frame_time")
+            return changed
+
+    # buffer
+    @property
+    def buffer_free(self):
+        return max(0, self.buffer_size - self._used)
+
+    def add_file(self, name, size, description=None):
+        """
+        Adds a synthetic file to the data buffer and returns it, or returns
+        None and flags an error if the buffer is full.
+        """
+        with self._lock:
+            if size > self.buffer_free:
+                self.errors["filewriter"] = ["buffer full"]
+                return None
+            f = SyntheticFile(name, size, description)
+            self.delete_file(name)
+            self.files[name] = f
+            self._used += f.size
+            self.files_version += 1
+            return f
+
+    def delete_file(self, name):
+        """
+        Removes a file from the data buffer, returns False if it does not
+        exist.
+        """
+        with self._lock:
+            f = self.files.pop(name, None)
+            if f is None:
+                return False
+            self._used -= f.size
+            self.files_version += 1
+            return True
+
+    def clear_files(self):
+        with self._lock:
+            self.files.clear()
+            self._used = 0
+            self.files_version += 1
+            self.errors["filewriter"] = []
+
+    def listing(self):
+        """
+        Returns the version of the file list and the list as JSON, with the
+        files in the order they were written.
+        """
+        with self._lock:
+            if self._listing is None or \
+                    self._listing[0] != self.files_version:
+                self._listing = (self.files_version,
+                                 json.dumps(list(self.files)).encode())
+            return self._listing
+
+    # commands
+    def command(self, subsystem, key, value):
+        """
+        Executes a command and returns the response dict (or None for
+        commands without response).
+
+        :raises KeyError: if the command does not exist
+        :raises ValueError: if the command is not possible in this state
+        """
+        if subsystem != "detector":
+            if key == "initialize":
+                with self._lock:
+                    self.state[subsystem] = "ready"
+                    self.errors[subsystem] = []
+            elif key == "clear":
+                if subsystem == "filewriter":
+                    self.clear_files()
+            else:
+                raise KeyError(key)
+            return None
+        if key == "initialize":
+            self._end_series()
+            with self._lock:
+                self.state["detector"] = "idle"
+                self.errors["detector"] = []
+            return None
+        elif key == "arm":
+            return self._arm()
+        elif key == "trigger":
+            self._trigger(value)
+            return None
+        elif key in ("disarm", "cancel", "abort"):
+            self._end_series()
+            with self._lock:
+                self.state["detector"] = "idle"
+                return {"sequence id": self.sequence_id}
+        raise KeyError(key)
+
+    def _arm(self):
+        with self._lock:
+            if self.state["detector"] not in ("idle", "ready"):
+                raise ValueError("can not arm in state {0}".format(
+                    self.state["detector"]))
+            if self._series is None:
+                self.sequence_id += 1
+                self._series = {"id": self.sequence_id, "triggers": 0,
+                                "images": 0, "files": 0, "filed": 0,
+                                "cancel": False}
+                if self.config["filewriter"]["mode"] == "enabled":
+                    self.state["filewriter"] = "acquire"
+            self.state["detector"] = "configure"
+        time.sleep(self.arm_time)
+        with self._lock:
+            if self.state["detector"] == "configure":
+                self.state["detector"] = "ready"
+            return {"sequence id": self.sequence_id}
+
+    def _trigger(self, value):
+        with self._lock:
+            config = self.config["detector"]
+            series = self._series
+            if series is None or self.state["detector"] != "ready":
+                raise ValueError("can not trigger in state {0}".format(
+                    self.state["detector"]))
+            if config["trigger_mode"] == "inte" and value not in (None, -1):
+                frame_time = float(value)
+            else:
+                frame_time = config["frame_time"]
+            nimages = config["nimages"]
+            self.state["detector"] = "acquire"
+        t0 = time.time()
+        for i in range(nimages):
+            # sleep until the end of the image
+            time.sleep(max(0.0, t0 + (i + 1) * frame_time - time.time()))
+            with self._lock:
+                if series["cancel"]:
+                    return
+                series["images"] += 1
+                self._write_data_files(series, final=False)
+        with self._lock:
+            series["triggers"] += 1
+            if series["triggers"] >= config["ntrigger"]:
+                self._end_series()
+                self.state["detector"] = "idle"
+            else:
+                self.state["detector"] = "ready"
+
+    def _end_series(self):
+        with self._lock:
+            series = self._series
+            if series is None:
+                return
+            series["cancel"] = True
+            self._series = None
+            self._write_data_files(series, final=True)
+            if self.config["filewriter"]["mode"] == "enabled":
+                name = "{0}_master.h5".format(self._series_name(series))
+                self.add_file(name, 64 * 1024 + 16 * series["images"],
+                              self._description(series, series["images"]))
+            if self.state["filewriter"] == "acquire":
+                self.state["filewriter"] = "ready"
+
+    def _series_name(self, series):
+        pattern = self.config["filewriter"]["name_pattern"]
+        return pattern.replace("$id", str(series["id"]))
+
+    def _description(self, series, nimages):
+        detector = self.config["detector"]
+        return {"series": series["id"], "nimages": nimages,
+                "bit_depth": detector["bit_depth_readout"],
+                "x_pixels": detector["x_pixels_in_detector"],
+                "y_pixels": detector["y_pixels_in_detector"]}
+
+    def image_size(self):
+        """
+        Returns the size of one image in a data file in bytes.
+        """
+        detector = self.config["detector"]
+        size = detector["x_pixels_in_detector"] * \
+            detector["y_pixels_in_detector"] * \
+            detector["bit_depth_readout"] // 8
+        if self.config["filewriter"]["compression_enabled"]:
+            size = int(size * self.compression_ratio)
+        return size
+
+    def _write_data_files(self, series, final):
+        # adds data files for the images not yet in a file
+        filewriter = self.config["filewriter"]
+        if filewriter["mode"] != "enabled":
+            return
+        per_file = filewriter["nimages_per_file"] or series["images"] or 1
+        while True:
+            pending = series["images"] - series["filed"]
+            if pending <= 0 or (pending < per_file and not final):
+                return
+            nimages = min(pending, per_file)
+            series["files"] += 1
+            name = "{0}_data_{1:06d}.h5".format(self._series_name(series),
+                                                series["files"])
+            self.add_file(name, HEADER_SIZE + nimages * self.image_size(),
+                          self._description(series, nimages))
+            series["filed"] += nimages
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """
+    Answers SIMPLON API and data buffer requests from the server's
+    :py:class:`SimulatedDCU`.
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "EigerSimulator/1.0"
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, method):
+        sim = self.server.simulator
+        sim.count(method)
+        path = unquote(self.path.split("?", 1)[0])
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        sim.link.delay()
+        self._truncate = None
+        for fault in sim.faults:
+            if fault.fires(method, path):
+                if fault.kind == "error":
+                    return self._send(fault.status, b"injected fault",
+                                      "text/plain")
+                elif fault.kind == "drop":
+                    self.close_connection = True
+                    return
+                elif fault.kind == "delay":
+                    time.sleep(fault.delay)
+                else:
+                    self._truncate = fault.kind
+        parts = path.strip("/").split("/")
+        if parts[0] == "data" and len(parts) > 1:
+            return self._data(method, "/".join(parts[1:]))
+        if len(parts) >= 3 and parts[0] in SUBSYSTEMS and parts[1] == "api":
+            return self._api(method, parts[0], parts[2], parts[3:], body)
+        self._send(404, b"not found", "text/plain")
+
+    def _api(self, method, subsystem, version, parts, body):
+        dcu = self.server.simulator.dcu
+        if version == "version":
+            return self._json({"value": self.server.simulator.api_version,
+                               "value_type": "string"})
+        if subsystem == "filewriter" and parts and parts[0] == "files":
+            name = "/".join(parts[1:])
+            if method == "DELETE" and name:
+                found = dcu.delete_file(name)
+                return self._send(204 if found else 404)
+            if name:
+                return self._send(404, b"not found", "text/plain")
+            version, body = dcu.listing()
+            headers = []
+            if self.server.simulator.list_etags:
+                etag = '"files-{0}"'.format(version)
+                if self.headers.get("If-None-Match") == etag:
+                    return self._send(304, headers=[("ETag", etag)])
+                headers.append(("ETag", etag))
+            return self._send(200, body, "application/json", headers)
+        if len(parts) < 2:
+            return self._send(404, b"not found", "text/plain")
+        section, key = parts[0], "/".join(parts[1:])
+        if method in ("GET", "HEAD"):
+            data = dcu.get(subsystem, section, key)
+            if data is None:
+                return self._send(404, b"not found", "text/plain")
+            return self._json(data)
+        if method != "PUT":
+            return self._send(405, b"method not allowed", "text/plain")
+        try:
+            value = json.loads(body.decode())["value"] if body else None
+        except (ValueError, KeyError, TypeError):
+            return self._send(400, b"invalid request", "text/plain")
+        try:
+            if section == "command":
+                data = dcu.command(subsystem, key, value)
+            elif section == "config":
+                data = dcu.set(subsystem, key, value)
+            else:
+                return self._send(405, b"method not allowed", "text/plain")
+        except KeyError:
+            return self._send(404, b"not found", "text/plain")
+        except ValueError as e:
+            return self._send(400, str(e).encode(), "text/plain")
+        if data is None:
+            return self._send(200)
+        self._json(data)
+
+    def _data(self, method, name):
+        dcu = self.server.simulator.dcu
+        if method == "DELETE":
+            found = dcu.delete_file(name)
+            return self._send(204 if found else 404)
+        with dcu._lock:
+            f = dcu.files.get(name)
+        if f is None:
+            return self._send(404, b"not found", "text/plain")
+        start, end = 0, f.size
+        status = 200
+        headers = [("ETag", f.etag),
+                   ("Last-Modified", self.date_time_string(f.mtime))]
+        byte_range = None
+        if self.server.simulator.ranges:
+            headers.append(("Accept-Ranges", "bytes"))
+            if self.headers.get("If-Range", f.etag) == f.etag:
+                byte_range = self._range(f.size)
+        if byte_range is False:
+            return self._send(416, headers=[
+                ("Content-Range", "bytes */{0}".format(f.size))])
+        elif byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers.append(("Content-Range", "bytes {0}-{1}/{2}".format(
+                start, end - 1, f.size)))
+        self._start(status, end - start, "application/octet-stream",
+                    headers)
+        if method == "HEAD":
+            return
+        self._write(f.chunks(start, end), end - start)
+
+    def _range(self, size):
+        # returns (start, end) of a satisfiable Range header, False for an
+        # unsatisfiable one, None if there is none
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        match = re.match(r"bytes=(\d*)-(\d*)$", header.strip())
+        if not match or match.group(1) == match.group(2) == "":
+            return None
+        first, last = match.groups()
+        if first == "":
+            start, end = max(0, size - int(last)), size
+        else:
+            start = int(first)
+            end = min(size, int(last) + 1) if last else size
+        if start >= size or start >= end:
+            return False
+        return start, end
+
+    def _json(self, data):
+        self._send(200, json.dumps(data).encode(), "application/json")
+
+    def _send(self, status, body=b"", content_type=None, headers=()):
+        self._start(status, len(body), content_type, headers)
+        if body and self.command != "HEAD":
+            self._write([body], len(body))
+
+    def _start(self, status, length, content_type=None, headers=()):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _write(self, chunks, length):
+        sim = self.server.simulator
+        limit = length // 2 if self._truncate else None
+        sent = 0
+        start = time.time()
+        for chunk in chunks:
+            if limit is not None and sent + len(chunk) > limit:
+                chunk = chunk[:limit - sent]
+            sim.link.transmit(self.wfile.write, chunk)
+            sent += len(chunk)
+            sim.link.pace(start, sent)
+            if limit is not None and sent >= limit:
+                self.wfile.flush()
+                if self._truncate == "reset":
+                    # closing with a zero linger time sends RST
+                    self.connection.setsockopt(
+                        socket.SOL_SOCKET, socket.SO_LINGER,
+                        struct.pack("ii", 1, 0))
+                self.close_connection = True
+                break
+        sim.count("bytes_sent", sent)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Simulator(object):
+    """
+    A :py:class:`SimulatedDCU` served over HTTP from a background thread.
+    *port* 0 picks a free port. The network is modelled by a
+    :py:class:`Link`, *faults* is a list of :py:class:`Fault` instances
+    (both can be changed while the simulator runs). *stats* counts the
+    requests by method and the body bytes sent.
+
+    :param str host: address to listen on
+    :param int port: port to listen on
+    :param str api_version: version reported by the API
+    :param float latency: latency of each request in seconds
+    :param float jitter: maximum additional random latency in seconds
+    :param float bandwidth: bandwidth of response bodies in bytes/s
+    :param faults: faults to inject
+    :param float stream_bandwidth: bandwidth of one response in bytes/s
+    :param bool ranges: whether the data buffer supports Range requests
+    :param bool list_etags: whether the file list supports conditional
+                            requests
+    :param dict dcu_args: arguments of the :py:class:`SimulatedDCU`
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, api_version="1.6.0",
+                 latency=0.0, jitter=0.0, bandwidth=None, faults=(),
+                 stream_bandwidth=None, ranges=True, list_etags=False,
+                 **dcu_args):
+        super(Simulator, self).__init__()
+        self.host = host
+        self.api_version = api_version
+        self.ranges = ranges
+        self.list_etags = list_etags
+        self.link = Link(latency, jitter, bandwidth, stream_bandwidth)
+        self.faults = list(faults)
+        self.dcu = SimulatedDCU(**dcu_args)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._server = _Server((host, port), SimulatorHandler)
+        self._server.simulator = self
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def address(self):
+        """
+        ``host:port`` of the simulator, for use with port -1.
+        """
+        return "{0}:{1}".format(self.host, self.port)
+
+    def count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + n
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                                            name="EigerSimulator")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_fault(spec):
+    """
+    Parses a fault given as ``kind[:probability[:pattern]]``, e.g.
+    ``error:0.1`` or ``drop:0.05:^/data/``.
+    """
+    parts = spec.split(":", 2)
+    probability = float(parts[1]) if len(parts) > 1 and parts[1] else 1.0
+    pattern = parts[2] if len(parts) > 2 else ""
+    return Fault(parts[0], pattern, probability)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m dectris_eiger.sim",
+        description="Simulated Eiger DCU (SIMPLON API and data buffer).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--api-version", default="1.6.0")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum additional latency in seconds")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="bandwidth in MB/s (default: unlimited)")
+    parser.add_argument("--stream-bandwidth", type=float, default=None,
+                        help="bandwidth per response in MB/s "
+                             "(default: unlimited)")
+    parser.add_argument("--fault", action="append", default=[],
+                        type=parse_fault,
+                        help="fault to inject as kind[:probability[:pattern]]"
+                             ", kind is one of " + ", ".join(Fault.KINDS))
+    args = parser.parse_args(argv)
+    bandwidth = args.bandwidth * 1e6 if args.bandwidth else None
+    stream_bandwidth = args.stream_bandwidth * 1e6 \
+        if args.stream_bandwidth else None
+    sim = Simulator(args.host, args.port, args.api_version, args.latency,
+                    args.jitter, bandwidth, args.fault, stream_bandwidth)
+    print("Simulated DCU at http://{0}".format(sim.address))
+    try:
+        sim.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
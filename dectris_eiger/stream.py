@@ -0,0 +1,800 @@
+# -*- coding: utf-8 -*-
+"""
+.. module:: stream
+   :synopsis: This module contains an interface to the Dectris Eiger's stream
+              subsystem and a receiver for the images it sends via ZeroMQ.
+
+With the stream subsystem enabled, the DCU pushes every image to a ZeroMQ
+socket (port 9999), so that data can be taken off the detector at full frame
+rate without the file writer's buffer. Each series is sent as a header
+message, one message per image and an end message (stream API
+"stream-1.0"), which :py:class:`StreamReceiver` decodes into
+:py:class:`SeriesHeader`, :py:class:`Frame` and :py:class:`SeriesEnd`
+objects::
+
+  detector.stream.mode = "enabled"
+  with StreamReceiver("eiger.local") as receiver:
+      detector.arm()
+      detector.trigger()
+      for frame in receiver.series():
+          image = frame.decode()
+
+:py:class:`ReplayPusher` sends recorded (or synthetic, see
+:py:func:`synthetic_series`) messages from a local socket, so that
+receivers can be tested without a detector.
+
+The receiver and the pusher require the ``pyzmq`` package, decoding images
+requires ``numpy`` (and ``lz4`` or ``bitshuffle`` for compressed images).
+"""
+import hashlib
+import json
+import struct
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .communication import get_client, get_value, set_value
+
+
+#: port of the DCU's ZeroMQ push socket
+STREAM_PORT = 9999
+
+#: number of decoded messages a :py:class:`StreamReceiver` queues
+QUEUE_SIZE = 1000
+
+#: time in seconds the receiver thread waits for a message before checking
+#: whether it is to stop
+POLL_INTERVAL = 0.1
+
+
+class EigerStream(object):
+    """
+    Interface to the Dectris Eiger detector's stream subsystem. This
+    interface can be used to enable the stream and configure the detail of
+    its messages.
+    """
+
+    def __init__(self, host, port=80, api_version="1.0.0", client=None):
+        super(EigerStream, self).__init__()
+        self._host = host
+        self._port = port
+        self._api_v = api_version
+        if client is None:
+            client = get_client(host, port)
+        self._client = client
+
+    # initialize
+    def initialize(self, timeout=100.0):
+        """
+        Resets the stream subsystem to its original state.
+
+        :param float timeout: communication timeout in seconds
+        """
+        set_value(self._host, self._port, self._api_v, "stream",
+                  "command", "initialize", "initialize", timeout=timeout,
+                  no_data=True, client=self._client)
+
+    # status
+    def get_status(self, timeout=2.0, return_full=False):
+        """
+        Returns the stream's status. The status can be one of "disabled",
+        "ready", "acquire" and "error".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: subsystem status
+        :rtype: str or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "status", "state", timeout=timeout,
+                         return_full=return_full, client=self._client)
+    status = property(get_status)
+
+    # error
+    def get_error(self, timeout=2.0, return_full=False):
+        """
+        Returns list of status parameters causing error state.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: list of parameters
+        :rtype: list or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "status", "error", timeout=timeout,
+                         return_full=return_full, client=self._client)
+    error = property(get_error)
+
+    # dropped
+    def get_dropped(self, timeout=2.0, return_full=False):
+        """
+        Returns the number of images which could not be sent, because no
+        receiver took them in time.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: number of dropped images
+        :rtype: int or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "status", "dropped", timeout=timeout,
+                         return_full=return_full, client=self._client)
+    dropped = property(get_dropped)
+
+    # mode
+    def get_mode(self, timeout=2.0, return_full=False):
+        """
+        Returns the operation mode, which can be "enabled" or "disabled".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the mode
+        :rtype: str or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "config", "mode", timeout=timeout,
+                         return_full=return_full, client=self._client)
+
+    def set_mode(self, mode, timeout=2.0):
+        """
+        Set the stream's operation mode, which can be "enabled" or
+        "disabled".
+
+        :param str mode: mode
+        :param float timeout: communication timeout in seconds
+        """
+        set_value(self._host, self._port, self._api_v, "stream",
+                  "config", "mode", mode, timeout=timeout, no_data=True,
+                  client=self._client)
+    mode = property(get_mode, set_mode)
+
+    # header detail
+    def get_header_detail(self, timeout=2.0, return_full=False):
+        """
+        Returns the detail of the series header message: "all" (with the
+        flatfield, pixel mask and countrate table), "basic" (with the
+        detector configuration) or "none".
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the header detail
+        :rtype: str or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "config", "header_detail", timeout=timeout,
+                         return_full=return_full, client=self._client)
+
+    def set_header_detail(self, detail, timeout=2.0):
+        """
+        Set the detail of the series header message, "all", "basic" or
+        "none".
+
+        :param str detail: header detail
+        :param float timeout: communication timeout in seconds
+        """
+        set_value(self._host, self._port, self._api_v, "stream",
+                  "config", "header_detail", detail, timeout=timeout,
+                  no_data=True, client=self._client)
+    header_detail = property(get_header_detail, set_header_detail)
+
+    # header appendix
+    def get_header_appendix(self, timeout=2.0, return_full=False):
+        """
+        Returns the user data appended to the series header message.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the appendix
+        :rtype: str or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "config", "header_appendix", timeout=timeout,
+                         return_full=return_full, client=self._client)
+
+    def set_header_appendix(self, appendix, timeout=2.0):
+        """
+        Set user data to be appended to the series header message.
+
+        :param str appendix: the appendix
+        :param float timeout: communication timeout in seconds
+        """
+        set_value(self._host, self._port, self._api_v, "stream",
+                  "config", "header_appendix", appendix, timeout=timeout,
+                  no_data=True, client=self._client)
+    header_appendix = property(get_header_appendix, set_header_appendix)
+
+    # image appendix
+    def get_image_appendix(self, timeout=2.0, return_full=False):
+        """
+        Returns the user data appended to every image message.
+
+        :param float timeout: communication timeout in seconds
+        :param bool return_full: whether to return the full response dict
+        :returns: the appendix
+        :rtype: str or dict
+        """
+        return get_value(self._host, self._port, self._api_v, "stream",
+                         "config", "image_appendix", timeout=timeout,
+                         return_full=return_full, client=self._client)
+
+    def set_image_appendix(self, appendix, timeout=2.0):
+        """
+        Set user data to be appended to every image message.
+
+        :param str appendix: the appendix
+        :param float timeout: communication timeout in seconds
+        """
+        set_value(self._host, self._port, self._api_v, "stream",
+                  "config", "image_appendix", appendix, timeout=timeout,
+                  no_data=True, client=self._client)
+    image_appendix = property(get_image_appendix, set_image_appendix)
+
+
+class StreamError(Exception):
+    """
+    Raised for messages which do not follow the stream API.
+    """
+
+
+class SeriesHeader(object):
+    """
+    First message of a series. Depending on the header detail it carries the
+    detector configuration (*config*, "basic" and "all") and the flatfield,
+    pixel mask and countrate table ("all") as ``(info, data)`` tuples of the
+    part's description dict and its raw data.
+    """
+
+    def __init__(self, series, detail, config=None, flatfield=None,
+                 pixel_mask=None, countrate_table=None, appendix=None):
+        super(SeriesHeader, self).__init__()
+        self.series = series
+        self.detail = detail
+        self.config = config
+        self.flatfield = flatfield
+        self.pixel_mask = pixel_mask
+        self.countrate_table = countrate_table
+        self.appendix = appendix
+
+    def __repr__(self):
+        return "SeriesHeader(series={0}, detail={1!r})".format(self.series,
+                                                               self.detail)
+
+
+class Frame(object):
+    """
+    One image of a series. *data* is the image as sent (a buffer of *size*
+    bytes, compressed according to *encoding*); :py:meth:`decode` returns it
+    as array. *shape* is given as (x, y) like in the stream API, times are
+    in nanoseconds.
+    """
+
+    def __init__(self, series, frame, shape, dtype, encoding, data,
+                 size=None, hash=None, start_time=None, stop_time=None,
+                 real_time=None, appendix=None):
+        super(Frame, self).__init__()
+        self.series = series
+        self.frame = frame
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.encoding = encoding
+        self.data = data
+        self.size = size if size is not None else len(data)
+        self.hash = hash
+        self.start_time = start_time
+        self.stop_time = stop_time
+        self.real_time = real_time
+        self.appendix = appendix
+
+    def __repr__(self):
+        return "Frame(series={0}, frame={1}, shape={2}, encoding={3!r})" \
+            .format(self.series, self.frame, self.shape, self.encoding)
+
+    def verify(self):
+        """
+        Returns whether the data matches the MD5 hash sent with the frame.
+        """
+        return self.hash is None or \
+            hashlib.md5(self.data).hexdigest() == self.hash
+
+    def decode(self):
+        """
+        Returns the image as numpy array of shape (y, x).
+
+        :raises ImportError: if numpy or the decompression library is missing
+        :raises StreamError: if the encoding is not known
+        """
+        return decode_image(self.data, self.shape, self.dtype, self.encoding)
+
+
+class SeriesEnd(object):
+    """
+    Last message of a series.
+    """
+
+    def __init__(self, series):
+        super(SeriesEnd, self).__init__()
+        self.series = series
+
+    def __repr__(self):
+        return "SeriesEnd(series={0})".format(self.series)
+
+
+def decode_image(data, shape, dtype, encoding, out=None):
+    """
+    Decodes an image sent by the stream subsystem. Encodings are "<"
+    (uncompressed), "lz4<" and "bs<bits>-lz4<" (bitshuffle and LZ4, each
+    with little endian data).
+
+    :param data: the image as sent
+    :param tuple shape: (x, y)
+    :param str dtype: pixel type, like "uint32"
+    :param str encoding: the encoding
+    :param numpy.ndarray out: array of shape (y, x) to decode into, e.g. in
+                              shared memory
+    :returns: the image (*out* if given)
+    :rtype: numpy.ndarray
+    """
+    if numpy is None:
+        raise ImportError("Decoding images requires numpy.")
+    dtype = numpy.dtype(dtype).newbyteorder("<")
+    count = shape[0] * shape[1]
+    if encoding == "<":
+        image = numpy.frombuffer(data, dtype, count)
+    elif encoding == "lz4<":
+        try:
+            import lz4.block
+        except ImportError:
+            raise ImportError("Decoding lz4 images requires lz4.")
+        image = numpy.frombuffer(lz4.block.decompress(
+            data, uncompressed_size=count * dtype.itemsize), dtype)
+    elif encoding.startswith("bs") and encoding.endswith("-lz4<"):
+        try:
+            import bitshuffle
+        except ImportError:
+            raise ImportError("Decoding bitshuffle images requires "
+                              "bitshuffle.")
+        # 8 bytes of total size and 4 bytes of block size, big endian
+        block_size = struct.unpack(">I", bytes(data[8:12]))[0]
+        image = bitshuffle.decompress_lz4(
+            numpy.frombuffer(data, numpy.uint8, offset=12), (count,), dtype,
+            block_size // dtype.itemsize)
+    else:
+        raise StreamError("unknown encoding {0}".format(encoding))
+    image = image.reshape(shape[1], shape[0])
+    if out is None:
+        return image
+    out[...] = image
+    return out
+
+
+def _buffer(part):
+    # the data of a message part without copying it
+    return part.buffer if hasattr(part, "buffer") else memoryview(part)
+
+
+def _json(part):
+    return json.loads(bytes(_buffer(part)).decode("utf-8"))
+
+
+def parse_message(parts):
+    """
+    Decodes a multipart message of the stream subsystem into a
+    :py:class:`SeriesHeader`, :py:class:`Frame` or :py:class:`SeriesEnd`.
+    Image data is not copied.
+
+    :param list parts: the message parts (``zmq.Frame`` objects or bytes)
+    :raises StreamError: if the message is not understood
+    """
+    try:
+        info = _json(parts[0])
+        htype = info["htype"]
+        if htype.startswith("dimage-"):
+            image, config = _json(parts[1]), _json(parts[3])
+            return Frame(info["series"], info["frame"], image["shape"],
+                         image["type"], image["encoding"],
+                         _buffer(parts[2]), image.get("size"),
+                         info.get("hash"), config.get("start_time"),
+                         config.get("stop_time"), config.get("real_time"),
+                         _appendix(parts, 4))
+        elif htype.startswith("dheader-"):
+            detail = info.get("header_detail", "none")
+            header = SeriesHeader(info["series"], detail)
+            index = 1
+            if detail in ("basic", "all"):
+                header.config = _json(parts[1])
+                index = 2
+            if detail == "all":
+                for name in ("flatfield", "pixel_mask", "countrate_table"):
+                    setattr(header, name, (_json(parts[index]),
+                                           _buffer(parts[index + 1])))
+                    index += 2
+            header.appendix = _appendix(parts, index)
+            return header
+        elif htype.startswith("dseries_end-"):
+            return SeriesEnd(info["series"])
+    except (IndexError, KeyError, TypeError, ValueError) as e:
+        raise StreamError("invalid message: {0}".format(e))
+    raise StreamError("unknown message type {0}".format(htype))
+
+
+def _appendix(parts, index):
+    # the user data appended to a message, parsed as JSON if possible
+    if len(parts) <= index:
+        return None
+    text = bytes(_buffer(parts[index])).decode("utf-8")
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class StreamReceiver(object):
+    """
+    Receives the messages of the stream subsystem in a background thread and
+    decodes them with :py:func:`parse_message`. Messages are queued (up to
+    *queue_size*; when the queue is full, the receiver stops taking messages
+    and the DCU holds them back) and taken with :py:meth:`get`, by iterating
+    over the receiver or, for one series, with :py:meth:`series`. With
+    *callback* set, it is called with every message in the receiver thread
+    instead, which avoids the queue.
+
+    Messages which can not be parsed and messages for which the callback
+    raises an exception are counted in *errors*, the last exception is kept
+    as *last_error*; the receiver goes on with the next message.
+
+    The thread does nothing but receive, parse the small JSON parts and hand
+    the message on; image data stays in the buffers received from ZeroMQ,
+    so that the receiver keeps up with the detector's frame rate.
+
+    :param str host: host name of the DCU (or a ZeroMQ endpoint like
+                     "tcp://127.0.0.1:9999")
+    :param int port: port of the DCU's push socket
+    :param int queue_size: number of messages queued
+    :param callable callback: function called with every message
+    :param zmq.Context context: ZeroMQ context (default: the global one)
+    """
+
+    def __init__(self, host, port=STREAM_PORT, queue_size=QUEUE_SIZE,
+                 callback=None, context=None):
+        super(StreamReceiver, self).__init__()
+        if zmq is None:
+            raise ImportError("The stream receiver requires pyzmq.")
+        if "://" in host:
+            self.endpoint = host
+        else:
+            self.endpoint = "tcp://{0}:{1}".format(host, port)
+        self.callback = callback
+        #: the last series header taken from the queue
+        self.header = None
+        self.messages = 0
+        self.frames = 0
+        self.nbytes = 0
+        self.errors = 0
+        self.last_error = None
+        self._context = context or zmq.Context.instance()
+        self._queue = queue.Queue(queue_size)
+        self._stop = threading.Event()
+        self._started = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            yield self.get()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def frame_rate(self):
+        """
+        Average number of frames received per second since the start.
+        """
+        if self._started is None:
+            return 0.0
+        return self.frames / max(time.time() - self._started, 1e-9)
+
+    def start(self):
+        """
+        Connects to the DCU and starts receiving.
+        """
+        if self.running:
+            return
+        socket = self._context.socket(zmq.PULL)
+        socket.connect(self.endpoint)
+        self._stop.clear()
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, args=(socket,),
+                                        name="EigerStreamReceiver")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops receiving and closes the connection. Queued messages can still
+        be taken.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get(self, timeout=None):
+        """
+        Returns the next message.
+
+        :param float timeout: maximum time to wait in seconds
+        :raises queue.Empty: if no message arrives within *timeout*
+        """
+        message = self._queue.get(timeout=timeout)
+        if isinstance(message, SeriesHeader):
+            self.header = message
+        return message
+
+    def series(self, timeout=None):
+        """
+        Yields the frames of the next series, skipping messages of earlier
+        series, until its end message. If the header was already taken with
+        :py:meth:`get`, the frames of its series are yielded; the header is
+        available as :py:attr:`header`.
+
+        :param float timeout: maximum time to wait for each message
+        :raises queue.Empty: if no message arrives within *timeout*
+        """
+        series = None
+        while True:
+            message = self.get(timeout)
+            if isinstance(message, SeriesHeader):
+                series = message.series
+                continue
+            if series is None and self.header is not None and \
+                    message.series == self.header.series:
+                series = message.series
+            if message.series != series:
+                continue
+            if isinstance(message, Frame):
+                yield message
+            else:
+                return
+
+    def _run(self, socket):
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        timeout = int(POLL_INTERVAL * 1000)
+        try:
+            while not self._stop.is_set():
+                if not poller.poll(timeout):
+                    continue
+                parts = socket.recv_multipart(copy=False)
+                try:
+                    message = parse_message(parts)
+                except StreamError as e:
+                    self.errors += 1
+                    self.last_error = e
+                    continue
+                self.messages += 1
+                if isinstance(message, Frame):
+                    self.frames += 1
+                    self.nbytes += message.size
+                if self.callback is None:
+                    self._put(message)
+                    continue
+                try:
+                    self.callback(message)
+                except Exception as e:
+                    # the thread must survive a failing consumer
+                    self.errors += 1
+                    self.last_error = e
+        finally:
+            socket.close(linger=0)
+
+    def _put(self, message):
+        # queues a message, waiting for space unless the receiver stops
+        while not self._stop.is_set():
+            try:
+                self._queue.put(message, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+
+def save_messages(path, messages):
+    """
+    Writes multipart messages (lists of bytes) into a file, to be replayed by
+    a :py:class:`ReplayPusher`.
+    """
+    with open(path, "wb") as f:
+        for parts in messages:
+            f.write(struct.pack("<I", len(parts)))
+            for part in parts:
+                data = bytes(_buffer(part))
+                f.write(struct.pack("<Q", len(data)))
+                f.write(data)
+
+
+def load_messages(path):
+    """
+    Reads multipart messages written by :py:func:`save_messages`.
+
+    :rtype: list of lists of bytes
+    """
+    messages = []
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(4)
+            if not head:
+                return messages
+            count = struct.unpack("<I", head)[0]
+            parts = []
+            for _ in range(count):
+                length = struct.unpack("<Q", f.read(8))[0]
+                parts.append(f.read(length))
+            messages.append(parts)
+
+
+def synthetic_series(series=1, nimages=10, shape=(1030, 1065),
+                     dtype="uint32", header_detail="basic", config=None):
+    """
+    Returns the messages the stream subsystem sends for a series of
+    *nimages* uncompressed images, for tests with a :py:class:`ReplayPusher`.
+    All images share one buffer of increasing pixel values.
+
+    :param int series: series id
+    :param int nimages: number of images
+    :param tuple shape: image size (x, y)
+    :param str dtype: pixel type
+    :param str header_detail: "all", "basic" or "none"
+    :param dict config: detector configuration sent in the header
+    :rtype: list of lists of bytes
+    """
+    itemsize = {"uint8": 1, "uint16": 2, "uint32": 4}[dtype]
+    count = shape[0] * shape[1]
+    pattern = bytes(bytearray(range(256)))
+    data = (pattern * (count * itemsize // 256 + 1))[:count * itemsize]
+    digest = hashlib.md5(data).hexdigest()
+
+    def dump(value):
+        return json.dumps(value).encode("utf-8")
+
+    header = [dump({"htype": "dheader-1.0", "series": series,
+                    "header_detail": header_detail})]
+    if header_detail in ("basic", "all"):
+        header.append(dump(config or {}))
+    if header_detail == "all":
+        for htype, table_type in (("dflatfield-1.0", "float32"),
+                                  ("dpixelmask-1.0", "uint32"),
+                                  ("dcountrate_table-1.0", "float32")):
+            header.append(dump({"htype": htype, "shape": list(shape),
+                                "type": table_type}))
+            header.append(b"\0" * (count * 4))
+    messages = [header]
+    for frame in range(nimages):
+        start = frame * 10 ** 6
+        messages.append([
+            dump({"htype": "dimage-1.0", "series": series, "frame": frame,
+                  "hash": digest}),
+            dump({"htype": "dimage_d-1.0", "shape": list(shape),
+                  "type": dtype, "encoding": "<", "size": len(data)}),
+            data,
+            dump({"htype": "dconfig-1.0", "start_time": start,
+                  "stop_time": start + 5 * 10 ** 5, "real_time": 5 * 10 ** 5}),
+        ])
+    messages.append([dump({"htype": "dseries_end-1.0", "series": series})])
+    return messages
+
+
+class ReplayPusher(object):
+    """
+    Sends recorded messages from a local ZeroMQ push socket like the DCU's
+    stream subsystem, to test receivers::
+
+      with ReplayPusher(synthetic_series(nimages=1000),
+                        frame_rate=500) as pusher:
+          with StreamReceiver(pusher.endpoint) as receiver:
+              frames = list(receiver.series(timeout=5.0))
+
+    :param messages: list of multipart messages or a file written by
+                     :py:func:`save_messages`
+    :param str host: interface to bind to
+    :param int port: port to bind to (default: a free port)
+    :param float frame_rate: images sent per second (default: as fast as
+                             possible)
+    :param int repeat: number of times the messages are sent
+    :param zmq.Context context: ZeroMQ context (default: the global one)
+    """
+
+    def __init__(self, messages, host="127.0.0.1", port=0, frame_rate=None,
+                 repeat=1, context=None):
+        super(ReplayPusher, self).__init__()
+        if zmq is None:
+            raise ImportError("The replay pusher requires pyzmq.")
+        if not isinstance(messages, list):
+            messages = load_messages(messages)
+        self.messages = messages
+        self.frame_rate = frame_rate
+        self.repeat = repeat
+        self.sent = 0
+        self._socket = (context or zmq.Context.instance()).socket(zmq.PUSH)
+        if port:
+            self._socket.bind("tcp://{0}:{1}".format(host, port))
+        else:
+            port = self._socket.bind_to_random_port("tcp://{0}".format(host))
+        self.port = port
+        self.endpoint = "tcp://{0}:{1}".format(host, port)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        Starts sending in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="EigerReplayPusher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Waits until all messages are sent, returns False on timeout.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def stop(self):
+        """
+        Stops sending and closes the socket.
+        """
+        self._stop.set()
+        self.wait()
+        self._socket.close(linger=0)
+
+    def _run(self):
+        t0 = time.time()
+        frames = 0
+        for _ in range(self.repeat):
+            for parts in self.messages:
+                if self._stop.is_set():
+                    return
+                if self.frame_rate and len(parts) > 2:
+                    delay = t0 + frames / float(self.frame_rate) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    frames += 1
+                while not self._stop.is_set():
+                    # waits for a receiver like the DCU, but can be stopped
+                    if self._socket.poll(int(POLL_INTERVAL * 1000),
+                                         zmq.POLLOUT):
+                        self._socket.send_multipart(parts, copy=False)
+                        self.sent += 1
+                        break
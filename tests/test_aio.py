@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.aio` against the simulator.
+"""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from dectris_eiger.aio import AsyncEigerClient, AsyncEigerDetector
+from dectris_eiger.buffer import DeleteError, DownloadError
+from dectris_eiger.communication import (ConnectionFailed, DeadlineExceeded,
+                                         ResponseError, RetryPolicy)
+from dectris_eiger.sim import Fault, Simulator
+
+
+@pytest.fixture
+def sim():
+    with Simulator() as sim:
+        yield sim
+
+
+def run(sim, call, policy=None):
+    async def main():
+        client = AsyncEigerClient("127.0.0.1", sim.port,
+                                  policy=policy or RetryPolicy(backoff=0.01))
+        detector = AsyncEigerDetector("127.0.0.1", sim.port, sim.api_version,
+                                      client=client)
+        try:
+            return await call(detector)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def test_arm_returns_sequence_id(sim):
+    assert isinstance(run(sim, lambda det: det.arm()), int)
+
+
+def test_reads_are_retried(sim):
+    fault = Fault("error", "/count_time$", count=2)
+    sim.faults.append(fault)
+    assert run(sim, lambda det: det.get_count_time()) > 0
+    assert fault.injected == 2
+
+
+def test_failed_command_raises_response_error(sim):
+    sim.faults.append(Fault("error", "/command/arm$", status=500))
+    with pytest.raises(ResponseError) as info:
+        run(sim, lambda det: det.arm())
+    assert info.value.status_code == 500
+    # commands are not repeated once they reached the DCU
+    assert sim.stats.get("PUT") == 1
+
+
+def test_dropped_connection_raises_connection_failed(sim):
+    sim.faults.append(Fault("drop", "/count_time$"))
+    with pytest.raises(ConnectionFailed):
+        run(sim, lambda det: det.get_count_time())
+
+
+def test_slow_command_raises_deadline_exceeded(sim):
+    sim.faults.append(Fault("delay", "/command/arm$", delay=1.0))
+    with pytest.raises(DeadlineExceeded):
+        run(sim, lambda det: det.arm(timeout=0.2))
+
+
+def test_download_retries_and_reports_failed_files(sim, tmpdir):
+    for name in ("s_1_data_000001.h5", "s_1_data_000002.h5",
+                 "s_1_master.h5"):
+        sim.dcu.add_file(name, 256 * 1024)
+    retried = Fault("error", "^/data/s_1_master.h5$", count=1)
+    sim.faults.append(retried)
+    sim.faults.append(Fault("error", "^/data/s_1_data_000002.h5$"))
+    with pytest.raises(DownloadError) as info:
+        run(sim, lambda det: det.buffer.download("s_1_*", str(tmpdir)))
+    report = info.value.report
+    assert sorted(report.files) == [("s_1_data_000001.h5", 256 * 1024),
+                                    ("s_1_master.h5", 256 * 1024)]
+    assert isinstance(report.errors["s_1_data_000002.h5"], ResponseError)
+    assert retried.injected == 1
+    assert tmpdir.join("s_1_master.h5").size() == 256 * 1024
+
+
+def test_download_file_times_out_per_transfer(sim, tmpdir):
+    sim.dcu.add_file("s_1_data_000001.h5", 1024)
+    sim.faults.append(Fault("delay", "^/data/", delay=1.0))
+    with pytest.raises(DeadlineExceeded):
+        run(sim, lambda det: det.buffer.download_file(
+            "s_1_data_000001.h5", str(tmpdir), timeout=0.2))
+
+
+def test_list_files_raises_on_error_status(sim):
+    sim.faults.append(Fault("error", "/files$", status=403))
+    with pytest.raises(ResponseError):
+        run(sim, lambda det: det.buffer.list_files())
+
+
+def test_delete_all_is_bounded_and_reports_failed_files(sim):
+    for i in range(6):
+        sim.dcu.add_file("s_1_data_{0:06d}.h5".format(i + 1), 1024)
+    sim.faults.append(Fault("error", "000002.h5$", status=403,
+                            methods=("DELETE",)))
+    sim.faults.append(Fault("delay", "^/data/", delay=0.2,
+                            methods=("DELETE",)))
+
+    async def delete_all(det):
+        t0 = time.time()
+        with pytest.raises(DeleteError) as info:
+            await det.buffer.delete_all(workers=2)
+        return info.value.report, time.time() - t0
+    report, elapsed = run(sim, delete_all)
+    assert sorted(report.deleted) == ["s_1_data_{0:06d}.h5".format(i)
+                                      for i in (1, 3, 4, 5, 6)]
+    assert list(report.errors) == ["s_1_data_000002.h5"]
+    assert sorted(sim.dcu.files) == ["s_1_data_000002.h5"]
+    # five deletes of 0.2 s, two at a time
+    assert elapsed >= 0.55
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.buffer` against the simulator.
+"""
+import io
+import json
+import os
+import random
+import threading
+import time
+
+import pytest
+import requests
+
+from dectris_eiger import buffer as buffer_module
+from dectris_eiger.buffer import (BufferMirror, DataBufferError,
+                                   DeleteError, DownloadError,
+                                   EigerDataBuffer, FileIndex,
+                                   IncompleteSeriesError, Manifest,
+                                   UnknownDataFileError, file_digest)
+from dectris_eiger.communication import EigerClient, ResponseError
+from dectris_eiger.sim import Fault, Simulator
+
+
+@pytest.fixture
+def sim():
+    with Simulator() as sim:
+        yield sim
+
+
+@pytest.fixture
+def buffer(sim):
+    client = EigerClient("127.0.0.1", sim.port)
+    yield EigerDataBuffer("127.0.0.1", sim.port, sim.api_version,
+                          client=client)
+    client.close()
+
+
+def test_mirror_keeps_files_while_writer_state_unknown(sim, buffer, tmpdir):
+    sim.dcu.state["filewriter"] = "acquire"
+    sim.dcu.add_file("s_1_data_000001.h5", 1024)
+    sim.faults.append(Fault("error", "^/filewriter/api/.*/status/state$",
+                            status=500))
+    mirror = BufferMirror(buffer, str(tmpdir), interval=0.05)
+    mirror.start()
+    try:
+        time.sleep(0.5)
+        assert mirror.status()["filewriter_state"] is None
+        assert "s_1_data_000001.h5" in sim.dcu.files
+        assert not os.path.exists(str(tmpdir.join("s_1_data_000001.h5")))
+        # once the file writer is known to be idle, the file is closed
+        del sim.faults[:]
+        sim.dcu.state["filewriter"] = "ready"
+        assert mirror.wait_idle(timeout=5.0)
+    finally:
+        mirror.stop()
+    assert "s_1_data_000001.h5" not in sim.dcu.files
+    assert tmpdir.join("s_1_data_000001.h5").size() == 1024
+
+
+def test_drain_keeps_master_of_incomplete_series(sim, buffer, tmpdir):
+    for name in ("s_1_data_000001.h5", "s_1_data_000002.h5",
+                 "s_1_master.h5", "s_2_data_000001.h5", "s_2_master.h5"):
+        sim.dcu.add_file(name, 4096)
+    sim.faults.append(Fault("error", "^/data/s_1_data_000002.h5$",
+                            status=500))
+    with pytest.raises(DownloadError) as info:
+        buffer.drain("s_*", str(tmpdir), workers=2)
+    errors = info.value.report.errors
+    assert sorted(errors) == ["s_1_data_000002.h5", "s_1_master.h5"]
+    assert isinstance(errors["s_1_master.h5"], IncompleteSeriesError)
+    assert sorted(sim.dcu.files) == ["s_1_data_000002.h5", "s_1_master.h5"]
+    assert not tmpdir.join("s_1_master.h5").exists()
+    assert tmpdir.join("s_2_master.h5").size() == 4096
+
+
+@pytest.mark.parametrize("kind", ["reset", "truncate"])
+def test_segments_retried_after_broken_body(sim, buffer, tmpdir, kind):
+    sim.dcu.add_file("s_1_data_000001.h5", 3 * 1024 ** 2)
+    fault = Fault(kind, "^/data/", count=1, methods=("GET",))
+    sim.faults.append(fault)
+    buffer.download_file("s_1_data_000001.h5", str(tmpdir), segments=4)
+    assert fault.injected == 1
+    assert tmpdir.join("s_1_data_000001.h5").size() == 3 * 1024 ** 2
+
+
+@pytest.mark.parametrize("kind", ["reset", "truncate"])
+def test_master_retried_after_broken_body(sim, buffer, tmpdir, kind):
+    sim.dcu.add_file("s_1_master.h5", 3 * 1024 ** 2)
+    fault = Fault(kind, "^/data/", count=1, methods=("GET",))
+    sim.faults.append(fault)
+    buffer.download("s_1_master.h5", str(tmpdir))
+    assert fault.injected == 1
+    assert tmpdir.join("s_1_master.h5").size() == 3 * 1024 ** 2
+
+
+def test_reset_body_raises_request_exception(sim, buffer, tmpdir):
+    sim.dcu.add_file("s_1_data_000001.h5", 3 * 1024 ** 2)
+    sim.faults.append(Fault("reset", "^/data/", methods=("GET",)))
+    with pytest.raises(requests.RequestException):
+        buffer.download_file("s_1_data_000001.h5", str(tmpdir))
+
+
+@pytest.mark.parametrize("readinto", [True, False])
+def test_download_with_and_without_readinto(sim, buffer, tmpdir, monkeypatch,
+                                            readinto):
+    if not readinto:
+        # as with urllib3 before 1.26
+        monkeypatch.setattr(buffer_module, "_body_reader",
+                            lambda response: None)
+    sim.dcu.add_file("s_1_data_000001.h5", 3 * 1024 ** 2)
+    fault = Fault("truncate", "^/data/", count=1, methods=("GET",))
+    sim.faults.append(fault)
+    buffer.download_file("s_1_data_000001.h5", str(tmpdir), segments=2)
+    assert fault.injected == 1
+    assert tmpdir.join("s_1_data_000001.h5").read_binary() == \
+        buffer.get_file("s_1_data_000001.h5")
+
+
+def test_synthetic_files_are_hdf5(sim, buffer, tmpdir):
+    h5py = pytest.importorskip("h5py")
+    name = "s_1_data_000001.h5"
+    f = sim.dcu.add_file(name, 3 * 1024 ** 2, {"series": 1})
+    assert f.size == 3 * 1024 ** 2
+    buffer.download_file(name, str(tmpdir), segments=4)
+    path = str(tmpdir.join(name))
+    with h5py.File(path, "r") as h5:
+        assert json.loads(h5.attrs["description"]) == \
+            {"series": 1, "name": name}
+        data = h5["data"]
+        offset = data.id.get_offset()
+        assert data[:len(f.pattern)].tobytes() == f.pattern
+        assert data[-100:].tobytes() == f.read(offset + data.size - 100,
+                                                offset + data.size)
+    # and they can be read remotely
+    with buffer.open_file(name) as remote:
+        with h5py.File(remote, "r") as h5:
+            assert h5["data"][12345] == f.read(offset + 12345)[0]
+
+
+@pytest.mark.parametrize("segments", [1, 4])
+def test_drain_keeps_file_whose_copy_does_not_match(sim, buffer, tmpdir,
+                                                    monkeypatch, segments):
+    sim.dcu.add_file("s_1_data_000001.h5", 9 * 1024 ** 2)
+    sim.dcu.add_file("s_1_data_000002.h5", 1024)
+    fsync_file = buffer_module.fsync_file
+
+    def corrupt(path, drop_cache=False):
+        # a byte of the first copy is lost on its way to the disk
+        if path.endswith("000001.h5"):
+            with open(path, "r+b") as f:
+                f.seek(100)
+                byte = bytearray(f.read(1))
+                byte[0] ^= 0xff
+                f.seek(100)
+                f.write(byte)
+        fsync_file(path, drop_cache)
+    monkeypatch.setattr(buffer_module, "fsync_file", corrupt)
+    with pytest.raises(DownloadError) as info:
+        buffer.drain("s_1_*", str(tmpdir), segments=segments,
+                     verify="sha256")
+    error = info.value.report.errors["s_1_data_000001.h5"]
+    assert isinstance(error, DataBufferError)
+    assert "checksum mismatch" in str(error)
+    assert sorted(sim.dcu.files) == ["s_1_data_000001.h5"]
+    manifest = Manifest(str(tmpdir), "sha256")
+    assert "s_1_data_000001.h5" not in manifest.load(
+        manifest.path("s_1_data_000001.h5")).get("files", {})
+
+
+def test_drain_verifies_checksum_before_delete(sim, buffer, tmpdir):
+    sim.dcu.add_file("s_1_data_000001.h5", 1024)
+    report = buffer.drain("s_1_*", str(tmpdir), verify="crc32")
+    assert report.deleted == ["s_1_data_000001.h5"]
+    assert not sim.dcu.files
+
+
+def set_files(sim, names):
+    # replaces the buffer's listing by *names* in this order
+    sim.dcu.clear_files()
+    for name in names:
+        sim.dcu.add_file(name, 1024)
+
+
+@pytest.fixture
+def index(sim, buffer, monkeypatch):
+    # the buffer's index, counting the refreshes parsed incrementally
+    index = buffer.index
+    index.diffs = []
+    diff = index._diff
+
+    def spy(raw):
+        result = diff(raw)
+        index.diffs.append(result is not None)
+        return result
+    monkeypatch.setattr(index, "_diff", spy)
+    return index
+
+
+BASE = ["s_1_data_{0:06d}.h5".format(i) for i in range(1, 6)]
+
+
+@pytest.mark.parametrize("names", [
+    BASE + ["s_1_data_000006.h5"],
+    BASE + ["s_1_data_000006.h5", "s_1_master.h5"],
+    BASE[1:],
+    BASE[:2] + BASE[3:],
+    BASE[:-1],
+    BASE[:2] + ["s_0_master.h5"] + BASE[2:],
+    BASE[:2] + ["s_1_data_000003x.h5"] + BASE[3:],
+    ["s_2_data_000001.h5"] + BASE,
+])
+def test_index_parses_changes_incrementally(sim, index, names):
+    set_files(sim, BASE)
+    index.refresh()
+    set_files(sim, names)
+    added, removed = index.refresh()
+    assert index.names == tuple(names)
+    assert set(added) == set(names) - set(BASE)
+    assert set(removed) == set(BASE) - set(names)
+    # the first listing is always parsed in full
+    assert index.diffs == [False, True]
+    assert index.changes(index.version - 1) == (sorted(added),
+                                                 sorted(removed))
+
+
+@pytest.mark.parametrize("special", [
+    "s_1_data,000003.h5", 's_1_"data"_000003.h5', "s_1_data\\000003.h5",
+    u"s_1_daten_\u00e4_000003.h5",
+])
+def test_index_parses_special_names_in_full(sim, index, special):
+    set_files(sim, BASE)
+    index.refresh()
+    names = BASE[:2] + [special] + BASE[3:]
+    set_files(sim, names)
+    assert index.refresh() == ((special,), (BASE[2],))
+    assert index.names == tuple(names)
+    assert special in index
+    # neither listing can be diffed by commas
+    set_files(sim, BASE)
+    assert index.refresh() == ((BASE[2],), (special,))
+    assert index.names == tuple(BASE)
+    assert index.diffs == [False, False, False]
+
+
+def test_index_follows_random_changes(sim, index):
+    rng = random.Random(1)
+    alphabet = "abc_.0123" * 10 + ',"\\'
+    names = []
+    for _ in range(200):
+        op = rng.random()
+        if names and op < 0.3:
+            del names[rng.randrange(len(names))]
+        else:
+            name = "".join(rng.choice(alphabet) for _ in range(
+                rng.randint(1, 12)))
+            if name not in names:
+                names.insert(rng.randint(0, len(names)), name)
+        before = set(index.names)
+        set_files(sim, names)
+        added, removed = index.refresh()
+        assert index.names == tuple(names)
+        assert set(added) == set(names) - before
+        assert set(removed) == before - set(names)
+    assert any(index.diffs)
+
+
+def test_index_uses_conditional_requests(tmpdir):
+    with Simulator(list_etags=True) as sim:
+        client = EigerClient("127.0.0.1", sim.port)
+        try:
+            index = FileIndex(client, sim.api_version)
+            set_files(sim, BASE)
+            assert index.refresh() == (tuple(BASE), ())
+            version, sent = index.version, sim.stats["bytes_sent"]
+            assert index.refresh() == ((), ())
+            # answered with 304 Not Modified, without a body
+            assert sim.stats["GET"] == 2
+            assert sim.stats["bytes_sent"] == sent
+            assert index.version == version
+            sim.dcu.add_file("s_1_master.h5", 1024)
+            assert index.refresh() == (("s_1_master.h5",), ())
+            assert index.version == version + 1
+        finally:
+            client.close()
+
+
+@pytest.fixture
+def remote(sim, buffer):
+    # a file of 20 blocks, of which 4 are cached
+    f = sim.dcu.add_file("s_1_data_000001.h5", 20 * 4096 + 100)
+    with buffer.open_file(f.name, block_size=4096, cache_blocks=4) as remote:
+        yield f, remote
+
+
+def test_remote_file_reads_into_buffers(sim, remote):
+    f, remote = remote
+    assert remote.size == f.size
+    buf = bytearray(5000)
+    remote.seek(3000)
+    assert remote.readinto(buf) == 5000
+    assert bytes(buf) == f.read(3000, 8000)
+    assert remote.tell() == 8000
+    # the blocks read are cached
+    gets = sim.stats["GET"]
+    remote.seek(4096)
+    assert remote.read(100) == f.read(4096, 4196)
+    assert sim.stats["GET"] == gets
+    # reads larger than the cache go directly into the buffer
+    view = memoryview(bytearray(6 * 4096))
+    remote.seek(1)
+    assert remote.readinto(view) == len(view)
+    assert view.tobytes() == f.read(1, 1 + len(view))
+    assert sim.stats["GET"] == gets + 1
+
+
+def test_remote_file_seeks(remote):
+    f, remote = remote
+    assert remote.seekable() and remote.readable()
+    assert remote.seek(-10, io.SEEK_END) == f.size - 10
+    assert remote.read(4) == f.read(f.size - 10, f.size - 6)
+    assert remote.seek(-4, io.SEEK_CUR) == f.size - 10
+    assert remote.seek(10) == 10 and remote.tell() == 10
+    with pytest.raises(ValueError):
+        remote.seek(-1)
+    with pytest.raises(ValueError):
+        remote.seek(0, 3)
+
+
+def test_remote_file_reads_stop_at_end(remote):
+    f, remote = remote
+    remote.seek(f.size - 10)
+    assert remote.read(100) == f.read(f.size - 10)
+    assert remote.tell() == f.size
+    assert remote.read(100) == b""
+    assert remote.readinto(bytearray(10)) == 0
+    remote.seek(f.size + 100)
+    assert remote.read() == b""
+    remote.seek(0)
+    assert remote.read() == f.read()
+
+
+def test_remote_file_requires_ranges(tmpdir):
+    with Simulator(ranges=False) as sim:
+        client = EigerClient("127.0.0.1", sim.port)
+        try:
+            sim.dcu.add_file("s_1_data_000001.h5", 8192)
+            buffer = EigerDataBuffer("127.0.0.1", sim.port, sim.api_version,
+                                     client=client)
+            with buffer.open_file("s_1_data_000001.h5") as remote:
+                with pytest.raises(DataBufferError) as info:
+                    remote.read(100)
+            assert "ranges not supported" in str(info.value)
+            with pytest.raises(UnknownDataFileError):
+                buffer.open_file("s_1_data_000002.h5")
+        finally:
+            client.close()
+
+
+def test_remote_file_detects_changed_file(sim, remote):
+    f, remote = remote
+    remote.read(100)
+    time.sleep(0.01)
+    sim.dcu.add_file(f.name, f.size)
+    with pytest.raises(DataBufferError):
+        remote.read(20 * 4096)
+
+
+def test_download_writes_manifest(sim, buffer, tmpdir):
+    names = ["s_1_data_000001.h5", "s_1_data_000002.h5", "s_1_master.h5"]
+    for name in names:
+        sim.dcu.add_file(name, 40000)
+    buffer.download("s_1_*", str(tmpdir), workers=2, checksum="sha256")
+    manifest = Manifest(str(tmpdir), "sha256")
+    path = manifest.path("s_1_master.h5")
+    assert path == str(tmpdir.join("s_1_manifest.json"))
+    content = Manifest.load(path)
+    assert content["algorithm"] == "sha256"
+    assert sorted(content["files"]) == names
+    for name in names:
+        fn = str(tmpdir.join(name))
+        assert content["files"][name] == {
+            "size": 40000, "checksum": file_digest(fn, "sha256")}
+    assert Manifest.verify(path) == {}
+
+
+def test_manifest_verify_reports_mismatches(tmpdir):
+    manifest = Manifest(str(tmpdir), "md5")
+    for i, content in enumerate([b"a" * 100, b"b" * 100, b"c" * 100]):
+        name = "s_1_data_{0:06d}.h5".format(i + 1)
+        tmpdir.join(name).write_binary(content)
+        manifest.add(name, 100, file_digest(str(tmpdir.join(name)), "md5"))
+    manifest.save()
+    path = manifest.path("s_1_master.h5")
+    assert Manifest.verify(path) == {}
+    tmpdir.join("s_1_data_000001.h5").write_binary(b"x" + b"a" * 99)
+    tmpdir.join("s_1_data_000002.h5").write_binary(b"b" * 99)
+    tmpdir.join("s_1_data_000003.h5").remove()
+    assert Manifest.verify(path) == {
+        "s_1_data_000001.h5": "checksum mismatch",
+        "s_1_data_000002.h5": "size mismatch",
+        "s_1_data_000003.h5": "missing"}
+
+
+def test_manifest_save_merges_entries(tmpdir):
+    manifest = Manifest(str(tmpdir), "md5")
+    manifest.add("s_1_data_000001.h5", 1, "01")
+    manifest.add("notes.txt", 2, "02")
+    manifest.save()
+    # a new instance, as after a restart, adds to the same manifest
+    reloaded = Manifest(str(tmpdir), "md5")
+    reloaded.add("s_1_data_000002.h5", 3, "03")
+    reloaded.save()
+    files = Manifest.load(str(tmpdir.join("s_1_manifest.json")))["files"]
+    assert sorted(files) == ["s_1_data_000001.h5", "s_1_data_000002.h5"]
+    assert Manifest.load(str(tmpdir.join("files_manifest.json")))[
+        "files"] == {"notes.txt": {"size": 2, "checksum": "02"}}
+    # checksums of another algorithm are not mixed with these
+    other = Manifest(str(tmpdir), "sha256")
+    other.add("s_1_data_000003.h5", 4, "04")
+    other.save()
+    content = Manifest.load(str(tmpdir.join("s_1_manifest.json")))
+    assert content == {"algorithm": "sha256", "files": {
+        "s_1_data_000003.h5": {"size": 4, "checksum": "04"}}}
+    assert Manifest.load(str(tmpdir.join("s_2_manifest.json"))) == {}
+    with pytest.raises(ValueError):
+        Manifest(str(tmpdir), "unknown")
+
+
+def test_failed_delete_does_not_stop_the_others(sim, buffer):
+    names = ["s_1_data_{0:06d}.h5".format(i) for i in range(1, 7)]
+    for name in names + ["s_1_master.h5"]:
+        sim.dcu.add_file(name, 1024)
+    sim.faults.append(Fault("error", "^/data/s_1_data_000003.h5$",
+                            status=403, methods=("DELETE",)))
+    deleted = []
+    with pytest.raises(DeleteError) as info:
+        buffer.delete("s_1_*", workers=3,
+                      callback=lambda name, found: deleted.append(name))
+    report = info.value.report
+    assert list(report.errors) == ["s_1_data_000003.h5"]
+    assert isinstance(report.errors["s_1_data_000003.h5"], ResponseError)
+    assert sorted(report.deleted) == sorted(deleted) == \
+        sorted(set(names + ["s_1_master.h5"]) - {"s_1_data_000003.h5"})
+    # master files go last
+    assert deleted[-1] == "s_1_master.h5"
+    assert list(sim.dcu.files) == ["s_1_data_000003.h5"]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_deletes_respect_the_concurrency_bound(sim, buffer, monkeypatch,
+                                               workers):
+    for i in range(1, 10):
+        sim.dcu.add_file("s_1_data_{0:06d}.h5".format(i), 1024)
+    delete_file = sim.dcu.delete_file
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def slow_delete(name):
+        # counts the deletes running at the same time
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return delete_file(name)
+    monkeypatch.setattr(sim.dcu, "delete_file", slow_delete)
+    report = buffer.delete_all(workers=workers)
+    assert len(report.deleted) == 9 and not sim.dcu.files
+    assert active[1] == workers
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.communication` against the simulator.
+"""
+import threading
+import time
+
+import pytest
+
+from dectris_eiger.communication import (CircuitBreaker, CircuitOpenError,
+                                         DeadlineExceeded, EigerClient,
+                                         ResponseError, RetryPolicy)
+from dectris_eiger.sim import Fault, Simulator
+
+
+@pytest.fixture
+def sim():
+    with Simulator() as sim:
+        yield sim
+
+
+def test_failing_transfers_do_not_open_control_circuit(sim):
+    client = EigerClient("127.0.0.1", sim.port,
+                         policy=RetryPolicy(retries=0),
+                         data_breaker=CircuitBreaker(threshold=2))
+    sim.dcu.add_file("s_1_data_000001.h5", 1024)
+    sim.faults.append(Fault("error", "^/data/", status=500))
+    url = client.data_url("s_1_data_000001.h5")
+    try:
+        for _ in range(2):
+            with pytest.raises(ResponseError):
+                client.request("GET", url)
+        assert client.data_breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            client.request("GET", url)
+        assert client.breaker.state == "closed"
+        assert client.get_value(sim.api_version, "detector", "status",
+                                "state", fresh=True)
+    finally:
+        client.close()
+
+
+@pytest.fixture
+def cached(sim):
+    client = EigerClient("127.0.0.1", sim.port,
+                         cache_ttl={"config": 0.3})
+    yield client
+    client.close()
+
+
+def read(client, sim, key, timeout=2.0):
+    return client.get_value(sim.api_version, "detector", "config", key,
+                            timeout=timeout)
+
+
+def test_config_reads_are_not_cached_by_default(sim):
+    client = EigerClient("127.0.0.1", sim.port)
+    try:
+        read(client, sim, "nimages")
+        sim.dcu.config["detector"]["nimages"] = 7
+        assert read(client, sim, "nimages") == 7
+        assert client.cache.hits == 0
+    finally:
+        client.close()
+
+
+def test_cache_hit_miss_and_expiry(sim, cached):
+    assert read(cached, sim, "nimages") == 1
+    sim.dcu.config["detector"]["nimages"] = 7
+    assert read(cached, sim, "nimages") == 1
+    assert (cached.cache.hits, cached.cache.misses) == (1, 1)
+    time.sleep(0.35)
+    assert read(cached, sim, "nimages") == 7
+    assert (cached.cache.hits, cached.cache.misses) == (1, 2)
+
+
+def test_write_invalidates_written_and_dependent_keys(sim, cached):
+    for key in ("frame_time", "count_time", "nimages"):
+        read(cached, sim, key)
+    gets = sim.stats["GET"]
+    # the count time stays within the longer frame time, so the DCU does not
+    # report it changed; it is dropped as it depends on the frame time
+    cached.set_value(sim.api_version, "detector", "config", "frame_time",
+                     0.5)
+    assert read(cached, sim, "frame_time") == 0.5
+    read(cached, sim, "count_time")
+    read(cached, sim, "nimages")
+    assert sim.stats["GET"] == gets + 2
+    assert cached.cache.hits == 1
+
+
+def test_write_invalidates_keys_reported_changed(sim, cached):
+    read(cached, sim, "threshold_energy")
+    read(cached, sim, "nimages")
+    cached.set_value(sim.api_version, "detector", "config", "photon_energy",
+                     10000.0)
+    assert read(cached, sim, "threshold_energy") == 5000.0
+    read(cached, sim, "nimages")
+    assert cached.cache.hits == 1
+
+
+def test_timeouts_of_a_hung_dcu_open_the_circuit(sim):
+    client = EigerClient("127.0.0.1", sim.port,
+                         policy=RetryPolicy(retries=0),
+                         breaker=CircuitBreaker(threshold=2))
+    sim.faults.append(Fault("delay", "/count_time$", delay=0.5))
+    try:
+        for _ in range(2):
+            with pytest.raises(DeadlineExceeded) as info:
+                read(client, sim, "count_time", timeout=0.1)
+            assert info.value.reached
+        assert client.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            read(client, sim, "nimages")
+    finally:
+        client.close()
+
+
+def test_concurrent_reads_share_one_request(sim):
+    client = EigerClient("127.0.0.1", sim.port)
+    readers = 8
+    barrier = threading.Barrier(readers)
+    results = []
+    sim.faults.append(Fault("delay", "/nimages$", delay=0.5, count=1))
+
+    def reader():
+        barrier.wait()
+        results.append(client.get_value(sim.api_version, "detector",
+                                        "config", "nimages", fresh=True))
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    gets = sim.stats.get("GET", 0)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5.0)
+        assert results == [1] * readers
+        assert sim.stats["GET"] == gets + 1
+        assert client.coalesced == readers - 1
+    finally:
+        client.close()
+
+
+def test_write_detaches_reads_in_flight(sim, monkeypatch):
+    client = EigerClient("127.0.0.1", sim.port, cache_ttl={"config": 60.0})
+    started = threading.Event()
+    get = sim.dcu.get
+    slow = []
+
+    def slow_get(subsystem, section, key):
+        # the first read sees the value before the write but answers late
+        data = get(subsystem, section, key)
+        if key == "nimages" and not slow:
+            slow.append(data)
+            started.set()
+            time.sleep(0.5)
+        return data
+    monkeypatch.setattr(sim.dcu, "get", slow_get)
+
+    stale = []
+    thread = threading.Thread(target=lambda: stale.append(
+        read(client, sim, "nimages")))
+    try:
+        thread.start()
+        assert started.wait(5.0)
+        client.set_value(sim.api_version, "detector", "config", "nimages", 5)
+        # later readers neither join the old request nor see its result
+        assert read(client, sim, "nimages") == 5
+        thread.join(5.0)
+        assert stale == [1]
+        assert read(client, sim, "nimages") == 5
+        assert client.coalesced == 0
+    finally:
+        client.close()
+
+
+def test_set_many_reports_failed_writes_and_keeps_the_others(sim):
+    client = EigerClient("127.0.0.1", sim.port, cache_ttl={"config": 60.0})
+    sim.faults.append(Fault("error", "/config/nimages$", status=400,
+                            methods=("PUT",)))
+    try:
+        for key in ("nimages", "ntrigger", "frame_time", "count_time"):
+            read(client, sim, key)
+        result = client.set_many(sim.api_version, {
+            "nimages": 5, "ntrigger": 3, "frame_time": 0.5})
+        assert sorted(result.errors) == ["nimages"]
+        assert isinstance(result.errors["nimages"], ResponseError)
+        assert result == {"ntrigger": 3, "frame_time": 0.5}
+        assert sim.dcu.config["detector"]["ntrigger"] == 3
+        # the successful writes invalidated their own and dependent keys,
+        # the failed one its own as the DCU may have applied it anyway
+        gets = sim.stats["GET"]
+        assert read(client, sim, "ntrigger") == 3
+        assert read(client, sim, "frame_time") == 0.5
+        read(client, sim, "count_time")
+        assert read(client, sim, "nimages") == 1
+        assert sim.stats["GET"] == gets + 4
+    finally:
+        client.close()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.decode`.
+"""
+import queue
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from dectris_eiger.decode import DecodedFrame, DecodePool
+from dectris_eiger.stream import (Frame, SeriesEnd, SeriesHeader, StreamError,
+                                  parse_message, synthetic_series)
+
+SHAPE = (64, 48)
+
+
+@pytest.fixture
+def pool():
+    with DecodePool(SHAPE, "uint32", workers=2, depth=4) as pool:
+        yield pool
+
+
+def frame(n, shape=SHAPE):
+    # an uncompressed frame whose pixels are all n
+    image = numpy.full((shape[1], shape[0]), n, "uint32")
+    return Frame(1, n, shape, "uint32", "<", image.tobytes())
+
+
+def test_messages_are_returned_in_submission_order():
+    messages = [parse_message(parts)
+                for parts in synthetic_series(nimages=6, shape=SHAPE)]
+    expected = messages[1].decode()
+    results = []
+    with DecodePool(SHAPE, "uint32", workers=3, depth=8) as pool:
+        for message in messages:
+            pool.submit(message)
+        for _ in messages:
+            result = pool.get(timeout=5.0)
+            if isinstance(result, DecodedFrame):
+                with result:
+                    assert (result.image == expected).all()
+                    result = result.frame
+            results.append(result)
+        assert pool.frames == 6 and pool.in_flight == 0
+    assert isinstance(results[0], SeriesHeader)
+    assert isinstance(results[-1], SeriesEnd)
+    assert [r.frame for r in results[1:-1]] == list(range(6))
+
+
+def test_submit_blocks_until_a_slot_is_released(pool):
+    for n in range(pool.depth):
+        pool.submit(frame(n))
+    with pytest.raises(queue.Full):
+        pool.submit(frame(pool.depth), timeout=0.2)
+    first = pool.get(timeout=5.0)
+    assert first.image[0, 0] == 0
+    first.release()
+    pool.submit(frame(pool.depth), timeout=0.2)
+    for n in range(1, pool.depth + 1):
+        with pool.get(timeout=5.0) as result:
+            assert result.image[0, 0] == n
+
+
+def test_undecodable_frames_raise_stream_error(pool):
+    corrupt = Frame(1, 0, SHAPE, "uint32", "lz4<", b"\xff" * 100)
+    oversized = frame(1, shape=(SHAPE[0] * 2, SHAPE[1]))
+    for message in (corrupt, oversized, frame(2)):
+        pool.submit(message)
+    for _ in range(2):
+        with pytest.raises(StreamError):
+            pool.get(timeout=5.0)
+    with pool.get(timeout=5.0) as result:
+        assert result.frame.frame == 2
+    assert pool.errors == 2
+    # the slots of the failed frames were handed back
+    assert pool.in_flight == 0
+
+
+def test_close_with_unreleased_frames():
+    pool = DecodePool(SHAPE, "uint32", workers=1, depth=2)
+    pool.start()
+    pool.submit(frame(7))
+    result = pool.get(timeout=5.0)
+    assert result.image[0, 0] == 7
+    pool.close()
+    assert pool._memory is None
+    assert not pool._processes
+
+
+def test_get_raises_when_a_worker_died(pool):
+    pool._processes[0].terminate()
+    pool._processes[0].join()
+    with pytest.raises(RuntimeError):
+        pool.get(timeout=5.0)
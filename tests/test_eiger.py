@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.eiger` against the simulator.
+"""
+import threading
+import time
+
+import pytest
+
+from dectris_eiger.communication import EigerClient
+from dectris_eiger.eiger import EigerDetector
+from dectris_eiger.sim import Simulator
+
+
+@pytest.fixture
+def sim():
+    with Simulator() as sim:
+        yield sim
+
+
+@pytest.fixture
+def detector(sim):
+    client = EigerClient("127.0.0.1", sim.port)
+    yield EigerDetector("127.0.0.1", sim.port, sim.api_version,
+                        client=client)
+    client.close()
+
+
+def test_late_wait_for_state_predicts_rest_of_series(sim, detector):
+    detector.set_many({"nimages": 10, "frame_time": 0.15,
+                       "count_time": 0.1, "filewriter/mode": "disabled"})
+    detector.arm()
+    ended = []
+
+    def trigger():
+        detector.trigger()
+        ended.append(time.time())
+    thread = threading.Thread(target=trigger)
+    thread.start()
+    time.sleep(1.0)
+    assert detector.get_state() == "acquire"
+    detector.wait_for_state(("ready", "idle"), timeout=10.0)
+    returned = time.time()
+    thread.join()
+    # the series ends 0.5 s after the wait started, waiting through the
+    # full 1.5 s series duration would return a second late
+    assert returned - ended[0] < 0.3
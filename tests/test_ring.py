@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.ring`.
+"""
+import multiprocessing
+import pickle
+import queue
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from dectris_eiger.ring import (BLOCK, OVERWRITE, FrameLost, FrameRing,
+                                image_dtype)
+
+SHAPE = (32, 24)
+
+
+def image(n):
+    return numpy.full((SHAPE[1], SHAPE[0]), n, "uint16")
+
+
+@pytest.fixture
+def ring():
+    with FrameRing(3, SHAPE, "uint16") as ring:
+        yield ring
+
+
+@pytest.fixture
+def overwriting():
+    with FrameRing(3, SHAPE, "uint16", policy=OVERWRITE) as ring:
+        yield ring
+
+
+def test_frames_are_read_in_place(ring):
+    seq = ring.claim()
+    ring.image(seq)[...] = image(5)
+    ring.publish(seq)
+    assert (ring.get(seq, timeout=1.0) == 5).all()
+    assert ring.release(seq)
+    assert not ring.release(seq)
+
+
+def test_block_policy_waits_for_release(ring):
+    for n in range(3):
+        ring.put(image(n))
+    with pytest.raises(queue.Full):
+        ring.claim(timeout=0.1)
+    assert ring.release(0)
+    seq = ring.put(image(3), timeout=0.1)
+    assert seq == 3
+    assert (ring.get(3) == 3).all()
+    stats = ring.stats()
+    assert (stats["waits"], stats["overwritten"]) == (1, 0)
+    assert stats["policy"] == BLOCK
+
+
+def test_overwrite_policy_drops_oldest_frame(overwriting):
+    for n in range(4):
+        overwriting.put(image(n), timeout=0.1)
+    with pytest.raises(FrameLost):
+        overwriting.get(0)
+    assert not overwriting.valid(0)
+    assert overwriting.valid(1)
+    assert (overwriting.get(3) == 3).all()
+    assert not overwriting.release(0)
+    assert overwriting.oldest() == 1
+    assert overwriting.stats()["overwritten"] == 1
+
+
+def test_get_times_out_for_unpublished_frames(ring):
+    with pytest.raises(queue.Empty):
+        ring.get(0, timeout=0.1)
+    seq = ring.claim()
+    with pytest.raises(queue.Empty):
+        ring.get(seq, timeout=0.1)
+
+
+def test_frames_skip_lost_frames(overwriting):
+    for n in range(5):
+        overwriting.put(image(n))
+    frames = overwriting.frames(start=0, timeout=0.1)
+    seqs = []
+    for seq, data in frames:
+        assert (data == seq).all()
+        seqs.append(seq)
+        overwriting.release(seq)
+        if seq == 4:
+            break
+    assert seqs == [2, 3, 4]
+
+
+def test_frame_is_freed_by_the_last_consumer():
+    with FrameRing(2, SHAPE, "uint16", consumers=2) as ring:
+        seq = ring.put(image(1))
+        assert ring.release(seq)
+        assert ring.stats()["used"] == 1
+        assert ring.valid(seq)
+        assert ring.release(seq)
+        assert ring.stats()["used"] == 0
+        assert not ring.valid(seq)
+        assert not ring.release(seq)
+
+
+def test_stats_report_occupancy(ring):
+    for n in range(2):
+        ring.put(image(n))
+    ring.release(0)
+    stats = ring.stats()
+    assert (stats["claimed"], stats["published"], stats["released"]) == \
+        (2, 2, 1)
+    assert (stats["used"], stats["high_water"], stats["slots"]) == (1, 2, 3)
+    assert stats["occupancy"] == pytest.approx(1 / 3.0)
+
+
+def produce(ring, count):
+    for n in range(count):
+        ring.put(image(n), timeout=5.0)
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_ring_is_shared_with_other_processes(method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip("{0} is not available".format(method))
+    # spawned processes get the ring pickled
+    context = multiprocessing.get_context(method)
+    with FrameRing(3, SHAPE, "uint16", context=context) as ring:
+        process = context.Process(target=produce, args=(ring, 6))
+        process.start()
+        try:
+            for n in range(6):
+                assert (ring.get(n, timeout=10.0) == n).all()
+                ring.release(n)
+        finally:
+            process.join(10.0)
+        assert process.exitcode == 0
+        assert ring.stats()["published"] == 6
+
+
+def test_pickled_ring_attaches_to_the_same_memory(ring):
+    seq = ring.put(image(9))
+    # the lock can only be inherited, so the state is pickled while the
+    # ring is passed to a new process
+    state = ring.__getstate__()
+    other = FrameRing.__new__(FrameRing)
+    other.__setstate__(state)
+    try:
+        assert (other.get(seq) == 9).all()
+        assert other.release(seq)
+        assert ring.stats()["released"] == 1
+    finally:
+        other.close()
+    assert (ring.image(seq) == 9).all()
+    with pytest.raises(RuntimeError):
+        pickle.dumps(ring)
+
+
+def test_image_dtype():
+    assert [image_dtype(bits) for bits in (8, 12, 16, 32)] == \
+        ["uint8", "uint16", "uint16", "uint32"]
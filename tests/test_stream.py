@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`dectris_eiger.stream` with a local replay of recorded
+messages.
+"""
+import struct
+import threading
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from dectris_eiger.stream import (Frame, ReplayPusher, SeriesEnd,
+                                  SeriesHeader, StreamError, StreamReceiver,
+                                  decode_image, load_messages, parse_message,
+                                  save_messages, synthetic_series)
+
+SHAPE = (64, 48)
+
+
+@pytest.fixture
+def zmq():
+    # the receiver and the pusher require pyzmq
+    return pytest.importorskip("zmq")
+
+
+def replay(messages, **kwargs):
+    # the messages as received through a ReplayPusher
+    with ReplayPusher(messages) as pusher:
+        with StreamReceiver(pusher.endpoint, **kwargs) as receiver:
+            header = receiver.get(timeout=5.0)
+            frames = list(receiver.series(timeout=5.0))
+            return receiver, header, frames
+
+
+def test_replay_delivers_header_frames_and_end(zmq):
+    config = {"count_time": 0.1, "nimages": 5}
+    receiver, header, frames = replay(synthetic_series(
+        series=3, nimages=5, shape=SHAPE, config=config))
+    assert isinstance(header, SeriesHeader)
+    assert (header.series, header.detail) == (3, "basic")
+    assert header.config == config
+    assert receiver.header is header
+    assert [frame.frame for frame in frames] == list(range(5))
+    assert all(frame.verify() for frame in frames)
+    assert (receiver.messages, receiver.frames, receiver.errors) == (7, 5, 0)
+    assert frames[0].decode().shape == (SHAPE[1], SHAPE[0])
+
+
+def test_replay_ends_series_with_end_message(zmq):
+    messages = synthetic_series(series=1, nimages=2, shape=SHAPE) + \
+        synthetic_series(series=2, nimages=1, shape=SHAPE)
+    with ReplayPusher(messages) as pusher:
+        with StreamReceiver(pusher.endpoint) as receiver:
+            assert len(list(receiver.series(timeout=5.0))) == 2
+            assert len(list(receiver.series(timeout=5.0))) == 1
+            assert receiver.header.series == 2
+    assert pusher.sent == len(messages)
+
+
+def test_replay_from_saved_messages(zmq, tmpdir):
+    path = str(tmpdir.join("series.bin"))
+    messages = synthetic_series(nimages=3, shape=SHAPE, header_detail="all")
+    save_messages(path, messages)
+    assert load_messages(path) == messages
+    _, header, frames = replay(path)
+    assert header.detail == "all"
+    assert header.pixel_mask[0]["htype"] == "dpixelmask-1.0"
+    assert len(frames) == 3
+
+
+def test_callback_errors_do_not_stop_receiver(zmq):
+    received = []
+    done = threading.Event()
+
+    def callback(message):
+        if isinstance(message, Frame) and message.frame == 1:
+            raise ValueError("consumer failed")
+        received.append(message)
+        if isinstance(message, SeriesEnd):
+            done.set()
+
+    with ReplayPusher(synthetic_series(nimages=3, shape=SHAPE)) as pusher:
+        with StreamReceiver(pusher.endpoint, callback=callback) as receiver:
+            assert done.wait(5.0)
+            assert receiver.running
+    assert [getattr(m, "frame", None) for m in received] == \
+        [None, 0, 2, None]
+    assert receiver.errors == 1
+    assert isinstance(receiver.last_error, ValueError)
+
+
+def test_frame_verify_detects_corruption():
+    parts = synthetic_series(nimages=1, shape=SHAPE)[1]
+    frame = parse_message(parts)
+    assert frame.verify()
+    data = bytearray(parts[2])
+    data[0] ^= 0xff
+    parts[2] = bytes(data)
+    assert not parse_message(parts).verify()
+
+
+def test_parse_message_rejects_invalid_messages():
+    with pytest.raises(StreamError):
+        parse_message([b'{"htype": "dunknown-1.0"}'])
+    with pytest.raises(StreamError):
+        parse_message([b"not json"])
+
+
+def image(dtype):
+    rng = numpy.random.RandomState(0)
+    return rng.randint(0, 1000, (SHAPE[1], SHAPE[0])).astype(dtype)
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16", "uint32"])
+def test_decode_uncompressed(dtype):
+    expected = image(dtype)
+    decoded = decode_image(expected.tobytes(), SHAPE, dtype, "<")
+    assert (decoded == expected).all()
+
+
+@pytest.mark.parametrize("dtype", ["uint16", "uint32"])
+def test_decode_lz4_round_trip(dtype):
+    lz4_block = pytest.importorskip("lz4.block")
+    expected = image(dtype)
+    data = lz4_block.compress(expected.tobytes(), store_size=False)
+    decoded = decode_image(data, SHAPE, dtype, "lz4<")
+    assert (decoded == expected).all()
+
+
+@pytest.mark.parametrize("dtype", ["uint16", "uint32"])
+def test_decode_bitshuffle_lz4_round_trip(dtype):
+    bitshuffle = pytest.importorskip("bitshuffle")
+    expected = image(dtype)
+    itemsize = expected.dtype.itemsize
+    block = 8192 // itemsize
+    # the DCU's header: total size and block size in bytes, big endian
+    data = struct.pack(">QI", expected.nbytes, block * itemsize) + \
+        bitshuffle.compress_lz4(expected.ravel(), block).tobytes()
+    encoding = "bs{0}-lz4<".format(8 * itemsize)
+    decoded = decode_image(data, SHAPE, dtype, encoding)
+    assert (decoded == expected).all()
+    out = numpy.zeros_like(expected)
+    assert decode_image(data, SHAPE, dtype, encoding, out=out) is out
+    assert (out == expected).all()
+
+
+def test_decode_unknown_encoding():
+    with pytest.raises(StreamError):
+        decode_image(b"", SHAPE, "uint32", "gzip<")